@@ -1,4 +1,5 @@
 import math
+import heapq
 import numpy as np
 
 
@@ -14,7 +15,8 @@ class incStat:
         self.cur_mean = np.nan
         self.cur_var = np.nan
         self.cur_std = np.nan
-        self.covs = [] # a list of incStat_covs (references) with relate to this incStat
+        self.covs = dict() # the incStat_covs (references) with relate to this incStat, indexed by the ID of the other stream
+        self.queuedExpiry = np.inf # the expiry time its stream is queued under in its incStatDB's expiry heap
 
     def insert(self, v, t=0):  # v is a scalar, t is v's arrival the timestamp
         if self.isTypeDiff:
@@ -34,8 +36,11 @@ class incStat:
         self.cur_std = np.nan
 
         # update covs (if any)
-        for cov in self.covs:
+        for cov in self.covs.values():
             cov.update_cov(self.ID, v, t)
+        selfCov = self.covs.get(self.ID)
+        if selfCov is not None: # a stream linked to itself is on both sides of the link, so it is updated once per side
+            selfCov.update_cov(self.ID, v, t)
 
     def processDecay(self, timestamp):
         factor=1
@@ -52,6 +57,12 @@ class incStat:
     def weight(self):
         return self.w
 
+    # the time at which this stream's weight will have decayed to cutoffWeight (if it receives no more updates)
+    def expiryTime(self, cutoffWeight):
+        if self.w <= cutoffWeight:
+            return self.lastTimestamp
+        return self.lastTimestamp + math.log2(self.w / cutoffWeight) / self.Lambda
+
     def mean(self):
         if math.isnan(self.cur_mean):  # calculate it only once when necessary
             self.cur_mean = self.CF1 / self.w
@@ -67,22 +78,29 @@ class incStat:
             self.cur_std = math.sqrt(self.var())
         return self.cur_std
 
+    # the incStat_cov linking this stream with stream ID2 (None if there is none).
+    # A stream 'linked' with itself gets its first link, as it always has (every link of a stream includes the stream).
+    def get_cov(self,ID2):
+        if ID2 == self.ID and len(self.covs) > 0:
+            return next(iter(self.covs.values()))
+        return self.covs.get(ID2)
+
     def cov(self,ID2):
-        for cov in self.covs:
-            if cov.incStats[0].ID == ID2 or cov.incStats[1].ID == ID2:
-                return cov.cov()
+        cov = self.get_cov(ID2)
+        if cov is not None:
+            return cov.cov()
         return [np.nan]
 
     def pcc(self,ID2):
-        for cov in self.covs:
-            if cov.incStats[0].ID == ID2 or cov.incStats[1].ID == ID2:
-                return cov.pcc()
+        cov = self.get_cov(ID2)
+        if cov is not None:
+            return cov.pcc()
         return [np.nan]
 
     def cov_pcc(self,ID2):
-        for cov in self.covs:
-            if cov.incStats[0].ID == ID2 or cov.incStats[1].ID == ID2:
-                return cov.get_stats1()
+        cov = self.get_cov(ID2)
+        if cov is not None:
+            return cov.get_stats1()
         return [np.nan]*2
 
     def radius(self, other_incStats):  # the radius of a set of incStats
@@ -108,10 +126,9 @@ class incStat:
         stats1D = self.allstats_1D()
         # Find cov component
         stats2D = [np.nan] * 4
-        for cov in self.covs:
-            if cov.incStats[0].ID == ID2 or cov.incStats[1].ID == ID2:
-                stats2D = cov.get_stats2()
-                break
+        cov = self.get_cov(ID2)
+        if cov is not None:
+            stats2D = cov.get_stats2()
         return stats1D + stats2D
 
     def getHeaders_1D(self, suffix=True):
@@ -248,12 +265,26 @@ class incStat_cov:
         return headers
 
 
+# Records are keyed by (stream ID, Lambda). Stream IDs can be any hashable, e.g. the integers assigned by netStat's key interning.
+# Records are evicted by stream: all the records of a stream (its windows) go together, when the weight of its slowest
+# decaying window (the smallest Lambda, whose weight is the largest) falls below the cutoff, as with incStatDB_vec.
 class incStatDB:
     # default_lambda: use this as the lambda for all streams. If not specified, then you must supply a Lambda with every query.
-    def __init__(self,limit=np.Inf,default_lambda=np.nan):
+    # evict: if True, adding a record beyond the limit evicts the stream with the lowest (projected) weight instead of rejecting the observation
+    # cutoffWeight: the weight below which a stream is considered expired (see cleanOutOldRecords)
+    def __init__(self,limit=np.Inf,default_lambda=np.nan,evict=False,cutoffWeight=1e-3):
         self.HT = dict()
+        self.streams = dict() # stream ID -> its records, by Lambda
         self.limit = limit
         self.df_lambda = default_lambda
+        self.evict = evict
+        self.cutoffWeight = cutoffWeight
+        self.n_evicted = 0 # total number of records evicted so far
+        self.n_created = 0 # total number of records created so far
+        self.n_covs_created = 0 # total number of cov links created so far
+        # lazy min-heap of (expiry time, stream ID): the time at which each stream's weight falls below cutoffWeight.
+        # An entry is only a lower bound (updates push the expiry later), so it is re-checked and re-queued when popped.
+        self.expiries = []
 
     def get_lambda(self,Lambda):
         if not np.isnan(self.df_lambda):
@@ -261,20 +292,25 @@ class incStatDB:
         return Lambda
 
     # Registers a new stream. init_time: init lastTimestamp of the incStat
-    def register(self,ID,Lambda=1,init_time=0,isTypeDiff=False):
+    # keep: the ID of a stream which must not be evicted to make room for this one
+    def register(self,ID,Lambda=1,init_time=0,isTypeDiff=False,keep=None):
         #Default Lambda?
         Lambda = self.get_lambda(Lambda)
 
         #Retrieve incStat
-        key = ID+"_"+str(Lambda)
+        key = (ID, Lambda)
         incS = self.HT.get(key)
         if incS is None: #does not already exist
-            if len(self.HT) + 1 > self.limit:
-                raise LookupError(
-                    'Adding Entry:\n' + key + '\nwould exceed incStatHT 1D limit of ' + str(
-                        self.limit) + '.\nObservation Rejected.')
+            if len(self.HT) + 1 > self.limit: # (the stream's other windows may be registered already: it is kept too)
+                if not self.evict or self.evictLightest((ID, keep)) == 0:
+                    raise LookupError(
+                        'Adding Entry:\n' + str(key) + '\nwould exceed incStatHT 1D limit of ' + str(
+                            self.limit) + '.\nObservation Rejected.')
             incS = incStat(Lambda, ID, init_time, isTypeDiff)
             self.HT[key] = incS #add new entry
+            self.streams.setdefault(ID, dict())[Lambda] = incS
+            self.n_created += 1
+            self.__queue__(ID)
         return incS
 
     # Registers covariance tracking for two streams, registers missing streams
@@ -284,17 +320,18 @@ class incStatDB:
 
         # Lookup both streams
         incS1 = self.register(ID1,Lambda,init_time,isTypeDiff)
-        incS2 = self.register(ID2,Lambda,init_time,isTypeDiff)
+        incS2 = self.register(ID2,Lambda,init_time,isTypeDiff,keep=ID1)
 
         #check for pre-exiting link
-        for cov in incS1.covs:
-            if cov.incStats[0].ID == ID2 or cov.incStats[1].ID == ID2:
-                return cov #there is a pre-exiting link
+        cov = incS1.get_cov(ID2)
+        if cov is not None:
+            return cov #there is a pre-exiting link
 
         # Link incStats
         inc_cov = incStat_cov(incS1,incS2,init_time)
-        incS1.covs.append(inc_cov)
-        incS2.covs.append(inc_cov)
+        incS1.covs[ID2] = inc_cov
+        incS2.covs[ID1] = inc_cov
+        self.n_covs_created += 1
         return inc_cov
 
     # updates/registers stream
@@ -309,7 +346,7 @@ class incStatDB:
         Lambda = self.get_lambda(Lambda)
 
         #Get incStat
-        incS = self.HT.get(ID+"_"+str(Lambda))
+        incS = self.HT.get((ID, Lambda))
         if incS is None:  # does not already exist
             return [np.na]*3
         else:
@@ -321,7 +358,7 @@ class incStatDB:
         Lambda = self.get_lambda(Lambda)
 
         # Get incStat
-        incS1 = self.HT.get(ID1 + "_" + str(Lambda))
+        incS1 = self.HT.get((ID1, Lambda))
         if incS1 is None:  # does not exist
             return [np.na]*2
 
@@ -335,14 +372,14 @@ class incStatDB:
         Lambda = self.get_lambda(Lambda)
 
         # Get incStat
-        incS1 = self.HT.get(ID + "_" + str(Lambda))
+        incS1 = self.HT.get((ID, Lambda))
         if incS1 is None:  # does not exist
             return ([],[])
 
         # find relevant cov entry
         stats = []
         IDs = []
-        for cov in incS1.covs:
+        for cov in incS1.covs.values():
             stats.append(cov.get_stats1())
             IDs.append([cov.incStats[0].ID,cov.incStats[1].ID])
         return stats,IDs
@@ -355,7 +392,7 @@ class incStatDB:
         # Get incStats
         incStats = []
         for ID in IDs:
-            incS = self.HT.get(ID + "_" + str(Lambda))
+            incS = self.HT.get((ID, Lambda))
             if incS is not None:  #exists
                 incStats.append(incS)
 
@@ -423,20 +460,588 @@ class incStatDB:
         return [str(Lambda)+"_"+s for s in hdrs]
 
 
-    #cleans out records that have a weight less than the cutoff.
+    # Writes the state of the table to w (a checkpoint.checkpointWriter): its records, their cov links and the expiry heap.
+    # The records (and then the links) are written in chunks of columns, with each link written once, as the pair of
+    # indices of its records, followed by the links of each record (in order, as the partner's ID and the link's index)
+    def save_state(self, w):
+        w.write_object({'limit': self.limit, 'df_lambda': self.df_lambda, 'evict': self.evict, 'cutoffWeight': self.cutoffWeight,
+                        'n_evicted': self.n_evicted, 'n_created': self.n_created, 'n_covs_created': self.n_covs_created, 'n': len(self.HT)})
+        records = list(self.HT.values())
+        index = dict() # id(incStat) -> record index
+        covs = [] # the links, by index
+        cov_index = dict() # id(incStat_cov) -> link index
+        for i, incS in enumerate(records):
+            index[id(incS)] = i
+            for cov in incS.covs.values():
+                if id(cov) not in cov_index:
+                    cov_index[id(cov)] = len(covs)
+                    covs.append(cov)
+
+        for i in range(0, len(records), w.chunk):
+            chunk = records[i:i + w.chunk]
+            w.write_object([incS.ID for incS in chunk])
+            for name in ['Lambda', 'CF1', 'CF2', 'w', 'isTypeDiff', 'lastTimestamp', 'cur_mean', 'cur_var', 'cur_std', 'queuedExpiry']:
+                w.write_array([getattr(incS, name) for incS in chunk])
+        w.write_object(len(covs))
+        for i in range(0, len(covs), w.chunk):
+            chunk = covs[i:i + w.chunk]
+            w.write_array([[index[id(cov.incStats[0])], index[id(cov.incStats[1])]] for cov in chunk])
+            for name in ['lastRes', 'CF3', 'w3', 'lastTimestamp_cf3']:
+                w.write_array([getattr(cov, name) for cov in chunk])
+        for i in range(0, len(records), w.chunk):
+            chunk = records[i:i + w.chunk]
+            w.write_array([len(incS.covs) for incS in chunk])
+            w.write_object([ID2 for incS in chunk for ID2 in incS.covs])
+            w.write_array(np.array([cov_index[id(cov)] for incS in chunk for cov in incS.covs.values()], dtype=np.int64))
+        w.write_list(self.expiries)
+
+    # Restores the state written by save_state from r (a checkpoint.checkpointReader)
+    def load_state(self, r):
+        params = r.read_object()
+        self.limit, self.df_lambda, self.evict = params['limit'], params['df_lambda'], params['evict']
+        self.cutoffWeight, self.n_evicted = params['cutoffWeight'], params['n_evicted']
+        self.n_created, self.n_covs_created = params.get('n_created', 0), params.get('n_covs_created', 0)
+        self.HT = dict()
+        self.streams = dict()
+        records = []
+        while len(records) < params['n']:
+            IDs = r.read_object()
+            cols = [r.read_array().tolist() for _ in range(10)]
+            for ID, Lambda, CF1, CF2, w, isTypeDiff, lastTimestamp, cur_mean, cur_var, cur_std, queuedExpiry in zip(IDs, *cols):
+                incS = incStat(Lambda, ID, lastTimestamp, isTypeDiff)
+                incS.CF1, incS.CF2, incS.w = CF1, CF2, w
+                incS.cur_mean, incS.cur_var, incS.cur_std = cur_mean, cur_var, cur_std
+                incS.queuedExpiry = queuedExpiry
+                self.HT[(ID, Lambda)] = incS
+                self.streams.setdefault(ID, dict())[Lambda] = incS
+                records.append(incS)
+        n_covs = r.read_object()
+        covs = []
+        while len(covs) < n_covs:
+            pairs = r.read_array().tolist()
+            lastRes, CF3, w3, lastTimestamp_cf3 = [r.read_array().tolist() for _ in range(4)]
+            for (i1, i2), res, cf3, w_3, t in zip(pairs, lastRes, CF3, w3, lastTimestamp_cf3):
+                cov = incStat_cov(records[i1], records[i2], t)
+                cov.lastRes, cov.CF3, cov.w3 = res, cf3, w_3
+                covs.append(cov)
+        i = 0
+        while i < len(records):
+            counts = r.read_array().tolist()
+            partners = r.read_object()
+            links = r.read_array().tolist()
+            k = 0
+            for count in counts:
+                records[i].covs = {partners[j]: covs[links[j]] for j in range(k, k + count)}
+                k += count
+                i += 1
+        self.expiries = r.read_list()
+
+    # the time at which a stream's weight (that of its slowest decaying window) will have decayed to cutoffWeight
+    def expiryTime(self, ID):
+        records = self.streams[ID]
+        return records[min(records)].expiryTime(self.cutoffWeight)
+
+    # queues a stream in the expiry heap
+    def __queue__(self, ID):
+        expiry = self.expiryTime(ID)
+        for incS in self.streams[ID].values():
+            incS.queuedExpiry = expiry
+        heapq.heappush(self.expiries, (expiry, ID))
+
+    # removes all the records of a stream, and unlinks them from the cov trackers of their partner streams
+    def __remove__(self, ID):
+        for Lambda, incS in self.streams.pop(ID).items():
+            del self.HT[(ID, Lambda)]
+            for ID2, cov in incS.covs.items():
+                if ID2 != incS.ID:
+                    other = cov.incStats[1] if cov.incStats[0] is incS else cov.incStats[0]
+                    del other.covs[incS.ID]
+            incS.covs = dict()
+            self.n_evicted += 1
+
+    # pops the next live entry of the expiry heap, re-queueing entries whose stream has been updated since they were pushed.
+    # returns the ID of the stream with the earliest expiry (and its expiry time), or None if there are no streams
+    def __pop_expiry__(self, curTime=np.inf):
+        while self.expiries and self.expiries[0][0] <= curTime:
+            expiry, ID = heapq.heappop(self.expiries)
+            records = self.streams.get(ID)
+            if records is None or next(iter(records.values())).queuedExpiry != expiry: # stream was removed (or re-added) since this entry was pushed
+                continue
+            cur_expiry = self.expiryTime(ID)
+            if cur_expiry > expiry: # stream was updated since, so re-queue it
+                for incS in records.values():
+                    incS.queuedExpiry = cur_expiry
+                heapq.heappush(self.expiries, (cur_expiry, ID))
+                continue
+            return ID, expiry
+        return None
+
+    # rebuilds the expiry heap (e.g., after the cutoff weight has changed)
+    def __rebuild_expiries__(self):
+        self.expiries = []
+        for ID, records in self.streams.items():
+            expiry = self.expiryTime(ID)
+            for incS in records.values():
+                incS.queuedExpiry = expiry
+            self.expiries.append((expiry, ID))
+        heapq.heapify(self.expiries)
+
+    # evicts the stream with the lowest projected weight, other than the streams in 'keep'. Returns the number of removed records.
+    def evictLightest(self,keep=()):
+        kept = []
+        entry = self.__pop_expiry__()
+        while entry is not None and entry[0] in keep: # put it back (later) and take the next one
+            kept.append(entry)
+            entry = self.__pop_expiry__()
+        for ID, expiry in kept:
+            heapq.heappush(self.expiries, (expiry, ID))
+        if entry is None:
+            return 0
+        n = len(self.streams[entry[0]])
+        self.__remove__(entry[0])
+        return n
+
+    #cleans out the streams whose weight (in every window) is less than the cutoff.
     #returns number or removed records.
     def cleanOutOldRecords(self,cutoffWeight,curTime):
+        if cutoffWeight != self.cutoffWeight:
+            self.cutoffWeight = cutoffWeight
+            self.__rebuild_expiries__()
+        n = 0
+        entry = self.__pop_expiry__(curTime)
+        while entry is not None:
+            n += len(self.streams[entry[0]])
+            self.__remove__(entry[0])
+            entry = self.__pop_expiry__(curTime)
+        return n
+
+
+# Struct-of-arrays alternative to incStatDB.
+# Instead of one incStat object per (stream, Lambda), every stream owns one row in a set of contiguous NumPy arrays
+# holding CF1/CF2/w for ALL of its decay windows (Lambdas). Covariance links (incStat_cov) are stored the same way.
+# Decaying and inserting a value into every window of a stream, and updating all of the stream's cov links,
+# is then done with a handful of vectorized operations instead of a Python-level update per window.
+# All the windows of a stream are created and updated on the same packets, so they share one lastTimestamp.
+# The stats produced are incStatDB's up to rounding (the decays are computed with NumPy's exp2, not math.pow; see
+# benchmarks/parity.py), with its caching of mean/var/std between inserts, ordered window by window as netStat lays them
+# out when looping over incStatDB.
+class incStatDB_vec:
+    # Lambdas: the decay factors tracked for every stream
+    # limit: the maximum number of (stream, Lambda) records, as with incStatDB
+    # evict, cutoffWeight: as with incStatDB. A stream's weight is that of its slowest decaying window (its largest).
+    # init_size: the initial number of stream rows (and cov rows) to allocate. The arrays grow as needed.
+    def __init__(self, Lambdas, limit=np.Inf, evict=False, cutoffWeight=1e-3, init_size=1024):
+        self.HT = dict()  # stream ID -> row
+        self.limit = limit
+        self.Lambdas = np.array(Lambdas, dtype=float)
+        self.negLambdas = -self.Lambdas
+        L = len(self.Lambdas)
+        self.evict = evict
+        self.cutoffWeight = cutoffWeight
+        self.n_evicted = 0  # total number of streams evicted so far
+        self.n_created = 0  # total number of streams created so far
+        self.n_covs_created = 0  # total number of cov links created so far
+        self.expiries = []  # lazy min-heap of (expiry time, stream ID), see incStatDB
+        self.minLambda = int(np.argmin(self.Lambdas))  # the window with the largest weight
+
+        # streams (one row per stream). Rows of evicted streams are reused.
+        self.IDs = []  # row -> stream ID (None if the row is free)
+        self.freeRows = []
+        self.CF = np.zeros((init_size, 3, L))  # [linear sum, sum of squares, weight] for each window
+        self.lastTimestamp = np.zeros(init_size)
+        self.isTypeDiff = np.zeros(init_size, dtype=bool)
+        self.cur_mean = np.zeros((init_size, L))
+        self.cur_var = np.zeros((init_size, L))
+        self.cur_std = np.zeros((init_size, L))
+        self.cached = np.zeros(init_size, dtype=np.int8)  # 0: nothing cached, 1: mean, 2: mean+var, 3: mean+var+std
+        self.queuedExpiry = np.zeros(init_size)  # the expiry time each stream is queued under in the expiry heap
+        self.covs = []  # row -> the cov rows linked to this stream, indexed by the row of the other stream
+
+        # cov links (one row per link between two streams). Rows of unlinked covs are reused.
+        self.n_covs = 0
+        self.freeCovs = []
+        self.covStreams = np.zeros((init_size, 2), dtype=np.intp)  # the two stream rows of each link
+        self.covIncs = np.zeros((init_size, 1))  # number of updates a link gets per insert (2 if a stream is linked to itself)
+        self.CF3 = np.zeros((init_size, L))  # sum of residule products (A-uA)(B-uB)
+        self.w3 = np.zeros((init_size, L))
+        self.lastRes = np.zeros((init_size, 2, L))
+        self.lastTimestamp_cf3 = np.zeros(init_size)
+
+    # the arrays with one row per stream, and with one row per cov link
+    streamArrays = ['CF', 'lastTimestamp', 'isTypeDiff', 'cur_mean', 'cur_var', 'cur_std', 'cached', 'queuedExpiry']
+    covArrays = ['covStreams', 'covIncs', 'CF3', 'w3', 'lastRes', 'lastTimestamp_cf3']
+
+    def __grow_streams__(self):
+        for name in self.streamArrays:
+            arr = getattr(self, name)
+            setattr(self, name, np.concatenate((arr, np.zeros_like(arr))))
+
+    def __grow_covs__(self):
+        for name in self.covArrays:
+            arr = getattr(self, name)
+            setattr(self, name, np.concatenate((arr, np.zeros_like(arr))))
+
+    # Registers a new stream and returns its row. init_time: init lastTimestamp of the stream
+    # keep: the ID of a stream which must not be evicted to make room for this one
+    def register(self, ID, init_time=0, isTypeDiff=False, keep=None):
+        row = self.HT.get(ID)
+        if row is None: #does not already exist
+            if (len(self.HT) + 1) * len(self.Lambdas) > self.limit:
+                if not self.evict or self.evictLightest((keep,)) == 0:
+                    raise LookupError(
+                        'Adding Entry:\n' + str(ID) + '\nwould exceed incStatHT 1D limit of ' + str(
+                            self.limit) + '.\nObservation Rejected.')
+            if self.freeRows:
+                row = self.freeRows.pop()
+                self.IDs[row] = ID
+            else:
+                row = len(self.IDs)
+                if row == len(self.lastTimestamp):
+                    self.__grow_streams__()
+                self.IDs.append(ID)
+                self.covs.append(dict())
+            self.CF[row] = 0
+            self.CF[row, 2] = 1e-20
+            self.lastTimestamp[row] = init_time
+            self.isTypeDiff[row] = isTypeDiff
+            self.cached[row] = 0
+            self.HT[ID] = row #add new entry
+            self.n_created += 1
+            self.__queue__(ID, row)
+        return row
+
+    # Registers covariance tracking for two streams, registers missing streams. Returns the cov row.
+    def register_cov(self, ID1, ID2, init_time=0, isTypeDiff=False):
+        # Lookup both streams
+        row1 = self.register(ID1, init_time, isTypeDiff)
+        row2 = self.register(ID2, init_time, isTypeDiff, keep=ID1)
+
+        #check for pre-exiting link (a stream 'linked' with itself gets its first link, see incStat.get_cov)
+        if row1 == row2 and len(self.covs[row1]) > 0:
+            return next(iter(self.covs[row1].values()))
+        c = self.covs[row1].get(row2)
+        if c is not None:
+            return c #there is a pre-exiting link
+
+        # Link streams
+        if self.freeCovs:
+            c = self.freeCovs.pop()
+        else:
+            c = self.n_covs
+            if c == len(self.lastTimestamp_cf3):
+                self.__grow_covs__()
+            self.n_covs += 1
+        self.covStreams[c] = (row1, row2)
+        self.covIncs[c] = 1
+        self.CF3[c] = 0
+        self.w3[c] = 1e-20
+        self.lastRes[c] = 0
+        self.lastTimestamp_cf3[c] = init_time
+        self.covs[row1][row2] = c
+        self.covs[row2][row1] = c
+        if row2 == row1:
+            self.covIncs[c] = 2
+        self.n_covs_created += 1
+        return c
+
+    # the time at which the stream's weight will have decayed to cutoffWeight (if it receives no more updates)
+    def expiryTime(self, row):
+        w = self.CF[row, 2, self.minLambda]
+        if w <= self.cutoffWeight:
+            return self.lastTimestamp[row]
+        return self.lastTimestamp[row] + math.log2(w / self.cutoffWeight) / self.Lambdas[self.minLambda]
+
+    # queues a stream in the expiry heap
+    def __queue__(self, ID, row):
+        self.queuedExpiry[row] = self.expiryTime(row)
+        heapq.heappush(self.expiries, (self.queuedExpiry[row], ID))
+
+    # removes a stream, unlinks all of its cov trackers and frees their rows
+    def __remove__(self, ID):
+        row = self.HT.pop(ID)
+        for other, c in self.covs[row].items():
+            if other != row:
+                del self.covs[other][row]
+            self.freeCovs.append(c)
+        self.covs[row] = dict()
+        self.IDs[row] = None
+        self.freeRows.append(row)
+        self.n_evicted += 1
+
+    # pops the next live entry of the expiry heap (see incStatDB.__pop_expiry__)
+    def __pop_expiry__(self, curTime=np.inf):
+        while self.expiries and self.expiries[0][0] <= curTime:
+            expiry, ID = heapq.heappop(self.expiries)
+            row = self.HT.get(ID)
+            if row is None or self.queuedExpiry[row] != expiry:  # stream was removed (or re-added) since this entry was pushed
+                continue
+            cur_expiry = self.expiryTime(row)
+            if cur_expiry > expiry:  # stream was updated since, so re-queue it
+                self.queuedExpiry[row] = cur_expiry
+                heapq.heappush(self.expiries, (cur_expiry, ID))
+                continue
+            return ID, expiry
+        return None
+
+    # rebuilds the expiry heap (e.g., after the cutoff weight has changed)
+    def __rebuild_expiries__(self):
+        self.expiries = []
+        for ID, row in self.HT.items():
+            self.queuedExpiry[row] = self.expiryTime(row)
+            self.expiries.append((self.queuedExpiry[row], ID))
+        heapq.heapify(self.expiries)
+
+    # evicts the stream with the lowest projected weight, other than the streams in 'keep'. Returns the number of removed streams (0 or 1).
+    def evictLightest(self, keep=()):
+        kept = []
+        entry = self.__pop_expiry__()
+        while entry is not None and entry[0] in keep:  # put it back (later) and take the next one
+            kept.append(entry)
+            entry = self.__pop_expiry__()
+        for ID, expiry in kept:
+            heapq.heappush(self.expiries, (expiry, ID))
+        if entry is None:
+            return 0
+        self.__remove__(entry[0])
+        return 1
+
+    # cleans out streams whose weight (in every window) is less than the cutoff. Returns number of removed streams.
+    def cleanOutOldRecords(self, cutoffWeight, curTime):
+        if cutoffWeight != self.cutoffWeight:
+            self.cutoffWeight = cutoffWeight
+            self.__rebuild_expiries__()
         n = 0
-        dump = sorted(self.HT.items(), key=lambda tup: tup[1][0].getMaxW(curTime))
-        for entry in dump:
-            entry[1][0].processDecay(curTime)
-            W = entry[1][0].w
-            if W <= cutoffWeight:
-                key = entry[0]
-                del entry[1][0]
-                del self.HT[key]
-                n=n+1
-            elif W > cutoffWeight:
-                break
+        entry = self.__pop_expiry__(curTime)
+        while entry is not None:
+            self.__remove__(entry[0])
+            n = n + 1
+            entry = self.__pop_expiry__(curTime)
         return n
 
+    # Writes the state of the table to w (a checkpoint.checkpointWriter): the used rows of the stream and cov arrays are
+    # written as they are, followed by the links of each stream (in order, as the partner's row and the link's row)
+    def save_state(self, w):
+        n, n_covs = len(self.IDs), self.n_covs
+        w.write_object({'Lambdas': self.Lambdas.tolist(), 'limit': self.limit, 'evict': self.evict, 'cutoffWeight': self.cutoffWeight,
+                        'n_evicted': self.n_evicted, 'n_created': self.n_created, 'n_covs_created': self.n_covs_created, 'n': n, 'n_covs': n_covs})
+        w.write_list(self.IDs)
+        w.write_array(np.array(self.freeRows, dtype=np.int64))
+        w.write_array(np.array(self.freeCovs, dtype=np.int64))
+        for name in self.streamArrays:
+            w.write_array(getattr(self, name)[:n])
+        for name in self.covArrays:
+            w.write_array(getattr(self, name)[:n_covs])
+        for i in range(0, n, w.chunk):
+            chunk = self.covs[i:i + w.chunk]
+            w.write_array([len(covs) for covs in chunk])
+            w.write_array(np.array([other for covs in chunk for other in covs], dtype=np.int64))
+            w.write_array(np.array([c for covs in chunk for c in covs.values()], dtype=np.int64))
+        w.write_list(self.expiries)
+
+    # Restores the state written by save_state from r (a checkpoint.checkpointReader)
+    def load_state(self, r):
+        params = r.read_object()
+        if params['Lambdas'] != self.Lambdas.tolist():
+            raise ValueError("The checkpoint's table tracks the Lambdas " + str(params['Lambdas']) + ", not " + str(self.Lambdas.tolist()))
+        self.limit, self.evict, self.cutoffWeight, self.n_evicted = params['limit'], params['evict'], params['cutoffWeight'], params['n_evicted']
+        self.n_created, self.n_covs_created = params.get('n_created', 0), params.get('n_covs_created', 0)
+        n, n_covs = params['n'], params['n_covs']
+        self.IDs = r.read_list()
+        self.HT = {ID: row for row, ID in enumerate(self.IDs) if ID is not None}
+        self.freeRows = r.read_array().tolist()
+        self.freeCovs = r.read_array().tolist()
+        # the arrays keep (at least) their initial size, with room to grow
+        for names, used in [(self.streamArrays, n), (self.covArrays, n_covs)]:
+            for name in names:
+                arr = r.read_array()
+                size = max(len(getattr(self, name)), used)
+                setattr(self, name, np.zeros((size,) + arr.shape[1:], dtype=arr.dtype))
+                getattr(self, name)[:used] = arr
+        self.n_covs = n_covs
+        self.covs = []
+        while len(self.covs) < n:
+            counts = r.read_array().tolist()
+            others = r.read_array().tolist()
+            links = r.read_array().tolist()
+            k = 0
+            for count in counts:
+                self.covs.append({others[j]: links[j] for j in range(k, k + count)})
+                k += count
+        self.expiries = r.read_list()
+
+    # The decays and squares below are NumPy ufuncs over all the windows (and links) at once. They round differently from
+    # incStat's math.pow in the last place, so the features match incStatDB's to rounding, not bit for bit.
+
+    @staticmethod
+    def sq(x):
+        return x * x
+
+    # the decay factor of each window after timeDiff seconds
+    def decayFactors(self, timeDiff):
+        return np.exp2(self.negLambdas * timeDiff)
+
+    # the decay factors of each window for a vector of timeDiffs: a (len(timeDiffs) x len(Lambdas)) array
+    def decayFactors_n(self, timeDiffs):
+        return np.exp2(np.multiply.outer(timeDiffs, self.negLambdas))
+
+    def processDecay(self, row, timestamp):
+        # check for decay
+        timeDiff = timestamp - self.lastTimestamp[row]
+        if timeDiff > 0:
+            self.CF[row] *= self.decayFactors(timeDiff)  # broadcasts over CF1, CF2 and w
+            self.lastTimestamp[row] = timestamp
+
+    def insert(self, row, v, t=0):  # v is a scalar, t is v's arrival the timestamp
+        if self.isTypeDiff[row]:
+            dif = t - self.lastTimestamp[row]
+            if dif > 0:
+                v = dif
+            else:
+                v = 0
+        self.processDecay(row, t)
+
+        # update all windows with v
+        self.CF[row] += np.array(((v,), (v * v,), (1.,)))
+        self.cached[row] = 0  # force recalculation if called
+
+        # update covs (if any)
+        covs = self.covs[row]
+        if len(covs) == 1:
+            c = next(iter(covs.values()))
+            self.update_cov(c, row, v, t, self.covIncs[c, 0])
+        elif len(covs) > 1:
+            self.update_covs(np.fromiter(covs.values(), dtype=np.intp, count=len(covs)), row, v, t)
+
+    # updates a single cov link with (v,t) from stream 'row'. It is assumed that the stream has ALREADY been updated with (t,v)
+    def update_cov(self, c, row, v, t, n_updates=1):
+        inc = 0 if self.covStreams[c, 0] == row else 1
+
+        # Decay other stream
+        self.processDecay(self.covStreams[c, 1 - inc], t)
+
+        # Decay residules
+        timeDiffs_cf3 = t - self.lastTimestamp_cf3[c]
+        if timeDiffs_cf3 > 0:
+            factor = self.decayFactors(timeDiffs_cf3)
+            self.CF3[c] *= factor
+            self.w3[c] *= factor
+            self.lastTimestamp_cf3[c] = t
+            self.lastRes[c, inc] *= factor
+
+        # Compute and update residule
+        res = v - self.mean(row)
+        self.CF3[c] += res * self.lastRes[c, 1 - inc]
+        self.w3[c] += n_updates
+        self.lastRes[c, inc] = res
+
+    # same as update_cov, but updates all the given cov links (rows in 'covs') of stream 'row' at once
+    def update_covs(self, covs, row, v, t):
+        inc = (self.covStreams[covs, 0] != row).astype(np.intp)
+        other = self.covStreams[covs, 1 - inc]
+
+        # Decay other streams
+        timeDiffs = t - self.lastTimestamp[other]
+        decay = timeDiffs > 0
+        if decay.any():
+            other = other[decay]
+            self.CF[other] *= self.decayFactors_n(timeDiffs[decay])[:, None, :]
+            self.lastTimestamp[other] = t
+
+        # Decay residules
+        timeDiffs_cf3 = t - self.lastTimestamp_cf3[covs]
+        decay = timeDiffs_cf3 > 0
+        if decay.any():
+            c = covs[decay]
+            factor = self.decayFactors_n(timeDiffs_cf3[decay])
+            self.CF3[c] *= factor
+            self.w3[c] *= factor
+            self.lastTimestamp_cf3[c] = t
+            self.lastRes[c, inc[decay]] *= factor
+
+        # Compute and update residule
+        res = v - self.mean(row)
+        self.CF3[covs] += res * self.lastRes[covs, 1 - inc]
+        self.w3[covs] += self.covIncs[covs]
+        self.lastRes[covs, inc] = res
+
+    def mean(self, row):
+        if self.cached[row] < 1:  # calculate it only once when necessary
+            np.divide(self.CF[row, 0], self.CF[row, 2], out=self.cur_mean[row])
+            self.cached[row] = 1
+        return self.cur_mean[row]
+
+    def var(self, row):
+        if self.cached[row] < 2:  # calculate it only once when necessary
+            self.cur_var[row] = np.abs(self.CF[row, 1] / self.CF[row, 2] - self.sq(self.mean(row)))
+            self.cached[row] = 2
+        return self.cur_var[row]
+
+    def std(self, row):
+        if self.cached[row] < 3:  # calculate it only once when necessary
+            np.sqrt(self.var(row), out=self.cur_std[row])
+            self.cached[row] = 3
+        return self.cur_std[row]
+
+    #calculates and pulls all stats on this stream into out: a (len(Lambdas) x 3) array of [weight, mean, var] per window
+    def allstats_1D(self, row, out):
+        CF = self.CF[row]
+        np.divide(CF[0], CF[2], out=self.cur_mean[row])
+        self.cur_var[row] = np.abs(CF[1] / CF[2] - self.sq(self.cur_mean[row]))
+        self.cached[row] = max(self.cached[row], 2)
+        out[:, 0] = CF[2]
+        out[:, 1] = self.cur_mean[row]
+        out[:, 2] = self.cur_var[row]
+        return out
+
+    # calculates and pulls all correlative stats AND 2D stats from both streams of cov link c into out:
+    # a (len(Lambdas) x 4) array of [radius, magnitude, cov, pcc] per window
+    def get_stats2(self, c, out):
+        row1, row2 = self.covStreams[c]
+        out[:, 0] = np.sqrt(self.sq(self.var(row1)) + self.sq(self.var(row2)))
+        out[:, 1] = np.sqrt(self.sq(self.mean(row1)) + self.sq(self.mean(row2)))
+        np.divide(self.CF3[c], self.w3[c], out=out[:, 2])
+        ss = self.std(row1) * self.std(row2)
+        out[:, 3] = 0
+        np.divide(out[:, 2], ss, out=out[:, 3], where=ss != 0)
+        return out
+
+    # updates/registers stream
+    def update(self, ID, t, v, isTypeDiff=False):
+        row = self.register(ID, t, isTypeDiff)
+        self.insert(row, v, t)
+        return row
+
+    # Updates and then pulls current 1D stats of every window: [weight, mean, std] * len(Lambdas)
+    # out: optional contiguous array of 3*len(Lambdas) to write the stats into (e.g. a slice of a preallocated feature row)
+    def update_get_1D_Stats(self, ID, t, v, isTypeDiff=False, out=None):
+        if out is None:
+            out = np.empty(3 * len(self.Lambdas))
+        row = self.update(ID, t, v, isTypeDiff)
+        self.allstats_1D(row, out.reshape(len(self.Lambdas), 3))
+        return out
+
+    # Updates and then pulls current 1D and 2D stats of every window:
+    # [weight, mean, std, radius, magnitude, cov, pcc] * len(Lambdas)
+    # out: optional contiguous array of 7*len(Lambdas) to write the stats into
+    def update_get_1D2D_Stats(self, ID1, ID2, t1, v1, out=None):
+        if out is None:
+            out = np.empty(7 * len(self.Lambdas))
+        stats = out.reshape(len(self.Lambdas), 7)
+        row = self.update(ID1, t1, v1)
+        self.allstats_1D(row, stats[:, 0:3])
+        # retrieve/add cov tracker and update it
+        c = self.register_cov(ID1, ID2, t1)
+        self.update_cov(c, row, v1, t1)
+        self.get_stats2(c, stats[:, 3:7])
+        return out
+
+    def getHeaders_1D(self, Lambda=1, ID=None):
+        hdrs = incStat(Lambda, ID).getHeaders_1D(suffix=False)
+        return [str(Lambda) + "_" + s for s in hdrs]
+
+    def getHeaders_1D2D(self, Lambda=1, IDs=None, ver=1):
+        if IDs is None:
+            IDs = [0, 1]
+        hdrs1D = self.getHeaders_1D(Lambda, IDs[0])
+        hdrs2D = incStat_cov(incStat(Lambda, IDs[0]), incStat(Lambda, IDs[0]), Lambda).getHeaders(ver, suffix=False)
+        return hdrs1D + [str(Lambda) + "_" + s for s in hdrs2D]
@@ -10,30 +10,59 @@ if use_extrapolation:
         subprocess.call(cmd,shell=True)
 #Import dependencies
 import netStat as ns
+import pcapParser
 import csv
+import sys
 import numpy as np
-print("Importing Scapy Library")
-from scapy.all import *
-from scapy.layers.inet import IP, TCP, UDP, ICMP
-from scapy.layers.l2 import ARP
-from scapy.layers.inet6 import IPv6
+try:
+    print("Importing Scapy Library")
+    from scapy.all import *
+    from scapy.layers.inet import IP, TCP, UDP, ICMP
+    from scapy.layers.l2 import ARP
+    from scapy.layers.inet6 import IPv6
+except ImportError:
+    print("Scapy not found: pcap files will be parsed with tshark, or the native parser")
 import os.path
 import platform
 import subprocess
+import threading
+import io
+import itertools
+import time
+
+# the packet fields extracted by tshark (the columns of the tsv)
+tshark_fields = "-e frame.time_epoch -e frame.len -e eth.src -e eth.dst -e ip.src -e ip.dst -e tcp.srcport -e tcp.dstport -e udp.srcport -e udp.dstport -e icmp.type -e icmp.code -e arp.opcode -e arp.src.hw_mac -e arp.src.proto_ipv4 -e arp.dst.hw_mac -e arp.dst.proto_ipv4 -e ipv6.src -e ipv6.dst"
 
 
 
 #Extracts Kitsune features from given pcap file one packet at a time using "get_next_vector()"
 # If wireshark is installed (tshark) it is used to parse (it's faster), otherwise, scapy is used (much slower).
 # If wireshark is used then a tsv file (parsed version of the pcap) will be made -which you can use as your input next time
+# vectorized: use the struct-of-arrays AfterImage backend (same features, less CPU per packet). False uses the original incStatDB.
+# max_records: memory budget for each AfterImage hash table. When full, the record with the lowest weight is evicted.
+# cleanup_interval: every this many packets, AfterImage records whose weight decayed below cutoff_weight are evicted (0: never)
+# stat_config: a netStat.netStatConfig selecting the feature groups and the Lambdas of each (None: the full 100 features)
+# parser: how pcap/pcapng files are parsed:
+#         'tshark_pipe': tshark's output is consumed from a pipe as it is produced (no tsv file is written)
+#         'tshark': tshark writes a tsv copy of the capture (<file>.tsv) which is then read (and can be reused as the input next time)
+#         'native': pcapParser streams the capture (no tshark or scapy needed)
+#         'scapy': the whole capture is loaded with scapy (slow)
+#         'auto': tshark_pipe if tshark is installed, otherwise native
+# Use get_progress() for the fraction of the input read so far.
 class FE:
-    def __init__(self,file_path,limit=np.inf):
+    def __init__(self,file_path,limit=np.inf,vectorized=True,max_records=np.inf,cleanup_interval=0,cutoff_weight=1e-3,stat_config=None,parser='auto',dtype=np.float64):
         self.path = file_path
+        self.dtype = np.dtype(dtype) # of the feature vectors (AfterImage computes the stats in float64, and they are then converted)
         self.limit = limit
+        self.parser = parser
         self.parse_type = None #unknown
         self.curPacketIndx = 0
         self.tsvin = None #used for parsing TSV file
         self.scapyin = None #used for parsing pcap with scapy
+        self.pcapin = None #used for parsing pcap with the native parser
+        self.tshark = None #the tshark process (tshark_pipe)
+        self.bytes_fed = 0 #bytes of the capture fed to tshark so far (tshark_pipe)
+        self.profiler = None #a profiler.stageProfiler timing the 'parse' and 'features' stages of each packet (None: off)
 
         ### Prep pcap ##
         self.__prep__()
@@ -41,7 +70,7 @@ class FE:
         ### Prep Feature extractor (AfterImage) ###
         maxHost = 100000000000
         maxSess = 100000000000
-        self.nstat = ns.netStat(np.nan, maxHost, maxSess)
+        self.nstat = ns.netStat(np.nan, maxHost, maxSess, vectorized, max_records, cleanup_interval, cutoff_weight, stat_config)
 
     def _get_tshark_path(self):
         if platform.system() == 'Windows':
@@ -71,19 +100,24 @@ class FE:
         ##If file is pcap
         elif type == "pcap" or type == 'pcapng':
             # Try parsing via tshark dll of wireshark (faster)
-            if os.path.isfile(self._tshark):
+            if self.parser == 'tshark_pipe' or (self.parser == 'auto' and os.path.isfile(self._tshark)):
+                self.parse_type = "tshark_pipe"
+            elif self.parser == 'tshark':
                 self.pcap2tsv_with_tshark()  # creates local tsv file
                 self.path += ".tsv"
                 self.parse_type = "tsv"
-            else: # Otherwise, parse with scapy (slower)
-                print("tshark not found. Trying scapy...")
+            elif self.parser == 'scapy':
                 self.parse_type = "scapy"
+            else: # Otherwise, stream the packets with the native parser
+                if self.parser == 'auto':
+                    print("tshark not found. Using the native pcap parser...")
+                self.parse_type = "pcap"
         else:
             print("File: " + self.path + " is not a tsv or pcap file")
             raise Exception()
 
         ### open readers ##
-        if self.parse_type == "tsv":
+        if self.parse_type == "tsv" or self.parse_type == "tshark_pipe":
             maxInt = sys.maxsize
             decrement = True
             while decrement:
@@ -96,13 +130,18 @@ class FE:
                     maxInt = int(maxInt / 10)
                     decrement = True
 
-            print("counting lines in file...")
-            num_lines = sum(1 for line in open(self.path))
-            print("There are " + str(num_lines) + " Packets.")
-            self.limit = min(self.limit, num_lines-1)
-            self.tsvinf = open(self.path, 'rt', encoding="utf8")
+            # the rows are streamed: the number of packets is not known in advance (the end of the input is detected when reached)
+            if self.parse_type == "tsv":
+                self.tsvinf = open(self.path, 'rt', encoding="utf8")
+            else:
+                self.tsvinf = self.open_tshark_pipe()
             self.tsvin = csv.reader(self.tsvinf, delimiter='\t')
-            row = self.tsvin.__next__() #move iterator past header
+            row = next(self.tsvin, None) #move iterator past header
+            self.parse_type = "tsv"
+
+        elif self.parse_type == "pcap": # streamed: the number of packets is not known in advance
+            self.pcapf = open(self.path, 'rb')
+            self.pcapin = pcapParser.read_file(self.pcapf, self.path)
 
         else: # scapy
             print("Reading PCAP file via Scapy...")
@@ -110,47 +149,31 @@ class FE:
             self.limit = len(self.scapyin)
             print("Loaded " + str(len(self.scapyin)) + " Packets.")
 
-    def get_next_vector(self):
+    # out: optional preallocated feature vector (e.g. a row of a batch matrix) to write the features into.
+    # Note: when out is given, the returned vector is out itself, and is overwritten by the next call which reuses it.
+    def get_next_vector(self, out=None):
+        if out is None:
+            out = np.empty(self.get_num_features(), dtype=self.dtype)
         if self.curPacketIndx == self.limit:
-            if self.parse_type == 'tsv':
-                self.tsvinf.close()
+            self.close()
             return []
+        if self.profiler is not None:
+            t0 = time.perf_counter_ns()
 
         ### Parse next packet ###
         if self.parse_type == "tsv":
-            row = self.tsvin.__next__()
-            IPtype = np.nan
-            timestamp = row[0]
-            framelen = row[1]
-            srcIP = ''
-            dstIP = ''
-            if row[4] != '':  # IPv4
-                srcIP = row[4]
-                dstIP = row[5]
-                IPtype = 0
-            elif row[17] != '':  # ipv6
-                srcIP = row[17]
-                dstIP = row[18]
-                IPtype = 1
-            srcproto = row[6] + row[
-                8]  # UDP or TCP port: the concatenation of the two port strings will will results in an OR "[tcp|udp]"
-            dstproto = row[7] + row[9]  # UDP or TCP port
-            srcMAC = row[2]
-            dstMAC = row[3]
-            if srcproto == '':  # it's a L2/L1 level protocol
-                if row[12] != '':  # is ARP
-                    srcproto = 'arp'
-                    dstproto = 'arp'
-                    srcIP = row[14]  # src IP (ARP)
-                    dstIP = row[16]  # dst IP (ARP)
-                    IPtype = 0
-                elif row[10] != '':  # is ICMP
-                    srcproto = 'icmp'
-                    dstproto = 'icmp'
-                    IPtype = 0
-                elif srcIP + srcproto + dstIP + dstproto == '':  # some other protocol
-                    srcIP = row[2]  # src MAC
-                    dstIP = row[3]  # dst MAC
+            row = next(self.tsvin, None) if not self.tsvinf.closed else None
+            if row is None: # end of input
+                self.close()
+                return []
+            IPtype, timestamp, framelen, srcMAC, dstMAC, srcIP, srcproto, dstIP, dstproto = self.parse_tsv_row(row)
+
+        elif self.parse_type == "pcap":
+            row = next(self.pcapin, None)
+            if row is None: # end of capture
+                self.close()
+                return []
+            IPtype, timestamp, framelen, srcMAC, dstMAC, srcIP, srcproto, dstIP, dstproto = self.parse_tsv_row(row)
 
         elif self.parse_type == "scapy":
             packet = self.scapyin[self.curPacketIndx]
@@ -199,24 +222,164 @@ class FE:
             return []
 
         self.curPacketIndx = self.curPacketIndx + 1
+        if self.profiler is not None:
+            t1 = time.perf_counter_ns()
+            self.profiler.add('parse', t1 - t0)
 
 
         ### Extract Features
         try:
-            return self.nstat.updateGetStats(IPtype, srcMAC, dstMAC, srcIP, srcproto, dstIP, dstproto,
+            x = self.nstat.updateGetStats(IPtype, srcMAC, dstMAC, srcIP, srcproto, dstIP, dstproto,
                                                  int(framelen),
-                                                 float(timestamp))
+                                                 float(timestamp), out)
         except Exception as e:
             print(e)
             return []
+        if self.profiler is not None:
+            self.profiler.add('features', time.perf_counter_ns() - t1)
+        return x
 
 
+    # Extracts the features of the next n packets into an (n x num_features) array, one row per packet.
+    # out: optional preallocated array (of at least n rows) which is filled in place
+    # Returns the rows filled: fewer than n when the input (or the packet limit) ends, and none when no packets are left.
+    def get_next_vectors(self, n, out=None):
+        if out is None:
+            out = np.empty((n, self.get_num_features()), dtype=self.dtype)
+        i = 0
+        while i < n:
+            if len(self.get_next_vector(out[i])) == 0: #Error or no packets left
+                break
+            i += 1
+        return out[:i]
+
+    # Resolves the packet fields of a row of tshark TSV fields (or pcapParser packet)
+    def parse_tsv_row(self, row):
+        IPtype = np.nan
+        timestamp = row[0]
+        framelen = row[1]
+        srcIP = ''
+        dstIP = ''
+        if row[4] != '':  # IPv4
+            srcIP = row[4]
+            dstIP = row[5]
+            IPtype = 0
+        elif row[17] != '':  # ipv6
+            srcIP = row[17]
+            dstIP = row[18]
+            IPtype = 1
+        srcproto = row[6] + row[
+            8]  # UDP or TCP port: the concatenation of the two port strings will will results in an OR "[tcp|udp]"
+        dstproto = row[7] + row[9]  # UDP or TCP port
+        srcMAC = row[2]
+        dstMAC = row[3]
+        if srcproto == '':  # it's a L2/L1 level protocol
+            if row[12] != '':  # is ARP
+                srcproto = 'arp'
+                dstproto = 'arp'
+                srcIP = row[14]  # src IP (ARP)
+                dstIP = row[16]  # dst IP (ARP)
+                IPtype = 0
+            elif row[10] != '':  # is ICMP
+                srcproto = 'icmp'
+                dstproto = 'icmp'
+                IPtype = 0
+            elif srcIP + srcproto + dstIP + dstproto == '':  # some other protocol
+                srcIP = row[2]  # src MAC
+                dstIP = row[3]  # dst MAC
+        return IPtype, timestamp, framelen, srcMAC, dstMAC, srcIP, srcproto, dstIP, dstproto
+
     def pcap2tsv_with_tshark(self):
         print('Parsing with tshark...')
-        fields = "-e frame.time_epoch -e frame.len -e eth.src -e eth.dst -e ip.src -e ip.dst -e tcp.srcport -e tcp.dstport -e udp.srcport -e udp.dstport -e icmp.type -e icmp.code -e arp.opcode -e arp.src.hw_mac -e arp.src.proto_ipv4 -e arp.dst.hw_mac -e arp.dst.proto_ipv4 -e ipv6.src -e ipv6.dst"
-        cmd =  '"' + self._tshark + '" -r '+ self.path +' -T fields '+ fields +' -E header=y -E occurrence=f > '+self.path+".tsv"
+        cmd =  '"' + self._tshark + '" -r '+ self.path +' -T fields '+ tshark_fields +' -E header=y -E occurrence=f > '+self.path+".tsv"
         subprocess.call(cmd,shell=True)
         print("tshark parsing complete. File saved as: "+self.path +".tsv")
 
+    # Starts tshark on the capture, and returns its (text) output stream of tsv rows.
+    # The capture is fed to tshark's stdin by a background thread, so the bytes fed measure the progress, and
+    # features can be extracted from the rows while tshark is still dissecting the rest of the capture.
+    def open_tshark_pipe(self):
+        print('Parsing with tshark (piped)...')
+        cmd = [self._tshark, '-r', '-', '-T', 'fields'] + tshark_fields.split() + ['-E', 'header=y', '-E', 'occurrence=f']
+        if self.limit < np.inf:
+            cmd += ['-c', str(int(self.limit))] # tshark stops dissecting at the limit
+        self.tshark = subprocess.Popen(cmd, stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+        self.feeder = threading.Thread(target=self.feed_tshark, daemon=True)
+        self.feeder.start()
+        return io.TextIOWrapper(self.tshark.stdout, encoding="utf8")
+
+    def feed_tshark(self):
+        try:
+            with open(self.path, 'rb') as f:
+                while True:
+                    chunk = f.read(1 << 16)
+                    if not chunk:
+                        break
+                    self.tshark.stdin.write(chunk)
+                    self.bytes_fed += len(chunk)
+        except (BrokenPipeError, ValueError, OSError): # tshark exited (e.g., the limit was reached) or was closed
+            pass
+        finally:
+            try:
+                self.tshark.stdin.close()
+            except (BrokenPipeError, OSError):
+                pass
+
+    # Writes the state of the feature extractor to w (a checkpoint.checkpointWriter): the position in the input, and the
+    # complete state of AfterImage (netStat)
+    def save_state(self, w):
+        offset = None # the offset of the next packet's record (native pcap parser)
+        if self.parse_type == "pcap" and not self.pcapf.closed:
+            offset = self.pcapf.tell()
+        w.write_object({'size': os.path.getsize(self.path), 'parse_type': self.parse_type, 'curPacketIndx': self.curPacketIndx, 'offset': offset})
+        self.nstat.save_state(w)
+
+    # Restores the state written by save_state from r (a checkpoint.checkpointReader), and resumes the input from the
+    # packet after the last one read (the input must be the same file). AfterImage is restored with its saved configuration
+    def load_state(self, r):
+        params = r.read_object()
+        if params['size'] != os.path.getsize(self.path) or params['parse_type'] != self.parse_type:
+            raise ValueError("The checkpoint was not taken on the input " + self.path)
+        self.nstat = ns.load_netStat(r)
+        self.seek(params['curPacketIndx'], params['offset'])
+
+    # Moves the input (freshly opened) to packet number indx. offset: the offset of the packet's record in a pcap/pcapng
+    # file, if known (the native parser then seeks to it). Otherwise, the packets before it are read and skipped
+    def seek(self, indx, offset=None):
+        if self.parse_type == "pcap" and offset is not None:
+            self.pcapin.close()
+            self.pcapf.seek(0)
+            self.pcapin = pcapParser.read_file(self.pcapf, self.path, offset)
+        elif self.parse_type == "tsv" or self.parse_type == "pcap":
+            rows = self.tsvin if self.parse_type == "tsv" else self.pcapin
+            n = indx - self.curPacketIndx
+            if sum(1 for _ in itertools.islice(rows, n)) < n:
+                raise ValueError("The input ended before packet " + str(indx))
+        self.curPacketIndx = indx
+
+    # The fraction [0,1] of the input which has been read so far
+    def get_progress(self):
+        if self.parse_type == "scapy":
+            return self.curPacketIndx / max(len(self.scapyin), 1)
+        size = max(os.path.getsize(self.path), 1)
+        if self.tshark is not None:
+            return min(self.bytes_fed / size, 1.0)
+        if self.parse_type == "tsv" and not self.tsvinf.closed:
+            return min(self.tsvinf.buffer.tell() / size, 1.0)
+        if self.parse_type == "pcap" and not self.pcapf.closed:
+            return min(self.pcapf.tell() / size, 1.0)
+        return 1.0
+
+    # Closes the input (and stops tshark if it is still running)
+    def close(self):
+        if self.parse_type == "tsv" and not self.tsvinf.closed:
+            self.tsvinf.close()
+        elif self.parse_type == "pcap" and not self.pcapf.closed:
+            self.pcapin.close()
+            self.pcapf.close()
+        if self.tshark is not None and self.tshark.poll() is None:
+            self.tshark.kill()
+            self.tshark.wait()
+
     def get_num_features(self):
-        return len(self.nstat.getNetStatHeaders())
+        return self.nstat.n_features # (the number of netStat headers)
@@ -1,12 +1,17 @@
+import time
 import numpy as np
 import KitNET.dA as AE
 import KitNET.corClust as CC
+import KitNET.ensemble as ENS
 
 # This class represents a KitNET machine learner.
 # KitNET is a lightweight online anomaly detection algorithm based on an ensemble of autoencoders.
 # For more information and citation, please see our NDSS'18 paper: Kitsune: An Ensemble of Autoencoders for Online Network Intrusion Detection
 # For licensing information, see the end of this document
 
+# the version of the model format written by KitNET.save
+FORMAT_VERSION = 2
+
 class KitNET:
     #n: the number of features in your input dataset (i.e., x \in R^n)
     #m: the maximum size of any autoencoder in the ensemble layer
@@ -17,7 +22,16 @@ class KitNET:
     #feature_map: One may optionally provide a feature map instead of learning one. The map must be a list,
     #           where the i-th entry contains a list of the feature indices to be assingned to the i-th autoencoder in the ensemble.
     #           For example, [[2,5,3],[4,0,1],[6,7]]
-    def __init__(self,n,max_autoencoder_size=10,FM_grace_period=None,AD_grace_period=10000,learning_rate=0.1,hidden_ratio=0.75, feature_map = None):
+    #fused: if True, the ensemble layer is trained and executed as one fusedEnsemble (same scores, fewer NumPy calls per instance)
+    #           instead of one autoencoder at a time
+    #batch_size: the autoencoders are trained with mini-batches of this many instances during the AD grace period: one SGD step
+    #           on the averaged gradient of each batch (see dA.train_batch). 1: one step per instance (the original algorithm)
+    #           Since there are batch_size times fewer steps, scale the learning_rate with it (e.g., batch_size=8 with learning_rate=0.8)
+    #FM_batch_size: during the FM grace period, the instances are buffered and folded into the feature mapper's correlation matrix
+    #           this many at a time (see corClust.update_batch), with the same incremental mean. 1: one update per instance
+    #dtype: the floating point type of the weights and of the computations (np.float64 or np.float32). The instances are
+    #           converted to it, and the anomaly scores are of this type. np.float32 halves the memory traffic, at some accuracy
+    def __init__(self,n,max_autoencoder_size=10,FM_grace_period=None,AD_grace_period=10000,learning_rate=0.1,hidden_ratio=0.75, feature_map = None, fused=True, batch_size=1, FM_batch_size=64, dtype=np.float64):
         # Parameters:
         self.AD_grace_period = AD_grace_period
         if FM_grace_period is None:
@@ -31,19 +45,27 @@ class KitNET:
         self.lr = learning_rate
         self.hr = hidden_ratio
         self.n = n
+        self.fused = fused
+        self.batch_size = max(int(batch_size), 1)
+        self.FM_batch_size = max(int(FM_batch_size), 1)
+        self.dtype = np.dtype(dtype)
 
         # Variables
         self.n_trained = 0 # the number of training instances so far
         self.n_executed = 0 # the number of executed instances so far
         self.v = feature_map
+        self.FM = CC.corClust(self.n,self.dtype) #incremental feature cluatering for the feature mapping process
+        self.ensembleLayer = []
+        self.ensemble = None # the fusedEnsemble of the ensembleLayer (if fused)
+        self.outputLayer = None
+        self.batch = None # the instances buffered for the next mini-batch (if batch_size > 1), or feature mapper update
+        self.n_batch = 0
+        self.profiler = None # a profiler.stageProfiler timing the 'FM update', 'ensemble' and 'output layer' stages (None: off)
         if self.v is None:
             print("Feature-Mapper: train-mode, Anomaly-Detector: off-mode")
         else:
             self.__createAD__()
             print("Feature-Mapper: execute-mode, Anomaly-Detector: train-mode")
-        self.FM = CC.corClust(self.n) #incremental feature cluatering for the feature mapping process
-        self.ensembleLayer = []
-        self.outputLayer = None
 
     #If FM_grace_period+AM_grace_period has passed, then this function executes KitNET on x. Otherwise, this function learns from x.
     #x: a numpy array of length n
@@ -58,52 +80,233 @@ class KitNET:
     #force train KitNET on x
     #returns the anomaly score of x during training (do not use for alerting)
     def train(self,x):
+        x = np.asarray(x,dtype=self.dtype)
+        prof = self.profiler
         if self.n_trained <= self.FM_grace_period and self.v is None: #If the FM is in train-mode, and the user has not supplied a feature mapping
+            if prof is not None:
+                t0 = time.perf_counter_ns()
             #update the incremetnal correlation matrix
-            self.FM.update(x)
+            if self.FM_batch_size > 1:
+                self.__buffer__(x)
+                if self.n_batch == self.FM_batch_size or self.n_trained == self.FM_grace_period:
+                    self.FM.update_batch(self.batch[:self.n_batch])
+                    self.n_batch = 0
+            else:
+                self.FM.update(x)
             if self.n_trained == self.FM_grace_period: #If the feature mapping should be instantiated
                 self.v = self.FM.cluster(self.m)
                 self.__createAD__()
                 print("The Feature-Mapper found a mapping: "+str(self.n)+" features to "+str(len(self.v))+" autoencoders.")
                 print("Feature-Mapper: execute-mode, Anomaly-Detector: train-mode")
+            if prof is not None:
+                prof.add('FM update', time.perf_counter_ns() - t0)
+        elif self.batch_size > 1: #buffer for mini-batch training
+            self.__buffer__(x)
+            # train when the batch is full, or the grace period ends
+            if self.n_batch == self.batch_size or self.n_trained >= self.AD_grace_period+self.FM_grace_period:
+                self.train_batch(self.batch[:self.n_batch])
+                self.n_batch = 0
+            if self.n_trained == self.AD_grace_period+self.FM_grace_period:
+                print("Feature-Mapper: execute-mode, Anomaly-Detector: execute-mode")
         else: #train
+            if prof is not None:
+                t0 = time.perf_counter_ns()
             ## Ensemble Layer
-            S_l1 = np.zeros(len(self.ensembleLayer))
-            for a in range(len(self.ensembleLayer)):
-                # make sub instance for autoencoder 'a'
-                xi = x[self.v[a]]
-                S_l1[a] = self.ensembleLayer[a].train(xi)
+            if self.ensemble is not None:
+                S_l1 = self.ensemble.train(x)
+            else:
+                S_l1 = np.zeros(len(self.ensembleLayer),dtype=self.dtype)
+                for a in range(len(self.ensembleLayer)):
+                    # make sub instance for autoencoder 'a'
+                    xi = x[self.v[a]]
+                    S_l1[a] = self.ensembleLayer[a].train(xi)
+            if prof is not None:
+                t1 = time.perf_counter_ns()
+                prof.add('ensemble', t1 - t0)
             ## OutputLayer
             self.outputLayer.train(S_l1)
+            if prof is not None:
+                prof.add('output layer', time.perf_counter_ns() - t1)
             if self.n_trained == self.AD_grace_period+self.FM_grace_period:
                 print("Feature-Mapper: execute-mode, Anomaly-Detector: execute-mode")
         self.n_trained += 1
 
+    #force train the autoencoders (AD) on the rows of X (an N x n matrix) as one mini-batch
+    #returns the anomaly scores of X during training (do not use for alerting)
+    #Note: does not count towards n_trained (train does)
+    def train_batch(self,X):
+        if self.v is None:
+            raise RuntimeError('KitNET Cannot train on X, because a feature mapping has not yet been learned or provided.')
+        X = np.asarray(X,dtype=self.dtype)
+        prof = self.profiler
+        if prof is not None:
+            t0 = time.perf_counter_ns()
+        ## Ensemble Layer
+        if self.ensemble is not None:
+            S_l1 = self.ensemble.train_batch(X)
+        else:
+            S_l1 = np.zeros((len(X),len(self.ensembleLayer)),dtype=self.dtype)
+            for a in range(len(self.ensembleLayer)):
+                S_l1[:,a] = self.ensembleLayer[a].train_batch(X[:,self.v[a]])
+        if prof is not None:
+            t1 = time.perf_counter_ns()
+            prof.add('ensemble', t1 - t0, len(X))
+        ## OutputLayer
+        S = self.outputLayer.train_batch(S_l1)
+        if prof is not None:
+            prof.add('output layer', time.perf_counter_ns() - t1, len(X))
+        return S
+
     #force execute KitNET on x
     def execute(self,x):
         if self.v is None:
             raise RuntimeError('KitNET Cannot execute x, because a feature mapping has not yet been learned or provided. Try running process(x) instead.')
         else:
             self.n_executed += 1
+            x = np.asarray(x,dtype=self.dtype)
+            prof = self.profiler
+            if prof is not None:
+                t0 = time.perf_counter_ns()
             ## Ensemble Layer
-            S_l1 = np.zeros(len(self.ensembleLayer))
-            for a in range(len(self.ensembleLayer)):
-                # make sub inst
-                xi = x[self.v[a]]
-                S_l1[a] = self.ensembleLayer[a].execute(xi)
+            if self.ensemble is not None:
+                S_l1 = self.ensemble.execute(x)
+            else:
+                S_l1 = np.zeros(len(self.ensembleLayer),dtype=self.dtype)
+                for a in range(len(self.ensembleLayer)):
+                    # make sub inst
+                    xi = x[self.v[a]]
+                    S_l1[a] = self.ensembleLayer[a].execute(xi)
+            if prof is not None:
+                t1 = time.perf_counter_ns()
+                prof.add('ensemble', t1 - t0)
             ## OutputLayer
-            return self.outputLayer.execute(S_l1)
+            score = self.outputLayer.execute(S_l1)
+            if prof is not None:
+                prof.add('output layer', time.perf_counter_ns() - t1)
+            return score
+
+    #execute KitNET on each row of X (an N x n matrix) with matrix-matrix products through every autoencoder
+    #returns the N anomaly scores. Same as execute on each row, up to floating point rounding (dA.execute is the reference)
+    def execute_batch(self,X):
+        if self.v is None:
+            raise RuntimeError('KitNET Cannot execute X, because a feature mapping has not yet been learned or provided. Try running process(x) instead.')
+        else:
+            self.n_executed += len(X)
+            X = np.asarray(X,dtype=self.dtype)
+            prof = self.profiler
+            if prof is not None:
+                t0 = time.perf_counter_ns()
+            ## Ensemble Layer
+            if self.ensemble is not None:
+                S_l1 = self.ensemble.execute_batch(X)
+            else:
+                S_l1 = np.zeros((len(X),len(self.ensembleLayer)),dtype=self.dtype)
+                for a in range(len(self.ensembleLayer)):
+                    S_l1[:,a] = self.ensembleLayer[a].execute_batch(X[:,self.v[a]])
+            if prof is not None:
+                t1 = time.perf_counter_ns()
+                prof.add('ensemble', t1 - t0, len(X))
+            ## OutputLayer
+            scores = self.outputLayer.execute_batch(S_l1)
+            if prof is not None:
+                prof.add('output layer', time.perf_counter_ns() - t1, len(X))
+            return scores
+
+    #process each row of X (an N x n matrix) in order, as process does: the rows during the grace periods are trained on
+    #one at a time, and all the rest are executed in one batch (execute_batch). Returns the N anomaly scores
+    def process_batch(self,X):
+        scores = np.zeros(len(X),dtype=self.dtype)
+        i = 0
+        while i < len(X) and self.n_trained <= self.FM_grace_period + self.AD_grace_period:
+            scores[i] = self.process(X[i])
+            i += 1
+        if i < len(X):
+            scores[i:] = self.execute_batch(X[i:])
+        return scores
+
+    #saves the KitNET (its parameters, feature map, weights and counters) to f: a file path or a binary file object
+    #the model is a versioned .npz archive (see load). A trained model can be reloaded and executed without a grace period
+    def save(self,f):
+        arrays = {'kitnet_format': np.array([FORMAT_VERSION]),
+                  'config': np.array([self.n, self.m, self.FM_grace_period, self.AD_grace_period, self.lr,
+                                      np.nan if self.hr is None else self.hr, self.batch_size, self.FM_batch_size]),
+                  'counters': np.array([self.n_trained, self.n_executed], dtype=np.int64),
+                  'dtype': np.array(self.dtype.name)}
+        if self.v is None: #the feature mapper is still learning
+            arrays.update({'fm_c': self.FM.c, 'fm_c_r': self.FM.c_r, 'fm_c_rs': self.FM.c_rs, 'fm_C': self.FM.C,
+                           'fm_N': np.array([self.FM.N], dtype=np.int64)})
+        else:
+            arrays['v_index'] = np.concatenate([np.asarray(map, dtype=np.int64) for map in self.v])
+            arrays['v_sizes'] = np.array([len(map) for map in self.v], dtype=np.int64)
+            for a, dA in enumerate(self.ensembleLayer + [self.outputLayer]):
+                name = 'out' if a == len(self.ensembleLayer) else 'ae' + str(a)
+                arrays.update({name + '_W': dA.W, name + '_hbias': dA.hbias, name + '_vbias': dA.vbias,
+                               name + '_norm_min': dA.norm_min, name + '_norm_max': dA.norm_max,
+                               name + '_n': np.array([dA.n], dtype=np.int64)})
+        if self.n_batch > 0: #a partially filled mini-batch (or feature mapper update)
+            arrays['batch'] = self.batch[:self.n_batch]
+        if isinstance(f, str):
+            with open(f, 'wb') as file: #(np.savez would append .npz to the path)
+                np.savez_compressed(file, **arrays)
+        else:
+            np.savez_compressed(f, **arrays)
+
+    #appends x to the buffered instances
+    def __buffer__(self,x):
+        if self.batch is None:
+            self.batch = np.empty((max(self.batch_size, self.FM_batch_size), self.n),dtype=self.dtype)
+        self.batch[self.n_batch] = x
+        self.n_batch += 1
 
     def __createAD__(self):
         # construct ensemble layer
         for map in self.v:
-            params = AE.dA_params(n_visible=len(map), n_hidden=0, lr=self.lr, corruption_level=0, gracePeriod=0, hiddenRatio=self.hr)
+            params = AE.dA_params(n_visible=len(map), n_hidden=0, lr=self.lr, corruption_level=0, gracePeriod=0, hiddenRatio=self.hr, dtype=self.dtype)
             self.ensembleLayer.append(AE.dA(params))
+        if self.fused and ENS.fusedEnsemble.supports(self.ensembleLayer):
+            self.ensemble = ENS.fusedEnsemble(self.ensembleLayer, self.v)
 
         # construct output layer
-        params = AE.dA_params(len(self.v), n_hidden=0, lr=self.lr, corruption_level=0, gracePeriod=0, hiddenRatio=self.hr)
+        params = AE.dA_params(len(self.v), n_hidden=0, lr=self.lr, corruption_level=0, gracePeriod=0, hiddenRatio=self.hr, dtype=self.dtype)
         self.outputLayer = AE.dA(params)
 
+#loads a KitNET saved with KitNET.save from f (a file path or a binary file object)
+#fused: as in KitNET (not part of the model, since both paths give the same scores)
+def load(f,fused=True):
+    with np.load(f) as z:
+        if 'kitnet_format' not in z.files:
+            raise ValueError("Not a KitNET model: missing the format version")
+        version = int(z['kitnet_format'][0])
+        if version > FORMAT_VERSION:
+            raise ValueError("KitNET model format version " + str(version) + " is not supported (the latest is " + str(FORMAT_VERSION) + ")")
+        config = z['config'].tolist()
+        n, m, FM_grace, AD_grace, lr, hr, batch_size = config[:7]
+        FM_batch_size = config[7] if version >= 2 else 1
+        v = None
+        if 'v_index' in z.files:
+            v = np.split(z['v_index'], np.cumsum(z['v_sizes'])[:-1])
+            v = [map.tolist() for map in v]
+        K = KitNET(int(n), int(m), int(FM_grace), int(AD_grace), lr, None if np.isnan(hr) else hr, feature_map=v,
+                   fused=fused, batch_size=int(batch_size), FM_batch_size=int(FM_batch_size),
+                   dtype=str(z['dtype']) if 'dtype' in z.files else np.float64)
+        K.n_trained, K.n_executed = z['counters'].tolist()
+        if v is None:
+            K.FM.c[:], K.FM.c_r[:], K.FM.c_rs[:], K.FM.C[:] = z['fm_c'], z['fm_c_r'], z['fm_c_rs'], z['fm_C']
+            K.FM.N = int(z['fm_N'][0])
+        else:
+            # the parameters are copied in place: the dA's may be views of the fusedEnsemble's arrays
+            for a, dA in enumerate(K.ensembleLayer + [K.outputLayer]):
+                name = 'out' if a == len(K.ensembleLayer) else 'ae' + str(a)
+                dA.W[:], dA.hbias[:], dA.vbias[:] = z[name + '_W'], z[name + '_hbias'], z[name + '_vbias']
+                dA.norm_min[:], dA.norm_max[:] = z[name + '_norm_min'], z[name + '_norm_max']
+                dA.n = int(z[name + '_n'][0])
+        if 'batch' in z.files:
+            for x in z['batch']:
+                K.__buffer__(x)
+    if K.n_trained > K.FM_grace_period + K.AD_grace_period:
+        print("Loaded a trained KitNET: Feature-Mapper: execute-mode, Anomaly-Detector: execute-mode")
+    return K
+
 # Copyright (c) 2017 Yisroel Mirsky
 #
 # MIT License
@@ -0,0 +1,125 @@
+import math
+import numpy as np
+from scipy.special import log_ndtr
+
+# Streaming calibration of the anomaly threshold: the log-normal fit of the benign RMSE scores (see example.py), kept
+# as a running mean and variance of log(RMSE), so every score gets its log-probability (and alert flag) as it arrives,
+# without keeping the scores. The log-probability of a score is norm.logsf(log(rmse), mean, std).
+# benign_period: the number of (non-zero) scores to fit the distribution on, after which it is frozen.
+#           None: every score updates the fit. The scores of the benign period are rated against the fit so far
+# phi: an alert is raised for a score whose probability is below phi (its log-probability below log(phi))
+# store: an optional scoreStore, which the results are appended to
+class thresholdCalibrator:
+    def __init__(self, benign_period=None, phi=1e-4, store=None):
+        self.benign_period = benign_period
+        self.phi = phi
+        self.log_phi = math.log(phi)
+        self.store = store
+        self.n = 0 # the number of scores fitted so far
+        self.mean = 0.0 # the running mean of their log
+        self.M2 = 0.0 # the running sum of squared deviations of their log from the mean
+
+    # the standard deviation of the fitted log-normal (0 until two scores have been fitted)
+    def std(self):
+        if self.n < 2:
+            return 0.0
+        return math.sqrt(self.M2 / self.n)
+
+    # the log-probabilities of rmses under the current fit (0 where the score is 0, i.e., during the grace periods)
+    def logprob(self, rmses):
+        rmses = np.asarray(rmses, dtype=np.float64)
+        out = np.zeros(len(rmses))
+        std = self.std()
+        if std > 0:
+            scored = rmses > 0
+            out[scored] = log_ndtr(-(np.log(rmses[scored]) - self.mean) / std)
+        return out
+
+    # Rates each score of rmses (an array, in arrival order): fits it if in the benign period, and returns
+    # the log-probabilities and alert flags of the scores (as arrays)
+    def process_batch(self, rmses):
+        rmses = np.asarray(rmses, dtype=np.float64)
+        scored = rmses > 0
+        y = np.log(rmses[scored])
+        k = len(y) if self.benign_period is None else min(max(self.benign_period - self.n, 0), len(y)) # the scores to fit
+
+        # the fit each score is rated against: the running fit (including the score) over the first k, the final fit after
+        mean = np.full(len(y), self.mean)
+        M2 = np.full(len(y), self.M2)
+        n = np.full(len(y), self.n, dtype=np.float64)
+        if k > 0:
+            d = y[:k] - self.mean
+            S1 = np.cumsum(d)
+            n[:k] = self.n + np.arange(1, k + 1)
+            mean[:k] = self.mean + S1 / n[:k]
+            M2[:k] = self.M2 + np.cumsum(d ** 2) - S1 ** 2 / n[:k]
+            self.n, self.mean, self.M2 = int(n[k - 1]), mean[k - 1], max(M2[k - 1], 0.0)
+            mean[k:], M2[k:], n[k:] = self.mean, self.M2, self.n
+        std = np.sqrt(np.maximum(M2, 0) / np.maximum(n, 1))
+        std[n < 2] = 0
+
+        logprobs = np.zeros(len(rmses))
+        valid = std > 0
+        lp = np.zeros(len(y))
+        lp[valid] = log_ndtr(-(y[valid] - mean[valid]) / std[valid])
+        logprobs[scored] = lp
+        alerts = logprobs < self.log_phi
+        if self.store is not None:
+            self.store.append(rmses, logprobs, alerts)
+        return logprobs, alerts
+
+    # Rates a single score: returns its log-probability and alert flag
+    def process(self, rmse):
+        logprobs, alerts = self.process_batch([rmse])
+        return logprobs[0], bool(alerts[0])
+
+
+# the record of one score in a scoreStore
+record = np.dtype([('rmse', np.float32), ('logprob', np.float32), ('alert', np.bool_)])
+
+
+# An append-only store of the results of every packet: its RMSE, log-probability and alert flag, held in one growing
+# NumPy array of records (9 bytes per packet, instead of a Python float object per score).
+# path: if given, the records are also appended to this file as they arrive (a raw array of records, see load_scores)
+class scoreStore:
+    def __init__(self, path=None, init_size=65536):
+        self.data = np.empty(init_size, dtype=record)
+        self.n = 0
+        self.f = open(path, 'wb') if path is not None else None
+
+    def __len__(self):
+        return self.n
+
+    def append(self, rmses, logprobs, alerts):
+        k = len(rmses)
+        if self.n + k > len(self.data):
+            data = np.empty(max(2 * len(self.data), self.n + k), dtype=record)
+            data[:self.n] = self.data[:self.n]
+            self.data = data
+        new = self.data[self.n:self.n + k]
+        new['rmse'] = rmses
+        new['logprob'] = logprobs
+        new['alert'] = alerts
+        self.n += k
+        if self.f is not None:
+            new.tofile(self.f)
+            self.f.flush()
+
+    # the stored columns (views, valid until the next append)
+    def rmse(self):
+        return self.data['rmse'][:self.n]
+
+    def logprob(self):
+        return self.data['logprob'][:self.n]
+
+    def alert(self):
+        return self.data['alert'][:self.n]
+
+    def close(self):
+        if self.f is not None:
+            self.f.close()
+
+
+# Reads the records a scoreStore appended to path
+def load_scores(path):
+    return np.fromfile(path, dtype=record)
@@ -3,16 +3,17 @@ from scipy.cluster.hierarchy import linkage, fcluster, to_tree
 
 # A helper class for KitNET which performs a correlation-based incremental clustering of the dimensions in X
 # n: the number of dimensions in the dataset
+# dtype: the floating point type the sums (and the partial correlation matrix) are accumulated in
 # For more information and citation, please see our NDSS'18 paper: Kitsune: An Ensemble of Autoencoders for Online Network Intrusion Detection
 class corClust:
-    def __init__(self,n):
+    def __init__(self,n,dtype=np.float64):
         #parameter:
         self.n = n
         #varaibles
-        self.c = np.zeros(n) #linear num of features
-        self.c_r = np.zeros(n) #linear sum of feature residules
-        self.c_rs = np.zeros(n) #linear sum of feature residules
-        self.C = np.zeros((n,n)) #partial correlation matrix
+        self.c = np.zeros(n,dtype=dtype) #linear num of features
+        self.c_r = np.zeros(n,dtype=dtype) #linear sum of feature residules
+        self.c_rs = np.zeros(n,dtype=dtype) #linear sum of feature residules
+        self.C = np.zeros((n,n),dtype=dtype) #partial correlation matrix
         self.N = 0 #number of updates performed
 
     # x: a numpy vector of length n
@@ -24,12 +25,24 @@ class corClust:
         self.c_rs += c_rt**2
         self.C += np.outer(c_rt,c_rt)
 
-    # creates the current correlation distance matrix between the features
+    # same as update on each row of X (a k x n matrix), in order: each row's residual is taken from the running mean
+    # (of all the rows up to it), and the k residual outer products are then folded into C with one matrix product
+    def update_batch(self,X):
+        k = len(X)
+        S = np.cumsum(np.vstack((self.c,X)),axis=0)[1:] #the linear sum after each row (summed in the same order as update)
+        R = X - S/(self.N + np.arange(1,k+1)).astype(S.dtype)[:,None] #the residual of each row
+        self.N += k
+        self.c = S[-1]
+        self.c_r += R.sum(axis=0)
+        self.c_rs += (R**2).sum(axis=0)
+        self.C += R.T @ R
+
+    # creates the current correlation distance matrix between the features (in float64, whatever the dtype of the sums)
     def corrDist(self):
-        c_rs_sqrt = np.sqrt(self.c_rs)
+        c_rs_sqrt = np.sqrt(self.c_rs.astype(np.float64))
         C_rs_sqrt = np.outer(c_rs_sqrt,c_rs_sqrt)
         C_rs_sqrt[C_rs_sqrt==0] = 1e-100 #this protects against dive by zero erros (occurs when a feature is a constant)
-        D = 1-self.C/C_rs_sqrt #the correlation distance matrix
+        D = 1-self.C.astype(np.float64)/C_rs_sqrt #the correlation distance matrix
         D[D<0] = 0 #small negatives may appear due to the incremental fashion in which we update the mean. Therefore, we 'fix' them
         return D
 
@@ -29,13 +29,15 @@ from KitNET.utils import *
 import json
 
 class dA_params:
-    def __init__(self,n_visible = 5, n_hidden = 3, lr=0.001, corruption_level=0.0, gracePeriod = 10000, hiddenRatio=None):
+    # dtype: the floating point type of the weights, biases and normalization bounds (and so, of the computations)
+    def __init__(self,n_visible = 5, n_hidden = 3, lr=0.001, corruption_level=0.0, gracePeriod = 10000, hiddenRatio=None, dtype=numpy.float64):
         self.n_visible = n_visible# num of units in visible (input) layer
         self.n_hidden = n_hidden# num of units in hidden layer
         self.lr = lr
         self.corruption_level = corruption_level
         self.gracePeriod = gracePeriod
         self.hiddenRatio = hiddenRatio
+        self.dtype = dtype
 
 class dA:
     def __init__(self, params):
@@ -45,8 +47,8 @@ class dA:
             self.params.n_hidden = int(numpy.ceil(self.params.n_visible*self.params.hiddenRatio))
 
         # for 0-1 normlaization
-        self.norm_max = numpy.ones((self.params.n_visible,)) * -numpy.Inf
-        self.norm_min = numpy.ones((self.params.n_visible,)) * numpy.Inf
+        self.norm_max = numpy.full(self.params.n_visible, -numpy.Inf, dtype=self.params.dtype)
+        self.norm_min = numpy.full(self.params.n_visible, numpy.Inf, dtype=self.params.dtype)
         self.n = 0
 
         self.rng = numpy.random.RandomState(1234)
@@ -55,10 +57,10 @@ class dA:
         self.W = numpy.array(self.rng.uniform(  # initialize W uniformly
             low=-a,
             high=a,
-            size=(self.params.n_visible, self.params.n_hidden)))
+            size=(self.params.n_visible, self.params.n_hidden)), dtype=self.params.dtype)
 
-        self.hbias = numpy.zeros(self.params.n_hidden)  # initialize h bias 0
-        self.vbias = numpy.zeros(self.params.n_visible)  # initialize v bias 0
+        self.hbias = numpy.zeros(self.params.n_hidden, dtype=self.params.dtype)  # initialize h bias 0
+        self.vbias = numpy.zeros(self.params.n_visible, dtype=self.params.dtype)  # initialize v bias 0
         self.W_prime = self.W.T
 
 
@@ -106,6 +108,36 @@ class dA:
         return numpy.sqrt(numpy.mean(L_h2**2)) #the RMSE reconstruction error during training
 
 
+    # mini-batch training: one SGD step on the gradient averaged over the rows of X (an N x n_visible matrix).
+    # The normalization bounds are first updated with the whole batch. Returns the RMSE of each row during training
+    def train_batch(self, X):
+        self.n = self.n + len(X)
+        # update norms
+        numpy.fmax(self.norm_max, numpy.fmax.reduce(X, axis=0), out=self.norm_max)
+        numpy.fmin(self.norm_min, numpy.fmin.reduce(X, axis=0), out=self.norm_min)
+
+        # 0-1 normalize
+        X = (X - self.norm_min) / (self.norm_max - self.norm_min + 0.0000000000000001)
+
+        if self.params.corruption_level > 0.0:
+            tilde_X = self.get_corrupted_input(X, self.params.corruption_level)
+        else:
+            tilde_X = X
+        Y = self.get_hidden_values(tilde_X)
+        Z = self.get_reconstructed_input(Y)
+
+        L_h2 = X - Z
+        L_h1 = numpy.dot(L_h2, self.W) * Y * (1 - Y)
+
+        L_vbias = L_h2.mean(axis=0)
+        L_hbias = L_h1.mean(axis=0)
+        L_W = (numpy.dot(tilde_X.T, L_h1) + numpy.dot(L_h2.T, Y)) / len(X)
+
+        self.W += self.params.lr * L_W
+        self.hbias += self.params.lr * L_hbias
+        self.vbias += self.params.lr * L_vbias
+        return numpy.sqrt(numpy.mean(L_h2**2, axis=1)) #the RMSE reconstruction errors during training
+
     def reconstruct(self, x):
         y = self.get_hidden_values(x)
         z = self.get_reconstructed_input(y)
@@ -122,5 +154,15 @@ class dA:
             return rmse
 
 
+    # returns the RMSE of the reconstruction of each row of X (an N x n_visible matrix), same as execute on each row
+    def execute_batch(self, X):
+        if self.n < self.params.gracePeriod:
+            return numpy.zeros(len(X))
+        # 0-1 normalize
+        X = (X - self.norm_min) / (self.norm_max - self.norm_min + 0.0000000000000001)
+        Y = sigmoid(numpy.dot(X, self.W) + self.hbias)
+        Z = sigmoid(numpy.dot(Y, self.W_prime) + self.vbias)
+        return numpy.sqrt(((X - Z) ** 2).mean(axis=1))
+
     def inGrace(self):
         return self.n < self.params.gracePeriod
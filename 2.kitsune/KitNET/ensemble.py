@@ -0,0 +1,177 @@
+import numpy
+from KitNET.utils import *
+
+# A fused representation of KitNET's ensemble layer, which trains and executes all of its autoencoders (dA's) with a
+# handful of array operations per instance, in place of a loop of small NumPy calls per autoencoder.
+# All the parameters of the ensemble are packed into a few arrays, and the dA's are rebound to views of them, so
+# both representations share one state: dA.train/dA.execute (the reference) can still be used on the same ensemble.
+#  - The inputs of all the autoencoders are gathered from x with a single precomputed index, into one flat vector.
+#  - The element-wise operations (normalization, biases, sigmoids, errors, updates) run once over the flat vectors.
+#  - The autoencoders are grouped by their number of visible units, and the weights of each group are stacked into one
+#    (k x n_visible x n_hidden) array, so each layer costs one batched matrix product per group (at most
+#    max_autoencoder_size groups, however large the ensemble). The autoencoders are not padded: every dot product runs
+#    over exactly the same values as in dA, so the RMSEs are numerically identical to the per-dA path.
+# dAs: the ensemble's list of dA's, v: the feature map (v[a] are the indices of x given to dAs[a])
+class fusedEnsemble:
+    def __init__(self, dAs, v):
+        if not fusedEnsemble.supports(dAs):
+            raise ValueError("fusedEnsemble: the autoencoders must have no corruption and no grace period")
+        self.dAs = dAs
+        self.k = len(dAs)
+        self.dtype = dAs[0].W.dtype # (KitNET creates all its dA's with the same dtype)
+
+        # order the autoencoders by their number of visible units (stable: in ensemble order within a group)
+        sizes = [dA.params.n_visible for dA in dAs]
+        self.order = numpy.array(sorted(range(self.k), key=lambda a: sizes[a]), dtype=numpy.intp)
+
+        # the gather index of the flat (visible) vector, and the flat layouts of the visible and hidden units
+        self.gidx = numpy.concatenate([numpy.asarray(v[a], dtype=numpy.intp) for a in self.order])
+        n_vis = len(self.gidx)
+        n_hid = sum([dAs[a].params.n_hidden for a in self.order])
+        self.norm_max = numpy.empty(n_vis, dtype=self.dtype)
+        self.norm_min = numpy.empty(n_vis, dtype=self.dtype)
+        self.vbias = numpy.empty(n_vis, dtype=self.dtype)
+        self.hbias = numpy.empty(n_hid, dtype=self.dtype)
+        self.vis_lr = numpy.empty(n_vis, dtype=self.dtype) # the learning rate of each unit's autoencoder
+        self.hid_lr = numpy.empty(n_hid, dtype=self.dtype)
+
+        # the groups: (visible slice, hidden slice, autoencoder slice (of order), stacked weights, learning rates (k x 1 x 1))
+        self.groups = []
+        vo, ho, a0 = 0, 0, 0
+        while a0 < self.k:
+            m = sizes[self.order[a0]]
+            a1 = a0
+            while a1 < self.k and sizes[self.order[a1]] == m:
+                a1 += 1
+            members = [dAs[a] for a in self.order[a0:a1]]
+            h = members[0].params.n_hidden
+            W = numpy.empty((a1 - a0, m, h), dtype=self.dtype)
+            for j, dA in enumerate(members):
+                vs, hs = slice(vo + j*m, vo + (j+1)*m), slice(ho + j*h, ho + (j+1)*h)
+                W[j] = dA.W
+                self.norm_max[vs] = dA.norm_max
+                self.norm_min[vs] = dA.norm_min
+                self.vbias[vs] = dA.vbias
+                self.hbias[hs] = dA.hbias
+                self.vis_lr[vs] = dA.params.lr
+                self.hid_lr[hs] = dA.params.lr
+                # rebind the dA to views of the fused arrays
+                dA.W = W[j]
+                dA.W_prime = dA.W.T
+                dA.norm_max = self.norm_max[vs]
+                dA.norm_min = self.norm_min[vs]
+                dA.vbias = self.vbias[vs]
+                dA.hbias = self.hbias[hs]
+            k = a1 - a0
+            lr = numpy.array([dA.params.lr for dA in members], dtype=self.dtype).reshape(k, 1, 1)
+            self.groups.append((slice(vo, vo + k*m), slice(ho, ho + k*h), slice(a0, a1), W, lr))
+            vo, ho, a0 = vo + k*m, ho + k*h, a1
+
+        self.S = numpy.empty(self.k, dtype=self.dtype) # the ensemble's scores, in ensemble order
+
+    # the fused path reproduces dA.train/dA.execute for the dA's KitNET creates: without input corruption or grace period
+    @staticmethod
+    def supports(dAs):
+        return all([dA.params.corruption_level == 0 and dA.params.gracePeriod == 0 for dA in dAs])
+
+    # the forward pass of every autoencoder on the (normalized) flat vector x: returns the hidden and reconstructed units
+    def forward(self, x):
+        y = numpy.empty(len(self.hbias), dtype=self.dtype)
+        z = numpy.empty(len(self.vbias), dtype=self.dtype)
+        for vs, hs, _, W, _ in self.groups:
+            k, m, h = W.shape
+            numpy.matmul(x[vs].reshape(k, 1, m), W, out=y[hs].reshape(k, 1, h))
+        y = sigmoid(y + self.hbias)  # Encode
+        for vs, hs, _, W, _ in self.groups:
+            k, m, h = W.shape
+            numpy.matmul(y[hs].reshape(k, 1, h), W.transpose(0, 2, 1), out=z[vs].reshape(k, 1, m))
+        z = sigmoid(z + self.vbias)  # Decode
+        return y, z
+
+    # the RMSE of each autoencoder (in ensemble order), given the flat reconstruction error e
+    def rmse(self, e):
+        for vs, _, As, W, _ in self.groups:
+            k, m, h = W.shape
+            self.S[self.order[As]] = numpy.sqrt((e[vs].reshape(k, m) ** 2).mean(axis=1))
+        return self.S.copy()
+
+    # trains every autoencoder on x (same as dA.train for each dA), and returns their RMSEs (in ensemble order)
+    def train(self, x):
+        for dA in self.dAs:
+            dA.n = dA.n + 1
+        x = x[self.gidx]
+        # update norms
+        numpy.fmax(self.norm_max, x, out=self.norm_max)
+        numpy.fmin(self.norm_min, x, out=self.norm_min)
+
+        # 0-1 normalize
+        x = (x - self.norm_min) / (self.norm_max - self.norm_min + 0.0000000000000001)
+        y, z = self.forward(x)
+
+        L_h2 = x - z
+        L_h1 = numpy.empty(len(self.hbias), dtype=self.dtype)
+        for vs, hs, _, W, _ in self.groups:
+            k, m, h = W.shape
+            numpy.matmul(L_h2[vs].reshape(k, 1, m), W, out=L_h1[hs].reshape(k, 1, h))
+        L_h1 = L_h1 * y * (1 - y)
+
+        for vs, hs, _, W, lr in self.groups:
+            k, m, h = W.shape
+            x_g, y_g, L_h1_g, L_h2_g = x[vs].reshape(k, m, 1), y[hs].reshape(k, 1, h), L_h1[hs].reshape(k, 1, h), L_h2[vs].reshape(k, m, 1)
+            L_W = x_g * L_h1_g + L_h2_g * y_g
+            W += lr * L_W
+        self.hbias += self.hid_lr * L_h1
+        self.vbias += self.vis_lr * L_h2
+        return self.rmse(L_h2) #the RMSE reconstruction error during training
+
+    # mini-batch trains every autoencoder on the rows of X (an N x n matrix), same as dA.train_batch for each dA,
+    # and returns their RMSEs (an N x k matrix, in ensemble order)
+    def train_batch(self, X):
+        N = len(X)
+        for dA in self.dAs:
+            dA.n = dA.n + N
+        X = X[:, self.gidx]
+        # update norms
+        numpy.fmax(self.norm_max, numpy.fmax.reduce(X, axis=0), out=self.norm_max)
+        numpy.fmin(self.norm_min, numpy.fmin.reduce(X, axis=0), out=self.norm_min)
+
+        # 0-1 normalize
+        X = (X - self.norm_min) / (self.norm_max - self.norm_min + 0.0000000000000001)
+        S = numpy.empty((N, self.k), dtype=self.dtype)
+        for vs, hs, As, W, lr in self.groups:
+            k, m, h = W.shape
+            X_g = X[:, vs].reshape(N, k, m).transpose(1, 0, 2)  # k x N x m
+            Y = sigmoid(numpy.matmul(X_g, W) + self.hbias[hs].reshape(k, 1, h))  # Encode
+            Z = sigmoid(numpy.matmul(Y, W.transpose(0, 2, 1)) + self.vbias[vs].reshape(k, 1, m))  # Decode
+
+            L_h2 = X_g - Z
+            L_h1 = numpy.matmul(L_h2, W) * Y * (1 - Y)
+            L_W = (numpy.matmul(X_g.transpose(0, 2, 1), L_h1) + numpy.matmul(L_h2.transpose(0, 2, 1), Y)) / N
+
+            W += lr * L_W
+            self.hbias[hs] += (lr * L_h1.mean(axis=1, keepdims=True)).ravel()
+            self.vbias[vs] += (lr * L_h2.mean(axis=1, keepdims=True)).ravel()
+            S[:, self.order[As]] = numpy.sqrt((L_h2 ** 2).mean(axis=2)).T
+        return S
+
+    # executes every autoencoder on x (same as dA.execute for each dA), and returns their RMSEs (in ensemble order)
+    def execute(self, x):
+        # 0-1 normalize
+        x = (x[self.gidx] - self.norm_min) / (self.norm_max - self.norm_min + 0.0000000000000001)
+        y, z = self.forward(x)
+        return self.rmse(x - z)
+
+    # executes every autoencoder on each row of X (an N x n matrix) with matrix-matrix products,
+    # and returns their RMSEs (an N x k matrix, in ensemble order)
+    def execute_batch(self, X):
+        N = len(X)
+        # 0-1 normalize
+        X = (X[:, self.gidx] - self.norm_min) / (self.norm_max - self.norm_min + 0.0000000000000001)
+        S = numpy.empty((N, self.k), dtype=self.dtype)
+        for vs, hs, As, W, _ in self.groups:
+            k, m, h = W.shape
+            X_g = X[:, vs].reshape(N, k, m).transpose(1, 0, 2)  # k x N x m
+            Y = sigmoid(numpy.matmul(X_g, W) + self.hbias[hs].reshape(k, 1, h))  # Encode
+            Z = sigmoid(numpy.matmul(Y, W.transpose(0, 2, 1)) + self.vbias[vs].reshape(k, 1, m))  # Decode
+            S[:, self.order[As]] = numpy.sqrt(((X_g - Z) ** 2).mean(axis=2)).T
+        return S
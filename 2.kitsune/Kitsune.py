@@ -1,5 +1,10 @@
 from FeatureExtractor import *
 from KitNET.KitNET import KitNET
+import KitNET.KitNET as KN
+import checkpoint
+import profiler
+import io
+import time
 
 # MIT License
 #
@@ -24,19 +29,134 @@ from KitNET.KitNET import KitNET
 # SOFTWARE.
 
 class Kitsune:
-    def __init__(self,file_path,limit,max_autoencoder_size=10,FM_grace_period=None,AD_grace_period=10000,learning_rate=0.1,hidden_ratio=0.75,):
+    # stat_config: a netStat.netStatConfig selecting the feature groups (and their Lambdas) to extract. KitNET is sized to match.
+    # batch_size: the mini-batch size KitNET trains with during the AD grace period (1: one SGD step per packet)
+    # model: a pre-trained KitNET, or a file it was saved to (KitNET.save). It replaces a new KitNET (and the KitNET
+    #        parameters above): a trained model executes from the first packet, with no grace period
+    # checkpoint_path, checkpoint_interval: every checkpoint_interval packets, a checkpoint is saved to checkpoint_path (see save_checkpoint)
+    # dtype: np.float32 extracts the feature vectors, and runs KitNET, in single precision (AfterImage's stats are still
+    #        tracked in float64): less memory traffic per packet, at a small cost in accuracy (see README). A model's dtype overrides it
+    # profile: if True, the latency of each stage (parse, features, FM update, ensemble, output layer) is recorded (see stats)
+    # log_interval: every log_interval packets, a line of stats is printed (0: never)
+    # max_records, cleanup_interval, cutoff_weight: AfterImage's stream eviction (see FE). By default every stream is kept,
+    #        so memory grows with long captures: set cleanup_interval (e.g. 10000) to evict the streams that have decayed away
+    def __init__(self,file_path,limit,max_autoencoder_size=10,FM_grace_period=None,AD_grace_period=10000,learning_rate=0.1,hidden_ratio=0.75,stat_config=None,batch_size=1,model=None,
+                 checkpoint_path=None,checkpoint_interval=0,dtype=np.float64,profile=False,log_interval=0,max_records=np.inf,cleanup_interval=0,cutoff_weight=1e-3):
         #init packet feature extractor (AfterImage)
-        self.FE = FE(file_path,limit)
+        self.FE = FE(file_path,limit,max_records=max_records,cleanup_interval=cleanup_interval,cutoff_weight=cutoff_weight,stat_config=stat_config,dtype=dtype)
 
         #init Kitnet
-        self.AnomDetector = KitNET(self.FE.get_num_features(),max_autoencoder_size,FM_grace_period,AD_grace_period,learning_rate,hidden_ratio)
+        if model is None:
+            self.AnomDetector = KitNET(self.FE.get_num_features(),max_autoencoder_size,FM_grace_period,AD_grace_period,learning_rate,hidden_ratio,batch_size=batch_size,dtype=dtype)
+        else:
+            self.AnomDetector = model if isinstance(model, KitNET) else KN.load(model)
+            if self.AnomDetector.n != self.FE.get_num_features():
+                raise ValueError("The KitNET model takes " + str(self.AnomDetector.n) + " features, but the feature extractor gives "
+                                 + str(self.FE.get_num_features()) + " (a different stat_config?)")
+            self.FE.dtype = self.AnomDetector.dtype
+
+        #reusable feature vector, written in place for every packet (KitNET does not keep references to x)
+        self.x = np.empty(self.FE.get_num_features(),dtype=self.FE.dtype)
+        self.X = None #reusable batch of feature vectors (proc_next_batch)
+
+        self.checkpoint_path = checkpoint_path
+        self.checkpoint_interval = checkpoint_interval if checkpoint_path is not None else 0
+        self.last_checkpoint = 0 #the number of packets processed at the last checkpoint
+
+        self.profiler = profiler.stageProfiler() if profile else None
+        self.__attach_profiler__()
+        self.log_interval = log_interval
+        self.last_log = 0 #the number of packets processed at the last stats line
+        self.last_log_time = time.time()
 
     def proc_next_packet(self):
         # create feature vector
-        x = self.FE.get_next_vector()
+        x = self.FE.get_next_vector(self.x)
         if len(x) == 0:
             return -1 #Error or no packets left
 
         # process KitNET
-        return self.AnomDetector.process(x)  # will train during the grace periods, then execute on all the rest.
+        rmse = self.AnomDetector.process(x)  # will train during the grace periods, then execute on all the rest.
+        self.__auto_checkpoint__()
+        if self.log_interval > 0:
+            self.__log_stats__()
+        return rmse
+
+    # Processes the next n packets, and returns their RMSE scores as an array
+    # (fewer than n when the packets run out, and an empty array when no packets are left).
+    # The packets after the grace periods are executed as one batch (KitNET.execute_batch): their scores match those of
+    # proc_next_packet only up to floating-point rounding (matrix-matrix vs. matrix-vector products), and depend on where
+    # the batch boundaries fall (the same packets processed in other batches can differ in the last digits)
+    def proc_next_batch(self, n):
+        # create feature vectors (into a reusable batch buffer)
+        if self.X is None or len(self.X) < n:
+            self.X = np.empty((n, self.FE.get_num_features()),dtype=self.FE.dtype)
+        X = self.FE.get_next_vectors(n, self.X)
+
+        # process KitNET (the packets after the grace periods are executed as one batch)
+        rmses = self.AnomDetector.process_batch(X)
+        self.__auto_checkpoint__()
+        if self.log_interval > 0:
+            self.__log_stats__()
+        return rmses
+
+    # Saves the complete state of Kitsune to path: the position in the input, AfterImage's hash tables, and KitNET (its
+    # weights, counters and grace period progress). See checkpoint.py for the format.
+    # A Kitsune resumed from the checkpoint (load_checkpoint) gives exactly the same scores as this one from the next packet on
+    def save_checkpoint(self, path):
+        checkpoint.save(path, self.__save_state__)
+        self.last_checkpoint = self.FE.curPacketIndx
+
+    def __save_state__(self, w):
+        self.FE.save_state(w)
+        model = io.BytesIO()
+        self.AnomDetector.save(model)
+        w.write_object(model.getvalue())
+
+    # Resumes from a checkpoint saved by save_checkpoint: the next packet processed is the one after the checkpoint.
+    # This Kitsune must have been created on the same input file. The saved configuration (stat_config, KitNET's parameters)
+    # replaces the one this Kitsune was created with
+    def load_checkpoint(self, path):
+        checkpoint.load(path, self.__load_state__)
+        self.last_checkpoint = self.FE.curPacketIndx
+
+    def __load_state__(self, r):
+        self.FE.load_state(r)
+        self.AnomDetector = KN.load(io.BytesIO(r.read_object()))
+        self.FE.dtype = self.AnomDetector.dtype
+        self.x = np.empty(self.FE.get_num_features(),dtype=self.FE.dtype)
+        self.X = None
+        self.__attach_profiler__()
+
+    # saves a checkpoint if checkpoint_interval packets have been processed since the last one
+    def __auto_checkpoint__(self):
+        if self.checkpoint_interval > 0 and self.FE.curPacketIndx - self.last_checkpoint >= self.checkpoint_interval:
+            self.save_checkpoint(self.checkpoint_path)
+
+    # The counters of the run so far: packets processed, instances trained and executed by KitNET, AfterImage's records
+    # (created, held and evicted) and cov links (created), and, if profiling, the latencies of each stage
+    # (see profiler.stageProfiler.stats)
+    def stats(self):
+        created, covs_created = self.FE.nstat.getNumCreated()
+        return {'packets': self.FE.curPacketIndx, 'trained': self.AnomDetector.n_trained, 'executed': self.AnomDetector.n_executed,
+                'records_created': created, 'records': self.FE.nstat.getNumRecords(), 'records_evicted': self.FE.nstat.getNumEvicted(),
+                'covs_created': covs_created,
+                'stages': self.profiler.stats() if self.profiler is not None else dict()}
+
+    def __attach_profiler__(self):
+        self.FE.profiler = self.profiler
+        self.AnomDetector.profiler = self.profiler
 
+    # prints a line of stats if log_interval packets have been processed since the last one
+    def __log_stats__(self):
+        n = self.FE.curPacketIndx
+        if n - self.last_log < self.log_interval:
+            return
+        t = time.time()
+        created, covs_created = self.FE.nstat.getNumCreated()
+        line = ("Kitsune: " + str(n) + " packets (" + str(int((n - self.last_log) / max(t - self.last_log_time, 1e-9))) + " packets/sec), "
+                + str(created) + " records created (" + str(self.FE.nstat.getNumRecords()) + " held), " + str(covs_created) + " cov links created")
+        if self.profiler is not None:
+            line += ". " + self.profiler.summary()
+        print(line)
+        self.last_log, self.last_log_time = n, t
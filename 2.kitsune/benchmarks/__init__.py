@@ -0,0 +1,2 @@
+# Benchmarks for the Kitsune hot path. Run them from the 2.kitsune directory, e.g.:
+#   python -m benchmarks.fanout
@@ -0,0 +1,76 @@
+# Measures how the per-packet cost of AfterImage's 2D (covariance) statistics scales with a host's fan-out,
+# e.g., a scanner or a bot talking to thousands of peers.
+# For each fan-out F, a host is linked with F peers, and then we time:
+#  - lookup: finding the host's cov link with a peer (register_cov on an existing link), which should stay flat in F
+#  - update: a full update_get_1D2D_Stats from the host to a peer. Every insert into a stream refreshes ALL of its
+#            cov links (this is how AfterImage defines the covariance), so this part necessarily grows with F.
+#
+# usage: python -m benchmarks.fanout [--fanouts 10 100 1000 10000 100000] [--packets 200] [--backend both|ref|vec]
+import argparse
+import time
+import numpy as np
+import AfterImage as af
+
+Lambdas = [5, 3, 1, .1, .01]
+
+
+def build(backend, fanout):
+    # links host 0 with peers 1..fanout (one packet each, at increasing times)
+    if backend == 'vec':
+        db = af.incStatDB_vec(Lambdas)
+        for p in range(1, fanout + 1):
+            db.register_cov(0, p, init_time=p * 1e-3)
+    else:
+        db = af.incStatDB()
+        for p in range(1, fanout + 1):
+            for l in Lambdas:
+                db.register_cov(0, p, l, init_time=p * 1e-3)
+    return db
+
+
+def time_lookup(backend, db, fanout, n):
+    peers = np.random.RandomState(0).randint(1, fanout + 1, n).tolist()
+    start = time.perf_counter()
+    if backend == 'vec':
+        for p in peers:
+            db.register_cov(0, p)
+    else:
+        for p in peers:
+            for l in Lambdas:
+                db.register_cov(0, p, l)
+    return (time.perf_counter() - start) / n
+
+
+def time_update(backend, db, fanout, n):
+    peers = np.random.RandomState(1).randint(1, fanout + 1, n).tolist()
+    t = fanout * 1e-3
+    start = time.perf_counter()
+    for i, p in enumerate(peers):
+        t += 1e-3
+        if backend == 'vec':
+            db.update_get_1D2D_Stats(0, p, t, 100 + i % 50)
+        else:
+            for l in Lambdas:
+                db.update_get_1D2D_Stats(0, p, t, 100 + i % 50, l)
+    return (time.perf_counter() - start) / n
+
+
+def main():
+    parser = argparse.ArgumentParser(description="AfterImage cov link cost vs. fan-out")
+    parser.add_argument('--fanouts', type=int, nargs='+', default=[10, 100, 1000, 10000, 100000])
+    parser.add_argument('--packets', type=int, default=200)
+    parser.add_argument('--backend', choices=['both', 'ref', 'vec'], default='both')
+    args = parser.parse_args()
+
+    backends = ['ref', 'vec'] if args.backend == 'both' else [args.backend]
+    print("backend   fan-out   lookup [us/pkt]   update [us/pkt]")
+    for backend in backends:
+        for fanout in args.fanouts:
+            db = build(backend, fanout)
+            lookup = time_lookup(backend, db, fanout, args.packets)
+            update = time_update(backend, db, fanout, args.packets)
+            print("%-8s %8d %17.2f %17.1f" % (backend, fanout, lookup * 1e6, update * 1e6))
+
+
+if __name__ == '__main__':
+    main()
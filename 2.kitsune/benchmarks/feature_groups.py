@@ -0,0 +1,46 @@
+# Measures the feature extraction throughput (packets/sec) of netStat under different netStatConfig's,
+# i.e., the price of each stat group and of the number of windows (Lambdas), on a synthetic trace (benchmarks/synth.trace).
+#
+# usage: python -m benchmarks.feature_groups [--packets 20000] [--hosts 100] [--backend both|ref|vec]
+import argparse
+import time
+import numpy as np
+import netStat as ns
+from benchmarks import synth
+
+configs = [
+    ('full (original)', ns.netStatConfig()),
+    ('no HpHp', ns.netStatConfig(HpHp=False)),
+    ('3 windows', ns.netStatConfig(Lambdas=[5, 3, 1])),
+    ('no HpHp, 3 windows', ns.netStatConfig(Lambdas=[5, 3, 1], HpHp=False)),
+    ('MI + HH_jit only', ns.netStatConfig(HH=False, HpHp=False)),
+]
+
+
+def throughput(config, vectorized, trace):
+    nstat = ns.netStat(HostLimit=10**11, HostSimplexLimit=10**11, vectorized=vectorized, config=config)
+    out = np.empty(nstat.n_features)
+    start = time.perf_counter()
+    for p in trace:
+        nstat.updateGetStats(*p, out=out)
+    return len(trace) / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="netStat throughput per feature configuration")
+    parser.add_argument('--packets', type=int, default=20000)
+    parser.add_argument('--hosts', type=int, default=100)
+    parser.add_argument('--backend', choices=['both', 'ref', 'vec'], default='both')
+    args = parser.parse_args()
+
+    trace = synth.stats_args(synth.trace(args.packets, args.hosts))
+    backends = ['ref', 'vec'] if args.backend == 'both' else [args.backend]
+    print("%-20s %8s %8s %12s" % ("config", "backend", "features", "packets/sec"))
+    for name, config in configs:
+        for backend in backends:
+            pps = throughput(config, backend == 'vec', trace)
+            print("%-20s %8s %8d %12.0f" % (name, backend, config.num_features(), pps))
+
+
+if __name__ == '__main__':
+    main()
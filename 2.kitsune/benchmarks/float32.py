@@ -0,0 +1,79 @@
+# Compares Kitsune's float32 mode (Kitsune(..., dtype=np.float32)) with the default float64: the accuracy of the
+# anomaly scores (RMSEs), of their log-probabilities under the log-normal fitted on the benign part (as in example.py),
+# and of the alerts raised at a log-probability threshold, and the instances/sec of KitNET in each precision.
+# The features are extracted once (in float64, as AfterImage always does) from a capture, or from a synthetic trace
+# (benchmarks/synth.trace), and KitNET is trained and executed on them in each precision (float32 features are the
+# float64 features, rounded).
+#
+# usage: python -m benchmarks.float32 [--capture ../rep/myoffice1000.pcapng] [--packets 30000] [--hosts 100]
+import argparse
+import contextlib
+import io
+import time
+import numpy as np
+from scipy.stats import norm
+import netStat as ns
+from FeatureExtractor import FE
+from KitNET.KitNET import KitNET
+from benchmarks import synth
+
+
+def features(args):
+    if args.capture is not None:
+        with contextlib.redirect_stdout(io.StringIO()):
+            fe = FE(args.capture, args.packets)
+        return fe.get_next_vectors(int(min(args.packets, 10**8)))
+    nstat = ns.netStat(HostLimit=10**11, HostSimplexLimit=10**11, vectorized=True)
+    X = np.empty((args.packets, nstat.n_features))
+    for i, p in enumerate(synth.stats_args(synth.trace(args.packets, args.hosts))):
+        nstat.updateGetStats(*p, out=X[i])
+    return X
+
+
+# trains and executes a KitNET of the given dtype on X, and returns the scores and the time taken
+def run(X, FMgrace, ADgrace, dtype):
+    X = X.astype(dtype)
+    with contextlib.redirect_stdout(io.StringIO()):
+        K = KitNET(X.shape[1], 10, FMgrace, ADgrace, dtype=dtype)
+        start = time.perf_counter()
+        scores = np.array([K.process(x) for x in X], dtype=np.float64)
+        t_process = time.perf_counter() - start
+    start = time.perf_counter()
+    K.execute_batch(X[FMgrace + ADgrace + 1:])
+    t_batch = time.perf_counter() - start
+    return scores, t_process, t_batch
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Kitsune float32 vs. float64")
+    parser.add_argument('--capture', default=None, help="a pcap, pcapng or tsv file (default: a synthetic trace)")
+    parser.add_argument('--packets', type=int, default=30000)
+    parser.add_argument('--hosts', type=int, default=100)
+    parser.add_argument('--threshold', type=float, default=-5, help="alert when the log-probability is below this")
+    args = parser.parse_args()
+
+    X = features(args)
+    n = len(X)
+    FMgrace, ADgrace = n // 10, n // 2
+    first = FMgrace + ADgrace + 1  # the first scored instance
+    S64, t64, b64 = run(X, FMgrace, ADgrace, np.float64)
+    S32, t32, b32 = run(X, FMgrace, ADgrace, np.float32)
+    S64, S32 = S64[first:], S32[first:]
+
+    # the log-probabilities, each under the log-normal fitted on the first half of its own execution phase
+    benign = slice(0, len(S64) // 2)
+    L64 = norm.logsf(np.log(S64), np.mean(np.log(S64[benign])), np.std(np.log(S64[benign])))
+    L32 = norm.logsf(np.log(S32), np.mean(np.log(S32[benign])), np.std(np.log(S32[benign])))
+    A64, A32 = L64 < args.threshold, L32 < args.threshold
+
+    rel = np.abs(S32 - S64) / S64
+    print("instances: %d (%d scored), features: %d" % (n, len(S64), X.shape[1]))
+    print("RMSE relative difference:    median %.2g, 99th percentile %.2g, max %.2g" % (np.median(rel), np.percentile(rel, 99), rel.max()))
+    print("log-probability difference:  median %.2g, max %.2g" % (np.median(np.abs(L32 - L64)), np.abs(L32 - L64).max()))
+    print("alerts (log-probability < %g): float64 %d, float32 %d, in both %d" % (args.threshold, A64.sum(), A32.sum(), (A64 & A32).sum()))
+    print("process:       float64 %8.0f, float32 %8.0f instances/sec" % (n / t64, n / t32))
+    print("execute_batch: float64 %8.0f, float32 %8.0f instances/sec" % (len(S64) / b64, len(S64) / b32))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,54 @@
+# Compares KitNET's batched inference (execute_batch) with the per-instance reference (execute, i.e., dA.execute per
+# autoencoder): checks that the scores agree (up to floating point rounding) and reports the instances/sec of each.
+# The features are extracted from a synthetic trace (benchmarks/synth.trace), KitNET is trained on the first part and executed on the rest.
+#
+# usage: python -m benchmarks.kitnet_batch [--packets 20000] [--hosts 100] [--batch 10000]
+import argparse
+import contextlib
+import io
+import time
+import numpy as np
+import netStat as ns
+from KitNET.KitNET import KitNET
+from benchmarks import synth
+
+
+def features(n, hosts):
+    nstat = ns.netStat(HostLimit=10**11, HostSimplexLimit=10**11, vectorized=True)
+    X = np.empty((n, nstat.n_features))
+    for i, p in enumerate(synth.stats_args(synth.trace(n, hosts))):
+        nstat.updateGetStats(*p, out=X[i])
+    return X
+
+
+def main():
+    parser = argparse.ArgumentParser(description="KitNET execute_batch vs. execute")
+    parser.add_argument('--packets', type=int, default=20000)
+    parser.add_argument('--hosts', type=int, default=100)
+    parser.add_argument('--batch', type=int, default=10000)
+    args = parser.parse_args()
+
+    X = features(args.packets, args.hosts)
+    FMgrace, ADgrace = args.packets // 10, args.packets // 2
+    with contextlib.redirect_stdout(io.StringIO()):
+        K = KitNET(X.shape[1], 10, FMgrace, ADgrace)
+        for x in X[:FMgrace + ADgrace + 1]:
+            K.process(x)
+    T = X[FMgrace + ADgrace + 1:]
+
+    start = time.perf_counter()
+    ref = np.array([K.execute(x) for x in T])
+    t_ref = time.perf_counter() - start
+
+    start = time.perf_counter()
+    batch = np.concatenate([K.execute_batch(T[i:i + args.batch]) for i in range(0, len(T), args.batch)])
+    t_batch = time.perf_counter() - start
+
+    print("autoencoders: %d, executed instances: %d" % (len(K.v), len(T)))
+    print("max relative difference: %.3g (parity: %s)" % (np.max(np.abs(batch - ref) / np.abs(ref)), np.allclose(batch, ref, rtol=1e-9, atol=0)))
+    print("execute:       %10.0f instances/sec" % (len(T) / t_ref))
+    print("execute_batch: %10.0f instances/sec" % (len(T) / t_batch))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,272 @@
+# End-to-end (macro) benchmark of the app's pages on the sample captures in rep/, run headless (without Streamlit):
+#  - kitsune:   Kitsune on each pcap, as the Kitsune page runs it (chunks of 1000 packets, scores calibrated online)
+#  - rforest:   3.rforest/app.py's process_data and make_predictions on each filtered_*.csv
+#  - visualize: 5.visualize/visualize.py's plotIPs on each pcap (without looking up the external IP)
+# The page functions are loaded from the pages' source files, as main.py runs them (from their own directory), but only
+# their imports and the functions themselves are executed, not the page's UI code.
+# Each run is made in a fresh process, so that its peak RSS (resident set size) is its own. A run reports its wall time,
+# throughput (packets or rows/sec), peak RSS, and the time of each stage. Inputs which are missing or are git-lfs
+# pointers (fetch them with `git lfs pull`), and pages whose dependencies are not installed, are reported as skipped.
+# The report can be written as JSON (--json), and compared with an earlier one (--baseline) to track regressions.
+#
+# usage: python -m benchmarks.macro [--workloads kitsune rforest visualize] [--pcaps ...] [--csvs ...] [--limit N]
+#                                   [--json report.json] [--baseline old.json]
+import argparse
+import ast
+import contextlib
+import importlib.util
+import io
+import json
+import multiprocessing as mp
+import os
+import platform
+import queue
+import sys
+import time
+import traceback
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+KITSUNE_DIR = os.path.join(ROOT, '2.kitsune')
+RFOREST_DIR = os.path.join(ROOT, '3.rforest')
+VISUALIZE_DIR = os.path.join(ROOT, '5.visualize')
+
+PCAPS = ['rep/DarkWave.pcap', 'rep/bigFlows.pcap', 'rep/home-400k.pcap']
+CSVS = ['rep/filtered_DarkWave.csv', 'rep/filtered_bigFlows.csv', 'rep/filtered_home-400k.csv']
+
+# the modules each page needs
+requirements = {
+    'kitsune': ['numpy', 'scipy'],
+    'rforest': ['pandas', 'joblib', 'sklearn'],
+    'visualize': ['dpkt', 'pygeoip', 'folium'],
+}
+
+# the data files each page loads
+data_files = {
+    'kitsune': [],
+    'rforest': [os.path.join(RFOREST_DIR, 'best_model_resaved.pkl'), os.path.join(RFOREST_DIR, 'predictor_names_resaved.pkl')],
+    'visualize': [os.path.join(VISUALIZE_DIR, 'GeoLiteCity.dat')],
+}
+
+
+# Loads the given functions of a page (a Streamlit script) without running the page: only its imports (those which
+# are installed) and the function definitions are executed, without their decorators (e.g. st.cache_resource)
+def page_functions(path, names):
+    with open(path, encoding='utf-8') as f:
+        tree = ast.parse(f.read(), path)
+    namespace = {'__name__': 'page'}
+    for node in tree.body:
+        if isinstance(node, (ast.Import, ast.ImportFrom)):
+            try:
+                exec(compile(ast.Module([node], []), path, 'exec'), namespace)
+            except ImportError:
+                pass
+        elif isinstance(node, ast.FunctionDef) and node.name in names:
+            node.decorator_list = []
+            exec(compile(ast.Module([node], []), path, 'exec'), namespace)
+    missing = [name for name in names if name not in namespace]
+    if missing:
+        raise LookupError(path + " does not define " + ", ".join(missing))
+    return namespace
+
+
+# the reason a run cannot be made (or None)
+def skip_reason(workload, path):
+    missing = [m for m in requirements[workload] if importlib.util.find_spec(m) is None]
+    if missing:
+        return "missing dependencies: " + ", ".join(missing)
+    for file in [path] + data_files[workload]:
+        if not os.path.isfile(file):
+            return "missing file: " + os.path.relpath(file, ROOT)
+        with open(file, 'rb') as f:
+            if f.read(24).startswith(b'version https://git-lfs'):
+                return os.path.relpath(file, ROOT) + " is a git-lfs pointer (run `git lfs pull`)"
+    return None
+
+
+def peak_rss_mb():
+    try:
+        import resource
+    except ImportError:  # (Windows)
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / 2**20 if sys.platform == 'darwin' else rss / 2**10  # bytes on macOS, KiB on Linux
+
+
+def run_kitsune(path, args):
+    with contextlib.redirect_stdout(io.StringIO()):
+        from Kitsune import Kitsune
+    from KitNET.calibrator import thresholdCalibrator, scoreStore
+    import pcapParser
+    stages = dict()
+
+    # the parser alone (a separate pass over the capture), for the breakdown of the feature extraction time
+    if not path.endswith('.tsv'):
+        start = time.perf_counter()
+        with open(path, 'rb') as f:
+            n = 0
+            for _ in pcapParser.read_file(f, path):
+                n += 1
+                if n == args.limit:
+                    break
+        stages['parse (separate pass)'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        K = Kitsune(path, args.limit, 10, args.fm_grace, args.ad_grace)
+        calibrator = thresholdCalibrator(store=scoreStore())
+        X = np.empty((1000, K.FE.get_num_features()))
+        fe = kitnet = calibrate = 0.0
+        while True:
+            t0 = time.perf_counter()
+            Xc = K.FE.get_next_vectors(1000, X)
+            t1 = time.perf_counter()
+            if len(Xc) == 0:
+                break
+            rmses = K.AnomDetector.process_batch(Xc)
+            t2 = time.perf_counter()
+            calibrator.process_batch(rmses)
+            t3 = time.perf_counter()
+            fe, kitnet, calibrate = fe + t1 - t0, kitnet + t2 - t1, calibrate + t3 - t2
+    wall = time.perf_counter() - start
+    stages.update({'features (parse + AfterImage)': fe, 'KitNET': kitnet, 'calibration': calibrate})
+    return {'items': K.FE.curPacketIndx, 'unit': 'packets', 'wall_s': wall, 'stages_s': stages,
+            'parser': K.FE.parse_type if K.FE.tshark is None else 'tshark_pipe'}
+
+
+def run_rforest(path, args):
+    import joblib
+    os.chdir(RFOREST_DIR)
+    page = page_functions('app.py', ['process_data', 'make_predictions'])
+    t0 = time.perf_counter()
+    model = joblib.load('best_model_resaved.pkl')  # (as load_model)
+    predictor_names = joblib.load('predictor_names_resaved.pkl')
+    t1 = time.perf_counter()
+    X, df = page['process_data'](path, predictor_names)
+    t2 = time.perf_counter()
+    page['make_predictions'](model, X)
+    t3 = time.perf_counter()
+    return {'items': len(df), 'unit': 'rows', 'wall_s': t3 - t0,
+            'stages_s': {'load_model': t1 - t0, 'process_data': t2 - t1, 'make_predictions': t3 - t2}}
+
+
+def run_visualize(path, args):
+    import dpkt
+    import folium
+    import pygeoip
+    os.chdir(VISUALIZE_DIR)
+    page = page_functions('visualize.py', ['plotIPs', 'retKML'])
+    t0 = time.perf_counter()
+    page['gi'] = pygeoip.GeoIP('GeoLiteCity.dat')
+    page['mymap'] = folium.Map(location=[0, 0], zoom_start=4)
+    t1 = time.perf_counter()
+    n = [0]
+
+    def counted(reader):
+        for item in reader:
+            n[0] += 1
+            if n[0] > args.limit:
+                return
+            yield item
+    with open(path, 'rb') as f:
+        page['plotIPs'](counted(dpkt.pcap.Reader(f)), None)
+    t2 = time.perf_counter()
+    page['mymap']._repr_html_()
+    t3 = time.perf_counter()
+    return {'items': min(n[0], args.limit), 'unit': 'packets', 'wall_s': t3 - t0,
+            'stages_s': {'load GeoIP + map': t1 - t0, 'plotIPs': t2 - t1, 'render map': t3 - t2}}
+
+
+runners = {'kitsune': run_kitsune, 'rforest': run_rforest, 'visualize': run_visualize}
+
+
+# runs one (workload, input) in this (fresh) process, and puts its result in queue
+def worker(workload, path, args, queue):
+    try:
+        if KITSUNE_DIR not in sys.path:
+            sys.path.insert(0, KITSUNE_DIR)
+        result = runners[workload](path, args)
+        result['status'] = 'ok'
+        result['per_s'] = result['items'] / result['wall_s'] if result['wall_s'] > 0 else None
+        result['peak_rss_mb'] = peak_rss_mb()
+    except Exception:
+        result = {'status': 'error', 'error': traceback.format_exc()}
+    queue.put(result)
+
+
+def run(workload, path, args):
+    reason = skip_reason(workload, path)
+    if reason is not None:
+        return {'status': 'skipped', 'reason': reason}
+    ctx = mp.get_context('spawn')
+    results = ctx.Queue()
+    p = ctx.Process(target=worker, args=(workload, path, args, results))
+    p.start()
+    while True:
+        try:
+            result = results.get(timeout=1.0)
+            break
+        except queue.Empty:
+            if not p.is_alive() and results.empty():
+                result = {'status': 'error', 'error': "the process exited with code " + str(p.exitcode)}
+                break
+    p.join()
+    return result
+
+
+def version():
+    try:
+        import subprocess
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], stderr=subprocess.DEVNULL, cwd=ROOT).decode().strip()
+    except Exception:
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="End-to-end benchmark of the pages on the rep/ captures")
+    parser.add_argument('--workloads', nargs='*', default=['kitsune', 'rforest', 'visualize'], choices=list(runners))
+    parser.add_argument('--pcaps', nargs='*', default=PCAPS, help="the captures (relative to the repository root) for kitsune and visualize")
+    parser.add_argument('--csvs', nargs='*', default=CSVS, help="the flow CSVs (relative to the repository root) for rforest")
+    parser.add_argument('--limit', type=float, default=np.inf, help="the maximum number of packets to process per capture")
+    parser.add_argument('--fm-grace', type=int, default=5000)
+    parser.add_argument('--ad-grace', type=int, default=50000)
+    parser.add_argument('--json', default=None, help="write the report to this file")
+    parser.add_argument('--baseline', default=None, help="a report of an earlier run, to compare with")
+    args = parser.parse_args()
+
+    baseline = dict()
+    if args.baseline is not None:
+        with open(args.baseline) as f:
+            baseline = dict([((r['workload'], r['file']), r) for r in json.load(f)['runs']])
+
+    runs = []
+    for workload in args.workloads:
+        for file in (args.csvs if workload == 'rforest' else args.pcaps):
+            result = run(workload, os.path.join(ROOT, file), args)
+            result.update({'workload': workload, 'file': file})
+            runs.append(result)
+            if result['status'] == 'ok':
+                line = "%-10s %-32s %8.1f s %10.0f %s/s  peak RSS %s MB" % (workload, file, result['wall_s'], result['per_s'], result['unit'],
+                                                                           "%.0f" % result['peak_rss_mb'] if result['peak_rss_mb'] else "?")
+                old = baseline.get((workload, file))
+                if old is not None and old.get('status') == 'ok':
+                    line += "  (%+.1f%% wall time)" % (100 * (result['wall_s'] / old['wall_s'] - 1))
+                print(line)
+                for stage, t in result['stages_s'].items():
+                    print("    %-34s %8.2f s" % (stage, t))
+            elif result['status'] == 'skipped':
+                print("%-10s %-32s skipped: %s" % (workload, file, result['reason']))
+            else:
+                print("%-10s %-32s error:\n%s" % (workload, file, result['error']))
+
+    if args.json is not None:
+        report = {'version': version(), 'python': platform.python_version(), 'numpy': np.__version__,
+                  'machine': platform.machine(), 'cpus': os.cpu_count(),
+                  'limit': None if args.limit == np.inf else args.limit, 'fm_grace': args.fm_grace, 'ad_grace': args.ad_grace,
+                  'runs': runs}
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,70 @@
+# Checks that AfterImage's vectorized backend (incStatDB_vec, netStat(vectorized=True)) extracts the same features as
+# the reference incStatDB (netStat(vectorized=False)): synthetic traces (benchmarks/synth.trace) are fed through both.
+# The backends round their decays differently in the last place (NumPy's exp2 vs. math.pow), so every feature must match
+# to within --tol of its range over the trace (KitNET normalizes each feature by its range), with NaNs in the same
+# places, and both must evict the same streams. The correlation coefficients (pcc) are only checked for NaNs: they divide by the product of two
+# stds, which is rounding noise for a stream of near-constant values, so they amplify any last-place difference without
+# bound (their inputs, the covariance and the stds, are checked). The cases cover the default configuration, a high
+# fan-out trace (hosts each talking to hundreds of peers), and eviction, by a periodic cleanup and by a cap on the records
+# of each table (both backends evict whole streams, see incStatDB). Raises an AssertionError at the first vector that
+# differs.
+#
+# usage: python -m benchmarks.parity [--packets 20000] [--tol 1e-9]
+import argparse
+import numpy as np
+import netStat as ns
+from benchmarks import synth
+
+# name -> (trace arguments, netStat arguments)
+cases = {
+    'default': ({'hosts': 100}, {}),
+    'high fan-out': ({'hosts': 1000, 'fanout': 500}, {}),
+    # (a cutoff close to 1, so that streams which got packets expire too, not only the streams never sent from)
+    'eviction (cleanup)': ({'hosts': 300}, {'cleanupInterval': 500, 'cutoffWeight': 0.9}),
+    'eviction (record limit)': ({'hosts': 300}, {'RecordLimit': 200}),
+    'high fan-out, eviction': ({'hosts': 1000, 'fanout': 500}, {'cleanupInterval': 100, 'cutoffWeight': 3, 'RecordLimit': 5000}),
+    'feature groups': ({'hosts': 100}, {'config': ns.netStatConfig(Lambdas=[5, 3, 1], H=True, HpHp=False)}),
+}
+
+
+# the number of vectors compared and the largest difference found, relative to the feature's range (all within tol,
+# otherwise it raises)
+def check(trace_args, stat_args, n, seed, tol):
+    args = synth.stats_args(synth.trace(n, seed=seed, **trace_args))
+    ref = ns.netStat(HostLimit=10**11, HostSimplexLimit=10**11, vectorized=False, **stat_args)
+    vec = ns.netStat(HostLimit=10**11, HostSimplexLimit=10**11, vectorized=True, **stat_args)
+    X_ref, X_vec = np.empty((len(args), ref.n_features)), np.empty((len(args), vec.n_features))
+    for i, p in enumerate(args):
+        ref.updateGetStats(*p, out=X_ref[i])
+        vec.updateGetStats(*p, out=X_vec[i])
+    pcc = np.array(['_pcc_' in name for name in ref.getNetStatHeaders()])
+    nan = np.isnan(X_ref)
+    span = np.nanmax(X_ref, axis=0, initial=-np.inf) - np.nanmin(X_ref, axis=0, initial=np.inf)
+    span = np.where(np.isfinite(span) & (span > 0), span, 1.0) # (a constant feature: its absolute difference)
+    err = np.where(nan | pcc, 0.0, np.abs(X_ref - X_vec)) / span
+    bad = (nan != np.isnan(X_vec)) | (err > tol)
+    if bad.any():
+        i = np.flatnonzero(bad.any(axis=1))[0]
+        differ = np.flatnonzero(bad[i])[:10]
+        raise AssertionError("packet %d: features %s differ (ref %s, vec %s)" % (i, differ.tolist(), X_ref[i, differ], X_vec[i, differ]))
+    worst = err.max(initial=0.0)
+    # (the reference counts the records of the evicted streams: one per Lambda of the table)
+    for HT_ref, HT_vec in zip(ref.getHTs(), vec.getHTs()):
+        if HT_ref.n_evicted != HT_vec.n_evicted * len(HT_vec.Lambdas):
+            raise AssertionError("the backends evicted different streams (%d records by ref, %d streams by vec)" % (HT_ref.n_evicted, HT_vec.n_evicted))
+    return len(args), worst, vec.getNumEvicted()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="incStatDB_vec vs. incStatDB feature parity")
+    parser.add_argument('--packets', type=int, default=20000)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--tol', type=float, default=1e-9, help="the largest difference allowed, relative to the feature's range")
+    args = parser.parse_args()
+    for name, (trace_args, stat_args) in cases.items():
+        n, worst, evicted = check(trace_args, stat_args, args.packets, args.seed, args.tol)
+        print("%-24s %d vectors match (largest difference %.1e of range, %d streams evicted by both)" % (name, n, worst, evicted))
+
+
+if __name__ == '__main__':
+    main()
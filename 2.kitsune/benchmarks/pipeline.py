@@ -0,0 +1,69 @@
+# Compares the serial Kitsune (Kitsune.proc_next_batch) with the pipelined one (pipeline.KitsunePipeline), and reports
+# the time of each stage alone: on a machine with two free cores, the pipeline takes about as long as its slower stage
+# (feature extraction or KitNET), instead of their sum.
+#
+# usage: python -m benchmarks.pipeline --capture capture.pcap [--packets 20000] [--chunk 1000] [--slots 4]
+import argparse
+import contextlib
+import io
+import os
+import time
+import numpy as np
+from FeatureExtractor import FE
+from Kitsune import Kitsune
+from KitNET.KitNET import KitNET
+from pipeline import KitsunePipeline
+
+
+def drain(proc):
+    out = []
+    while True:
+        rmses = proc()
+        if len(rmses) == 0:
+            return np.concatenate(out) if out else np.empty(0)
+        out.append(rmses)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Kitsune: serial vs. pipelined")
+    parser.add_argument('--capture', default='../rep/myoffice1000.pcapng', help="a pcap, pcapng or tsv file")
+    parser.add_argument('--packets', type=int, default=20000)
+    parser.add_argument('--chunk', type=int, default=1000)
+    parser.add_argument('--slots', type=int, default=4)
+    args = parser.parse_args()
+    FMgrace, ADgrace = args.packets // 20, args.packets // 5
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        # the stages alone
+        fe = FE(args.capture, args.packets)
+        start = time.perf_counter()
+        X = fe.get_next_vectors(args.packets)
+        t_fe = time.perf_counter() - start
+        K = KitNET(X.shape[1], 10, FMgrace, ADgrace)
+        start = time.perf_counter()
+        for i in range(0, len(X), args.chunk):
+            K.process_batch(X[i:i + args.chunk])
+        t_kitnet = time.perf_counter() - start
+
+        # serial
+        K = Kitsune(args.capture, args.packets, 10, FMgrace, ADgrace)
+        start = time.perf_counter()
+        serial = drain(lambda: K.proc_next_batch(args.chunk))
+        t_serial = time.perf_counter() - start
+
+        # pipelined (including starting the producer process)
+        start = time.perf_counter()
+        with KitsunePipeline(args.capture, args.packets, 10, FMgrace, ADgrace, chunk_size=args.chunk, n_slots=args.slots) as P:
+            piped = drain(P.proc_next_batch)
+        t_piped = time.perf_counter() - start
+
+    n = len(serial)
+    print("packets: %d, cores: %d, identical scores: %s" % (n, os.cpu_count(), np.array_equal(serial, piped)))
+    print("feature extraction alone: %8.0f packets/sec" % (n / t_fe))
+    print("KitNET alone:             %8.0f packets/sec" % (n / t_kitnet))
+    print("serial:                   %8.0f packets/sec" % (n / t_serial))
+    print("pipelined:                %8.0f packets/sec (bound: %.0f)" % (n / t_piped, n / max(t_fe, t_kitnet)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,84 @@
+# Checks that the native pcap/pcapng parser, and Kitsune's checkpoints, resume from a saved offset exactly where they
+# left off, on synthetic captures (benchmarks/synth.trace): a pcap, a pcapng, and a pcapng whose interface sets the
+# if_tsoffset option (whose value must only shift the timestamps, not the resume offset).
+#  - parser: the packets read from the offset of every --stride'th record are the remaining packets of a full read
+#  - Kitsune: the scores of a run checkpointed (save_checkpoint) and resumed (load_checkpoint) at --split are those of an
+#    uninterrupted run
+# Raises an AssertionError at the first mismatch.
+#
+# usage: python -m benchmarks.resume [--packets 3000] [--hosts 30] [--stride 97] [--split 2000]
+import argparse
+import contextlib
+import io
+import os
+import tempfile
+import numpy as np
+import pcapParser
+from Kitsune import Kitsune
+from benchmarks import synth
+
+
+# the packets of the capture, and the offset of the record after each of them (where a resume continues from)
+def read_all(path):
+    rows, offsets = [], []
+    with open(path, 'rb') as f:
+        for row in pcapParser.read_file(f, path):
+            rows.append(row)
+            offsets.append(f.tell())
+    return rows, offsets
+
+
+def check_parser(path, n, stride):
+    rows, offsets = read_all(path)
+    assert len(rows) == n, "%s: %d of %d packets read" % (path, len(rows), n)
+    for i in range(0, n, stride):
+        with open(path, 'rb') as f:
+            rest = list(pcapParser.read_file(f, path, offsets[i]))
+        assert rest == rows[i + 1:], "%s: resuming after packet %d gives different packets" % (path, i)
+    return rows
+
+
+def check_kitsune(path, n, split, tmp):
+    def kitsune():
+        return Kitsune(path, np.inf, 10, n // 10, n // 2)
+    with contextlib.redirect_stdout(io.StringIO()):
+        K = kitsune() # (in the same batches: a batch boundary changes the rounding of the batched execution)
+        ref = np.concatenate([K.proc_next_batch(split), K.proc_next_batch(n)])
+        K = kitsune()
+        first = K.proc_next_batch(split)
+        checkpoint = os.path.join(tmp, 'kitsune.ckpt')
+        K.save_checkpoint(checkpoint)
+        K = kitsune()
+        K.load_checkpoint(checkpoint)
+        rest = K.proc_next_batch(n)
+    assert np.array_equal(np.concatenate([first, rest]), ref), "%s: the scores after a resume at %d differ" % (path, split)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Resuming the parser and Kitsune from a saved offset")
+    parser.add_argument('--packets', type=int, default=3000)
+    parser.add_argument('--hosts', type=int, default=30)
+    parser.add_argument('--stride', type=int, default=97, help="check a resume after every stride'th packet")
+    parser.add_argument('--split', type=int, default=2000, help="the packet Kitsune is checkpointed at")
+    args = parser.parse_args()
+
+    tr = synth.trace(args.packets, args.hosts)
+    with tempfile.TemporaryDirectory() as tmp:
+        paths = {'pcap': os.path.join(tmp, 'trace.pcap'), 'pcapng': os.path.join(tmp, 'trace.pcapng'),
+                 'pcapng, if_tsoffset': os.path.join(tmp, 'trace_tsoffset.pcapng')}
+        synth.write_pcap(paths['pcap'], tr)
+        synth.write_pcapng(paths['pcapng'], tr)
+        synth.write_pcapng(paths['pcapng, if_tsoffset'], tr, ts_offset=1000)
+
+        rows = dict()
+        for name, path in paths.items():
+            rows[name] = check_parser(path, args.packets, args.stride)
+            check_kitsune(path, args.packets, args.split, tmp)
+            print("%-20s resume: ok (%d packets)" % (name, args.packets))
+        # the same packets in every format: if_tsoffset is applied to the timestamps
+        assert rows['pcapng'] == rows['pcap'] and rows['pcapng, if_tsoffset'] == rows['pcap'], "the formats give different packets"
+        print("pcap, pcapng and pcapng with if_tsoffset give the same packets")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,241 @@
+# Micro-benchmarks of each stage of Kitsune's per-packet hot path, on a synthetic trace (benchmarks/synth.trace):
+#  - incStat.insert: one damped window of one stream
+#  - incStatDB.update_get_1D2D_Stats: the 1D and 2D stats of a channel, over all the Lambdas (the reference backend
+#    takes one call per Lambda, incStatDB_vec one call)
+#  - netStat.updateGetStats: all of AfterImage's features (both backends)
+#  - FE.get_next_vector: parsing + netStat, from a pcap (native parser) and from a tsv
+#  - dA.train / dA.execute: one autoencoder of 10 visible units
+#  - KitNET.process: in each phase (feature mapping, training, execution)
+# For each stage it reports:
+#  - ns_per_packet: the wall time per packet (the best of --repeat runs, each on a fresh state)
+#  - blocks_per_packet: the net number of memory blocks the stage keeps allocated per packet (sys.getallocatedblocks),
+#    i.e., how fast its state grows. (CPython has no counter of all the allocations made, only of the live ones.)
+#  - bytes_per_packet: the net bytes kept allocated per packet, and peak_bytes: the high-water mark of the
+#    temporary allocations (tracemalloc, measured in a separate run, as tracing slows the stage down)
+# The results can be written as JSON (--json), and compared with an earlier run (--baseline) to track regressions.
+#
+# usage: python -m benchmarks.stages [--packets 20000] [--hosts 100] [--fanout F] [--stages netStat FE ...] [--json out.json] [--baseline old.json]
+import argparse
+import contextlib
+import gc
+import io
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+import numpy as np
+import AfterImage as af
+import netStat as ns
+from FeatureExtractor import FE
+from KitNET.KitNET import KitNET
+import KitNET.corClust as CC
+from KitNET.dA import dA, dA_params
+from benchmarks import synth
+
+Lambdas = [5, 3, 1, .1, .01]
+
+
+# Each stage is set up by a function of the benchmark's context, which returns (fn, items): the stage runs fn(*item)
+# for every item, one per packet. The state is built by the setup, so each run starts afresh.
+def incStat_insert(ctx):
+    s = af.incStat(Lambdas[0], 0)
+    return s.insert, [(p[7], p[8]) for p in ctx.args]
+
+
+def incStatDB_ref(ctx):
+    db = af.incStatDB(limit=np.inf)
+    def update(a, b, t, v):
+        for l in Lambdas:
+            db.update_get_1D2D_Stats(a, b, t, v, l)
+    return update, ctx.channels
+
+
+def incStatDB_vec(ctx):
+    db = af.incStatDB_vec(Lambdas)
+    out = np.empty(7 * len(Lambdas))
+    return (lambda a, b, t, v: db.update_get_1D2D_Stats(a, b, t, v, out)), ctx.channels
+
+
+def netStat_ref(ctx):
+    return netStat_(ctx, False)
+
+
+def netStat_vec(ctx):
+    return netStat_(ctx, True)
+
+
+def netStat_(ctx, vectorized):
+    nstat = ns.netStat(np.nan, 10**11, 10**11, vectorized)
+    out = np.empty(nstat.n_features)
+    return (lambda *p: nstat.updateGetStats(*p, out=out)), ctx.args
+
+
+def FE_pcap(ctx):
+    return FE_(ctx, ctx.pcap)
+
+
+def FE_tsv(ctx):
+    return FE_(ctx, ctx.tsv)
+
+
+def FE_(ctx, path):
+    with contextlib.redirect_stdout(io.StringIO()):
+        fe = FE(path)
+    out = np.empty(fe.get_num_features())
+    return (lambda: fe.get_next_vector(out)), [()] * len(ctx.args)
+
+
+def dA_(ctx):
+    return dA(dA_params(n_visible=10, n_hidden=7, lr=0.1, gracePeriod=0))
+
+
+def dA_train(ctx):
+    return dA_(ctx).train, [(x,) for x in ctx.X[:, :10]]
+
+
+def dA_execute(ctx):
+    ae = dA_(ctx)
+    for x in ctx.X[:, :10]:
+        ae.train(x)
+    return ae.execute, [(x,) for x in ctx.X[:, :10]]
+
+
+def KitNET_(ctx, FMgrace, ADgrace, feature_map=None):
+    with contextlib.redirect_stdout(io.StringIO()):
+        return KitNET(ctx.X.shape[1], 10, FMgrace, ADgrace, feature_map=feature_map)
+
+
+def KitNET_FM(ctx):
+    K = KitNET_(ctx, len(ctx.X), 0)
+    return K.process, [(x,) for x in ctx.X]
+
+
+def KitNET_train(ctx):
+    K = KitNET_(ctx, 0, len(ctx.X), ctx.feature_map)
+    return K.process, [(x,) for x in ctx.X]
+
+
+def KitNET_execute(ctx):
+    K = KitNET_(ctx, 0, len(ctx.X) - 1, ctx.feature_map)
+    with contextlib.redirect_stdout(io.StringIO()):
+        for x in ctx.X:
+            K.process(x)
+    return K.process, [(x,) for x in ctx.X]
+
+
+stages = [
+    ('incStat.insert', incStat_insert),
+    ('incStatDB.update_get_1D2D_Stats', incStatDB_ref),
+    ('incStatDB_vec.update_get_1D2D_Stats', incStatDB_vec),
+    ('netStat.updateGetStats (ref)', netStat_ref),
+    ('netStat.updateGetStats (vec)', netStat_vec),
+    ('FE.get_next_vector (pcap)', FE_pcap),
+    ('FE.get_next_vector (tsv)', FE_tsv),
+    ('dA.train', dA_train),
+    ('dA.execute', dA_execute),
+    ('KitNET.process (feature mapping)', KitNET_FM),
+    ('KitNET.process (training)', KitNET_train),
+    ('KitNET.process (execution)', KitNET_execute),
+]
+
+
+# the trace and its derived inputs, shared by the stages
+class context:
+    def __init__(self, args, tmp):
+        trace = synth.trace(args.packets, args.hosts, args.fanout, seed=args.seed)
+        self.args = synth.stats_args(trace)
+        self.channels = [(a, b, t / 10**6, size) for t, size, _, a, b, _, _ in trace]
+        self.pcap = os.path.join(tmp, 'trace.pcap')
+        self.tsv = os.path.join(tmp, 'trace.tsv')
+        synth.write_pcap(self.pcap, trace)
+        synth.write_tsv(self.tsv, trace)
+        nstat = ns.netStat(np.nan, 10**11, 10**11, True)
+        self.X = np.empty((len(self.args), nstat.n_features))
+        for i, p in enumerate(self.args):
+            nstat.updateGetStats(*p, out=self.X[i])
+        FM = CC.corClust(self.X.shape[1])
+        FM.update_batch(self.X)
+        self.feature_map = FM.cluster(10)
+
+
+def run(fn, items):
+    start = time.perf_counter_ns()
+    for item in items:
+        fn(*item)
+    return time.perf_counter_ns() - start
+
+
+def measure(setup, ctx, repeat):
+    n = len(ctx.args)
+    best = min([run(*setup(ctx)) for _ in range(repeat)])
+
+    # the memory: on a fresh state, with the garbage collector settled before and after
+    fn, items = setup(ctx)
+    gc.collect()
+    blocks = sys.getallocatedblocks()
+    tracemalloc.start()
+    base = tracemalloc.get_traced_memory()[0]
+    run(fn, items)
+    gc.collect()
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    blocks = sys.getallocatedblocks() - blocks
+    return {'ns_per_packet': best / n, 'blocks_per_packet': blocks / n,
+            'bytes_per_packet': (current - base) / n, 'peak_bytes': peak - base}
+
+
+def version():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], stderr=subprocess.DEVNULL,
+                                       cwd=os.path.dirname(os.path.abspath(__file__))).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Kitsune per-stage micro-benchmarks")
+    parser.add_argument('--packets', type=int, default=20000)
+    parser.add_argument('--hosts', type=int, default=100)
+    parser.add_argument('--fanout', type=int, default=None, help="the number of peers of each host (default: any host)")
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--stages', nargs='*', default=None, help="run only the stages whose name starts with one of these")
+    parser.add_argument('--json', default=None, help="write the results to this file")
+    parser.add_argument('--baseline', default=None, help="a JSON file of an earlier run, to compare with")
+    args = parser.parse_args()
+
+    selected = [(name, setup) for name, setup in stages if args.stages is None or any([name.startswith(s) for s in args.stages])]
+    if len(selected) == 0:
+        raise ValueError("no stage matches " + str(args.stages) + " (the stages: " + ", ".join([name for name, _ in stages]) + ")")
+    baseline = None
+    if args.baseline is not None:
+        with open(args.baseline) as f:
+            baseline = json.load(f)['stages']
+
+    with tempfile.TemporaryDirectory() as tmp:
+        ctx = context(args, tmp)
+        results = dict()
+        print("%-40s %12s %10s %10s %12s" % ("stage", "ns/packet", "blocks/pkt", "bytes/pkt", "peak bytes") + ("  vs. baseline" if baseline else ""))
+        for name, setup in selected:
+            r = measure(setup, ctx, args.repeat)
+            results[name] = r
+            line = "%-40s %12.0f %10.3f %10.1f %12d" % (name, r['ns_per_packet'], r['blocks_per_packet'], r['bytes_per_packet'], r['peak_bytes'])
+            if baseline is not None and name in baseline:
+                line += "  %+6.1f%%" % (100 * (r['ns_per_packet'] / baseline[name]['ns_per_packet'] - 1))
+            print(line)
+
+    if args.json is not None:
+        report = {'version': version(), 'python': platform.python_version(), 'numpy': np.__version__,
+                  'machine': platform.machine(), 'cpus': os.cpu_count(),
+                  'trace': {'packets': args.packets, 'hosts': args.hosts, 'fanout': args.fanout, 'seed': args.seed},
+                  'stages': results}
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,155 @@
+# Synthetic traffic for the benchmarks: one deterministic generator (trace) of packets between a pool of hosts, with
+# configurable host count, fan-out and protocol mix, in the form taken by netStat.updateGetStats (stats_args), or written
+# to a pcap, pcapng or tshark tsv file.
+import argparse
+import random
+import socket
+import struct
+
+
+# A configurable synthetic trace, which can also be written to a pcap or a tshark tsv file (to benchmark the parsers
+# and FE end to end). Deterministic: the same arguments give the same trace.
+# hosts: the number of hosts, fanout: the number of peers each host talks to (None: any host),
+# mix: the share of each protocol (tcp, udp, icmp, arp), burst: the share of packets sharing the previous packet's timestamp.
+# Each packet is a tuple (time in microseconds, frame length, protocol, src host, dst host, src port, dst port).
+DEFAULT_MIX = {'tcp': 0.6, 'udp': 0.3, 'icmp': 0.05, 'arp': 0.05}
+SERVICES = {'tcp': [80, 443, 22, 8080], 'udp': [53, 123, 5353]}
+
+
+def trace(n, hosts=30, fanout=None, mix=None, burst=0.05, seed=1):
+    rnd = random.Random(seed)
+    mix = DEFAULT_MIX if mix is None else mix
+    protos, weights = list(mix.keys()), list(mix.values())
+    if fanout is None or fanout >= hosts:
+        peers = None
+    else:
+        peers = [rnd.sample(range(hosts), fanout) for _ in range(hosts)]
+    t = 1600000000 * 10**6
+    out = []
+    for i in range(n):
+        t += 0 if rnd.random() < burst else max(1, int(rnd.expovariate(50) * 10**6))
+        a = rnd.randrange(hosts)
+        b = rnd.randrange(hosts) if peers is None else rnd.choice(peers[a])
+        proto = rnd.choices(protos, weights)[0]
+        sp = dp = 0
+        if proto in SERVICES:
+            sp, dp = rnd.randrange(1024, 65536), rnd.choice(SERVICES[proto])
+            if rnd.random() < 0.5:  # a response
+                a, b, sp, dp = b, a, dp, sp
+        size = rnd.choice([60, 60, 1514, rnd.randrange(60, 1515)])
+        out.append((t, size, proto, a, b, sp, dp))
+    return out
+
+
+def mac(h):
+    return '02:00:00:00:%02x:%02x' % (h // 256, h % 256)
+
+
+def ip(h):
+    return '10.%d.%d.%d' % (h // 65536, h // 256 % 256, h % 256)
+
+
+# the trace, in the form taken by netStat.updateGetStats (as FE resolves the fields of each packet)
+def stats_args(trace):
+    out = []
+    for t, size, proto, a, b, sp, dp in trace:
+        if proto in SERVICES:
+            srcproto, dstproto = str(sp), str(dp)
+        else:
+            srcproto = dstproto = proto
+        out.append((0, mac(a), mac(b), ip(a), srcproto, ip(b), dstproto, size, t / 10**6))
+    return out
+
+
+# the Ethernet frame of a packet (padded to its frame length)
+def frame(size, proto, a, b, sp, dp):
+    if proto == 'arp':
+        payload = struct.pack('!HHBBH6s4s6s4s', 1, 0x0800, 6, 4, 1, bytes.fromhex(mac(a).replace(':', '')), socket.inet_aton(ip(a)),
+                              bytes(6), socket.inet_aton(ip(b)))
+        etype = 0x0806
+    else:
+        if proto == 'tcp':
+            l4, num = struct.pack('!HHIIBBHHH', sp, dp, 0, 0, 0x50, 0x18, 1024, 0, 0), 6
+        elif proto == 'udp':
+            l4, num = struct.pack('!HHHH', sp, dp, max(8, size - 34), 0), 17
+        else:
+            l4, num = struct.pack('!BBHI', 8, 0, 0, 0), 1
+        l3 = struct.pack('!BBHHHBBH4s4s', 0x45, 0, max(20 + len(l4), size - 14), 0, 0, 64, num, 0, socket.inet_aton(ip(a)), socket.inet_aton(ip(b)))
+        payload, etype = l3 + l4, 0x0800
+    data = bytes.fromhex(mac(b).replace(':', '')) + bytes.fromhex(mac(a).replace(':', '')) + struct.pack('!H', etype) + payload
+    return data + bytes(max(0, size - len(data)))
+
+
+# writes the trace to a (microsecond, Ethernet) pcap file
+def write_pcap(path, trace):
+    with open(path, 'wb') as f:
+        f.write(struct.pack('<IHHiIII', 0xa1b2c3d4, 2, 4, 0, 0, 65535, 1))
+        for t, size, proto, a, b, sp, dp in trace:
+            data = frame(size, proto, a, b, sp, dp)
+            f.write(struct.pack('<IIII', t // 10**6, t % 10**6, len(data), len(data)))
+            f.write(data)
+
+
+# writes the trace to a (little-endian, microsecond, Ethernet) pcapng file: a section header, one interface description
+# and an enhanced packet block per packet. ts_offset: the interface's if_tsoffset option, in seconds (the timestamps are
+# stored relative to it, and the readers add it back)
+def write_pcapng(path, trace, ts_offset=0):
+    def block(btype, body):
+        body += bytes(-len(body) % 4)
+        return struct.pack('<II', btype, len(body) + 12) + body + struct.pack('<I', len(body) + 12)
+    options = struct.pack('<HHqHH', 14, 8, ts_offset, 0, 0) if ts_offset != 0 else b''
+    with open(path, 'wb') as f:
+        f.write(block(0x0A0D0D0A, struct.pack('<IHHq', 0x1A2B3C4D, 1, 0, -1)))
+        f.write(block(1, struct.pack('<HHI', 1, 0, 65535) + options))
+        for t, size, proto, a, b, sp, dp in trace:
+            data = frame(size, proto, a, b, sp, dp)
+            ts = t - ts_offset * 10**6
+            f.write(block(6, struct.pack('<IIIII', 0, ts >> 32, ts & 0xFFFFFFFF, len(data), len(data)) + data))
+
+
+# writes the trace to a tsv file, with the columns tshark gives FE (see FeatureExtractor.tshark_fields)
+def write_tsv(path, trace):
+    with open(path, 'w', encoding='utf8') as f:
+        f.write('\t'.join(['c%d' % i for i in range(19)]) + '\n')
+        for t, size, proto, a, b, sp, dp in trace:
+            row = [''] * 19
+            row[0], row[1], row[2], row[3] = "%d.%06d000" % (t // 10**6, t % 10**6), str(size), mac(a), mac(b)
+            if proto == 'arp':
+                row[12], row[13], row[14], row[15], row[16] = '1', mac(a), ip(a), '00:00:00:00:00:00', ip(b)
+            else:
+                row[4], row[5] = ip(a), ip(b)
+                if proto == 'tcp':
+                    row[6], row[7] = str(sp), str(dp)
+                elif proto == 'udp':
+                    row[8], row[9] = str(sp), str(dp)
+                else:
+                    row[10], row[11] = '8', '0'
+            f.write('\t'.join(row) + '\n')
+
+
+# usage: python -m benchmarks.synth out.pcap|out.pcapng|out.tsv [--packets 100000] [--hosts 30] [--fanout F] [--mix tcp=.6,udp=.3,icmp=.05,arp=.05]
+def main():
+    parser = argparse.ArgumentParser(description="Writes a synthetic trace to a pcap, pcapng or tsv file")
+    parser.add_argument('path', help="the output file (.pcap, .pcapng or .tsv)")
+    parser.add_argument('--packets', type=int, default=100000)
+    parser.add_argument('--hosts', type=int, default=30)
+    parser.add_argument('--fanout', type=int, default=None)
+    parser.add_argument('--mix', default=None, help="the protocol shares, e.g., tcp=.6,udp=.3,icmp=.05,arp=.05")
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+    mix = None
+    if args.mix is not None:
+        mix = dict([(k, float(v)) for k, v in [kv.split('=') for kv in args.mix.split(',')]])
+        if not set(mix) <= set(DEFAULT_MIX):
+            raise ValueError("unknown protocols in --mix (expected: " + ", ".join(DEFAULT_MIX) + ")")
+    tr = trace(args.packets, args.hosts, args.fanout, mix, seed=args.seed)
+    if args.path.endswith('.tsv'):
+        write_tsv(args.path, tr)
+    elif args.path.endswith('.pcapng'):
+        write_pcapng(args.path, tr)
+    else:
+        write_pcap(args.path, tr)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,76 @@
+import os
+import pickle
+import numpy as np
+
+# The checkpoint format of the Kitsune pipeline (see Kitsune.save_checkpoint).
+# A checkpoint is a stream of records written one after the other: the magic string and format version, followed by
+# each component's state (FE.save_state, netStat.save_state, ...), as small pickled objects (parameters, counters and
+# chunks of Python lists) and NumPy arrays (in the .npy format). Nothing needs to be seeked, so a checkpoint is written
+# and read sequentially: large tables are streamed out column by column, and chunk by chunk, instead of being serialized
+# into one in-memory copy first.
+# Note: like any pickle, only load checkpoints from a trusted source.
+
+MAGIC = b'KITSUNE-CHECKPOINT'
+FORMAT_VERSION = 1
+CHUNK = 65536  # the number of items per chunk of a long list (or of a table's rows)
+
+
+class checkpointWriter:
+    # f: a binary file object, opened for writing
+    def __init__(self, f):
+        self.f = f
+        self.chunk = CHUNK
+        self.f.write(MAGIC)
+        self.write_object(FORMAT_VERSION)
+
+    def write_object(self, obj):
+        pickle.dump(obj, self.f, protocol=pickle.HIGHEST_PROTOCOL)
+
+    def write_array(self, arr):
+        np.lib.format.write_array(self.f, np.asarray(arr), allow_pickle=False)
+
+    # a (long) list of Python objects, in chunks of CHUNK items
+    def write_list(self, items):
+        self.write_object(len(items))
+        for i in range(0, len(items), CHUNK):
+            self.write_object(items[i:i + CHUNK])
+
+
+class checkpointReader:
+    # f: a binary file object, opened for reading
+    def __init__(self, f):
+        self.f = f
+        self.chunk = CHUNK
+        if self.f.read(len(MAGIC)) != MAGIC:
+            raise ValueError("Not a Kitsune checkpoint")
+        self.version = self.read_object()
+        if self.version > FORMAT_VERSION:
+            raise ValueError("Kitsune checkpoint format version " + str(self.version) + " is not supported (the latest is " + str(FORMAT_VERSION) + ")")
+
+    def read_object(self):
+        return pickle.load(self.f)
+
+    def read_array(self):
+        return np.lib.format.read_array(self.f, allow_pickle=False)
+
+    def read_list(self):
+        n = self.read_object()
+        items = []
+        while len(items) < n:
+            items.extend(self.read_object())
+        return items
+
+
+# Writes a checkpoint to path with write(writer). The checkpoint is written to a temporary file which then replaces path,
+# so a crash while checkpointing leaves the previous checkpoint intact.
+def save(path, write):
+    tmp = path + '.tmp'
+    with open(tmp, 'wb') as f:
+        write(checkpointWriter(f))
+    os.replace(tmp, path)
+
+
+# Reads the checkpoint at path with read(reader), and returns what read returns
+def load(path, read):
+    with open(path, 'rb') as f:
+        return read(checkpointReader(f))
@@ -1,10 +1,10 @@
 from Kitsune import Kitsune
+from KitNET.calibrator import thresholdCalibrator, scoreStore
 import numpy as np
 import time
 import sys
 from tkinter import filedialog
 import tkinter as tk
-from scipy.stats import norm
 from matplotlib import pyplot as plt
 from matplotlib import cm
 
@@ -25,34 +25,46 @@ maxAE = 10  # maximum size for any autoencoder in the ensemble layer
 FMgrace = 5000  # the number of instances taken to learn the feature mapping (the ensemble's architecture)
 ADgrace = 50000  # the number of instances used to train the anomaly detector (ensemble itself)
 
+# AfterImage params:
+cleanupInterval = 10000  # every this many packets, the streams whose weight has decayed away are evicted (0: keep every stream)
+
 # Build Kitsune
-K = Kitsune(path, packet_limit, maxAE, FMgrace, ADgrace)
+model_path = None  # a KitNET saved by a previous run (K.AnomDetector.save): Kitsune then executes with no grace period
+
+K = Kitsune(path, packet_limit, maxAE, FMgrace, ADgrace, model=model_path, cleanup_interval=cleanupInterval)
+first = FMgrace + ADgrace + 1 if model_path is None else 0  # the first packet with an anomaly score
+
+# Here we demonstrate how one can fit the RMSE scores to a log-normal distribution (useful for finding/setting a cutoff threshold \phi):
+# the calibrator fits it on the scores of the first 100000 packets as they arrive, and rates every packet online.
+# The results are kept in a compact store of arrays (pass a path to scoreStore to also stream them to a file)
+store = scoreStore()
+calibrator = thresholdCalibrator(benign_period=100000 - first, phi=1e-4, store=store)
 
 print("Running Kitsune:")
-RMSEs = []
 i = 0
 start = time.time()
-# Here we process (train/execute) each individual packet.
+# Here we process (train/execute) the packets in chunks of 1000 (each packet is still processed individually by KitNET).
 # In this way, each observation is discarded after performing process() method.
 while True:
-    i += 1
-    if i % 1000 == 0:
-        print(i)
-    rmse = K.proc_next_packet()
-    if rmse == -1:
+    rmses = K.proc_next_batch(1000)
+    if len(rmses) == 0:
         break
-    RMSEs.append(rmse)
+    logprobs, alerts = calibrator.process_batch(rmses)
+    i += len(rmses)
+    print(i, "alerts:", int(alerts.sum()))
 stop = time.time()
 print("Complete. Time elapsed: " + str(stop - start))
 
-# Here we demonstrate how one can fit the RMSE scores to a log-normal distribution (useful for finding/setting a cutoff threshold \phi)
-benignSample = np.log(RMSEs[FMgrace + ADgrace + 1:100000])
-logProbs = norm.logsf(np.log(RMSEs), np.mean(benignSample), np.std(benignSample))
+print("Alerts (log-probability < log(phi)): " + str(int(store.alert().sum())))
+
+# the log-probabilities under the final fit (the online ones of the benign period were rated against the fit so far)
+RMSEs = store.rmse()
+logProbs = calibrator.logprob(RMSEs)
 
 # plot the RMSE anomaly scores
 print("Plotting results")
 plt.figure(figsize=(10, 5))
-fig = plt.scatter(range(FMgrace + ADgrace + 1, len(RMSEs)), RMSEs[FMgrace + ADgrace + 1:], s=0.1, c=logProbs[FMgrace + ADgrace + 1:],cmap='RdYlGn')
+fig = plt.scatter(range(first, len(RMSEs)), RMSEs[first:], s=0.1, c=logProbs[first:],cmap='RdYlGn')
 plt.yscale("log")
 plt.title("Anomaly Scores from Kitsune's Execution Phase")
 plt.ylabel("RMSE (log scaled)")
@@ -0,0 +1,273 @@
+import hashlib
+import json
+import multiprocessing as mp
+import os
+import shutil
+import tempfile
+import threading
+import time
+import traceback
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+# Background Kitsune jobs for the Streamlit page (streamlit.py).
+# An analysis (a capture, its packet limit and grace periods, and optionally a pre-trained model) runs in a worker process
+# of a pool, so the page's script can be rerun (a widget interaction, a browser refresh) without losing or blocking the
+# work: the page only submits the job and polls its progress.
+# Each job has a directory in the cache, named by a hash of its key (the hash of the capture's content, the parameters, and
+# the hash of the model), where the worker writes:
+#  status.json  the job's state ('running', 'done' or 'error'), packets processed, progress and alerts so far (the alerts
+#               of the benign period are counted again, against the final fit, when the job is done)
+#  scores.bin   the RMSE, log-probability and alert flag of every packet, written as they are computed (calibrator.scoreStore),
+#               and rated again against the final fit when the job is done
+#  model.kitnet the trained KitNET (KitNET.save)
+#  plot.png     the plot of the anomaly scores (decimated to a pixel budget, see decimate)
+#  result.json  a summary: the packets processed, the first scored packet, the alerts raised and the log-normal fit
+# A job whose results are in the cache is not run again: submitting the same capture with the same parameters (from any
+# session) returns the finished job at once, or attaches to the job still running.
+# The finished (or failed) jobs not used for MAX_AGE seconds are removed from the cache (see jobRunner.cleanup, run by
+# submit at most once per CLEANUP_INTERVAL).
+
+CHUNK = 1000 # packets processed between status updates
+STATUS = 'status.json'
+SCORES = 'scores.bin'
+MODEL = 'model.kitnet'
+PLOT = 'plot.png'
+RESULT = 'result.json'
+PLOT_BUDGET = 1000 # the plot's x-axis buckets (about its width in pixels)
+BENIGN_PERIOD = 50000 # the scores the log-normal fit is made on (at most half the scores of the packet limit), then frozen
+# jobs run at once: one per core but one (left to the server), so that one long job does not hold up every session's jobs.
+# More workers share the cores (and memory) between the jobs running, each of which then runs slower
+WORKERS = int(os.environ.get('KITSUNE_JOB_WORKERS', max(1, (os.cpu_count() or 2) - 1)))
+MAX_AGE = 7 * 24 * 3600 # seconds a finished job is kept after its last use
+CLEANUP_INTERVAL = 3600
+STREAM_CLEANUP = 10000 # AfterImage evicts the streams that have decayed away every this many packets (bounded memory on long captures)
+
+
+# the SHA-256 of a file's content, read in chunks
+def hash_file(path, chunk=1 << 20):
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(chunk), b''):
+            h.update(block)
+    return h.hexdigest()
+
+
+# the ID of the job with the given key
+def job_id(file_hash, packet_limit, FM_grace, AD_grace, model_hash=None):
+    key = json.dumps([file_hash, float(packet_limit), int(FM_grace), int(AD_grace), model_hash])
+    return hashlib.sha256(key.encode()).hexdigest()[:24]
+
+
+# writes obj as JSON to path, atomically (a poller never reads a partial file)
+def write_json(path, obj):
+    tmp = path + '.tmp'
+    with open(tmp, 'w') as f:
+        json.dump(obj, f)
+    os.replace(tmp, path)
+
+
+def read_json(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+# The indices of the points to plot of a series of scores, reduced to a budget of buckets: in each bucket of consecutive
+# packets, the points of the lowest and highest RMSE (the extent of the bucket's pixel column) and of the lowest
+# log-probability (its most anomalous color): at most 3 points per bucket, however many alerts a flood (a scan, a DoS)
+# raises, and the worst alert of each bucket is among them. A series of at most 3 points per bucket is kept whole
+def decimate(rmses, logprobs, budget=PLOT_BUDGET):
+    n = len(rmses)
+    if n <= 3 * budget:
+        return np.arange(n)
+    size = -(-n // budget) # packets per bucket
+    n_buckets = -(-n // size)
+    pad = n_buckets * size - n # (less than a bucket: the last bucket is never all padding)
+    starts = np.arange(n_buckets) * size
+    picks = []
+    for values, reduce in [(rmses, np.nanargmin), (rmses, np.nanargmax), (logprobs, np.nanargmin)]:
+        padded = np.concatenate([np.asarray(values, dtype=np.float64), np.full(pad, np.nan)]).reshape(n_buckets, size)
+        picks.append(starts + reduce(padded, axis=1))
+    return np.unique(np.concatenate(picks))
+
+
+# Plots the anomaly scores of the packets from first on, colored by their log-probability, and saves the PNG to path.
+# Only the points picked by decimate are drawn
+def plot_scores(path, rmses, logprobs, first, budget=PLOT_BUDGET):
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+    rmses, logprobs = rmses[first:], logprobs[first:]
+    points = decimate(rmses, logprobs, budget)
+    fig, ax = plt.subplots(figsize=(10, 6))
+    scatter = ax.scatter(points + first, rmses[points], s=2, c=logprobs[points], cmap='RdYlGn')
+    ax.set_yscale("log")
+    ax.set_title("Anomaly Scores from Kitsune's Execution Phase", fontsize=16)
+    ax.set_ylabel("RMSE (log scaled)", fontsize=14)
+    ax.set_xlabel("Packet Number", fontsize=14)
+    if len(points) < len(rmses):
+        ax.text(0.99, 0.01, "%d of %d packets shown (extremes per bucket)" % (len(points), len(rmses)),
+                transform=ax.transAxes, ha='right', va='bottom', fontsize=8, alpha=0.6)
+    plt.colorbar(scatter, ax=ax, label='Log Probability', pad=0.15)
+    plt.tight_layout()
+    fig.savefig(path, format='png')
+    plt.close(fig)
+
+
+# The worker: runs Kitsune on the capture, and writes the job's files to job_dir
+def run_job(job_dir, file_path, packet_limit, FM_grace, AD_grace, model_path=None):
+    from Kitsune import Kitsune
+    from KitNET.calibrator import thresholdCalibrator, scoreStore
+    status = {'state': 'running', 'packets': 0, 'progress': 0.0, 'alerts': 0, 'started': time.time()}
+    write_json(os.path.join(job_dir, STATUS), status)
+    try:
+        if model_path is None:
+            K = Kitsune(file_path, packet_limit, 10, FM_grace, AD_grace, cleanup_interval=STREAM_CLEANUP)
+            first = FM_grace + AD_grace + 1
+        else:
+            K = Kitsune(file_path, packet_limit, model=model_path, cleanup_interval=STREAM_CLEANUP)
+            first = 0 # every packet is scored
+        store = scoreStore(os.path.join(job_dir, SCORES))
+        # the fit is frozen after the benign period: it is not pulled towards the anomalies that follow
+        benign_period = BENIGN_PERIOD
+        if packet_limit < float('inf'):
+            benign_period = int(min(benign_period, max((packet_limit - first) // 2, 1)))
+        calibrator = thresholdCalibrator(benign_period=benign_period, store=store)
+        i = 0
+        while i < packet_limit:
+            rmses = K.proc_next_batch(int(min(CHUNK, packet_limit - i)))
+            if len(rmses) == 0:
+                break
+            _, alerts = calibrator.process_batch(rmses)
+            i += len(rmses)
+            status['packets'], status['alerts'] = i, status['alerts'] + int(alerts.sum())
+            progress = K.FE.get_progress()
+            if packet_limit < float('inf'):
+                progress = max(progress, i / packet_limit)
+            status['progress'] = min(progress, 1.0)
+            write_json(os.path.join(job_dir, STATUS), status)
+        store.close()
+        K.FE.close()
+
+        # The scores of the benign period were rated online against the fit so far: every score is rated again against the
+        # final fit, so the alerts counted, stored (scores.bin) and plotted are the same
+        rmses = store.rmse()
+        logprobs = calibrator.logprob(rmses)
+        store.data['logprob'][:len(store)] = logprobs
+        store.data['alert'][:len(store)] = logprobs < calibrator.log_phi
+        tmp = os.path.join(job_dir, SCORES + '.tmp')
+        store.data[:len(store)].tofile(tmp)
+        os.replace(tmp, os.path.join(job_dir, SCORES))
+        status['alerts'] = int(store.alert().sum())
+
+        plot_scores(os.path.join(job_dir, PLOT), rmses, logprobs, first)
+        K.AnomDetector.save(os.path.join(job_dir, MODEL))
+        write_json(os.path.join(job_dir, RESULT), {'packets': i, 'first': first, 'alerts': status['alerts'],
+                                                   'mean': calibrator.mean, 'std': calibrator.std()})
+        status.update({'state': 'done', 'progress': 1.0, 'finished': time.time()})
+    except Exception:
+        status.update({'state': 'error', 'error': traceback.format_exc()})
+    write_json(os.path.join(job_dir, STATUS), status)
+
+
+class jobRunner:
+    # cache_dir: where the jobs' directories are kept (default: kitsune-jobs in the system's temp directory)
+    # max_workers: the number of jobs run at once (the rest are queued; default: WORKERS)
+    def __init__(self, cache_dir=None, max_workers=None):
+        self.cache_dir = cache_dir if cache_dir is not None else os.path.join(tempfile.gettempdir(), 'kitsune-jobs')
+        os.makedirs(self.cache_dir, exist_ok=True)
+        self.max_workers = max_workers if max_workers is not None else WORKERS
+        self.pool = self.new_pool()
+        self.futures = dict() # job ID -> Future, of the jobs submitted to this runner
+        self.lock = threading.Lock()
+        self.last_cleanup = 0.0
+
+    # spawned workers: forking the (multi-threaded) Streamlit server is not safe
+    def new_pool(self):
+        return ProcessPoolExecutor(max_workers=self.max_workers, mp_context=mp.get_context('spawn'))
+
+    def job_dir(self, job):
+        return os.path.join(self.cache_dir, job)
+
+    # Submits an analysis of the capture at file_path (see Kitsune), unless the same one is cached or running.
+    # file_hash, model_hash: the hashes of the files' content, if already known. Returns the job's ID
+    def submit(self, file_path, packet_limit, FM_grace, AD_grace, model_path=None, file_hash=None, model_hash=None):
+        if file_hash is None:
+            file_hash = hash_file(file_path)
+        if model_path is not None and model_hash is None:
+            model_hash = hash_file(model_path)
+        if model_path is not None:
+            FM_grace, AD_grace = 0, -1 # (not used: a pre-trained model scores every packet)
+        job = job_id(file_hash, packet_limit, FM_grace, AD_grace, model_hash)
+        if time.time() - self.last_cleanup > CLEANUP_INTERVAL:
+            self.last_cleanup = time.time()
+            self.cleanup()
+        with self.lock:
+            future = self.futures.get(job)
+            if future is not None and not future.done():
+                return job # running (or queued)
+            status = read_json(os.path.join(self.job_dir(job), STATUS))
+            if status is not None and status['state'] == 'done':
+                os.utime(os.path.join(self.job_dir(job), STATUS)) # (used: kept another MAX_AGE)
+                return job # cached
+            os.makedirs(self.job_dir(job), exist_ok=True)
+            write_json(os.path.join(self.job_dir(job), STATUS), {'state': 'queued', 'packets': 0, 'progress': 0.0, 'alerts': 0})
+            args = (run_job, self.job_dir(job), file_path, packet_limit, FM_grace, AD_grace, model_path)
+            try:
+                self.futures[job] = self.pool.submit(*args)
+            except BrokenProcessPool: # a worker died (e.g. killed when out of memory): the pool takes no more jobs
+                self.pool = self.new_pool()
+                self.futures[job] = self.pool.submit(*args)
+        return job
+
+    # The status of a job: {'state': 'queued', 'running', 'done' or 'error', 'packets', 'progress', 'alerts', ('error')}
+    # or None if the job is unknown
+    def status(self, job):
+        status = read_json(os.path.join(self.job_dir(job), STATUS))
+        future = self.futures.get(job)
+        if future is not None and future.done() and future.exception() is not None: # the worker itself failed
+            return {'state': 'error', 'packets': 0, 'progress': 0.0, 'alerts': 0, 'error': repr(future.exception())}
+        if status is not None and status['state'] in ('queued', 'running') and future is None:
+            # left behind by an earlier server (or runner): it will not finish
+            status.update({'state': 'error', 'error': "The job was interrupted: submit it again"})
+        return status
+
+    # The results of a finished job: the summary (result.json), with the paths of its files (scores, model and plot)
+    def result(self, job):
+        result = read_json(os.path.join(self.job_dir(job), RESULT))
+        if result is None:
+            raise LookupError("Job " + job + " has no results (yet)")
+        for name, file in [('scores', SCORES), ('model', MODEL), ('plot', PLOT)]:
+            result[name] = os.path.join(self.job_dir(job), file)
+        return result
+
+    # Removes the directories of the jobs that are done or failed (or were interrupted) and whose status was last written
+    # (or used, see submit) max_age seconds ago. A running job writes its status every CHUNK packets, so it is never that
+    # old, even if it runs in another server's runner. Returns the number of jobs removed
+    def cleanup(self, max_age=MAX_AGE):
+        removed = 0
+        now = time.time()
+        for entry in os.scandir(self.cache_dir):
+            try:
+                if not entry.is_dir():
+                    continue
+                with self.lock:
+                    future = self.futures.get(entry.name)
+                    if future is not None and not future.done():
+                        continue # running (or queued) in this runner
+                    path = os.path.join(entry.path, STATUS)
+                    if now - os.stat(path if os.path.exists(path) else entry.path).st_mtime <= max_age:
+                        continue
+                    shutil.rmtree(entry.path)
+                    self.futures.pop(entry.name, None)
+                removed += 1
+            except OSError: # removed meanwhile (by another process)
+                pass
+        return removed
+
+    def shutdown(self):
+        self.pool.shutdown(wait=False, cancel_futures=True)
@@ -31,28 +31,168 @@ import AfterImage as af
 # SOFTWARE.
 
 
+# Interns stream keys (an endpoint identifier such as a MAC, an IP, or a tuple like (IP, port)) into compact integer IDs.
+# A key is assigned its ID once, the first time it is seen; AfterImage's hash tables are then indexed by these integers
+# instead of by strings concatenated anew for every packet.
+class streamKeys:
+    def __init__(self):
+        self.IDs = dict() # key -> ID
+        self.keys = [] # ID -> key
+
+    def intern(self, key):
+        ID = self.IDs.get(key)
+        if ID is None: # new key
+            ID = len(self.keys)
+            self.IDs[key] = ID
+            self.keys.append(key)
+        return ID
+
+    # the original key of an ID
+    def lookup(self, ID):
+        return self.keys[ID]
+
+    # Writes the interned keys to w (a checkpoint.checkpointWriter)
+    def save_state(self, w):
+        w.write_list(self.keys)
+
+    # Restores the keys written by save_state from r (a checkpoint.checkpointReader)
+    def load_state(self, r):
+        self.keys = r.read_list()
+        self.IDs = {key: ID for ID, key in enumerate(self.keys)}
+
+
+# Selects the stat groups which netStat extracts, and the Lambdas (window decay factors) tracked by each group.
+# Each group is given as a list of Lambdas, True (track the default Lambdas), or False/None (disabled):
+#  MI:     Stats on src MAC-IP relationships (3 features per Lambda)
+#  H:      Host BW: Stats on the srcIP's general Sender Statistics (3). Off by default: it duplicates the 1D stats of the HH group
+#  HH:     Host-Host BW: Stats on the dual traffic behavior between srcIP and dstIP (7)
+#  HH_jit: Host-Host Jitter (3)
+#  HpHp:   Host:port-Host:port BW: Stats on the dual traffic behavior between the src and dst sockets (7)
+# Lambdas: the default Lambdas. None resolves to [5,3,1,.1,.01]
+# The default configuration is the original Kitsune feature set: MI, HH, HH_jit and HpHp over all five Lambdas (100 features).
+# E.g., netStatConfig(Lambdas=[5,3,1], HpHp=False) extracts 39 features.
+class netStatConfig:
+    groups = ['MI', 'H', 'HH', 'HH_jit', 'HpHp'] # in the order they appear in the stat vector
+    groupSizes = {'MI': 3, 'H': 3, 'HH': 7, 'HH_jit': 3, 'HpHp': 7} # features per Lambda
+
+    def __init__(self, Lambdas=None, MI=True, H=False, HH=True, HH_jit=True, HpHp=True):
+        if Lambdas is None:
+            Lambdas = [5,3,1,.1,.01]
+        self.Lambdas = list(Lambdas)
+        self.groupLambdas = dict()
+        for group, sel in zip(self.groups, [MI, H, HH, HH_jit, HpHp]):
+            if sel is True:
+                self.groupLambdas[group] = list(self.Lambdas)
+            elif sel is False or sel is None:
+                self.groupLambdas[group] = []
+            else:
+                self.groupLambdas[group] = list(sel)
+        if self.num_features() == 0:
+            raise ValueError("netStatConfig: at least one stat group must be enabled")
+
+    # the enabled groups, in stat vector order
+    def enabled(self):
+        return [group for group in self.groups if len(self.groupLambdas[group]) > 0]
+
+    def num_features(self):
+        return sum([self.groupSizes[group]*len(self.groupLambdas[group]) for group in self.groups])
+
+    def __repr__(self):
+        return "netStatConfig(" + ", ".join([group+"="+str(self.groupLambdas[group]) for group in self.groups]) + ")"
+
+
 class netStat:
     #Datastructure for efficent network stat queries
     # HostLimit: no more that this many Host identifiers will be tracked
     # HostSimplexLimit: no more that this many outgoing channels from each host will be tracked (purged periodically)
     # Lambdas: a list of 'window sizes' (decay factors) to track for each stream. nan resolved to default [5,3,1,.1,.01]
-    def __init__(self, Lambdas = np.nan, HostLimit=255,HostSimplexLimit=1000):
-        #Lambdas
-        if np.isnan(Lambdas):
-            self.Lambdas = [5,3,1,.1,.01]
-        else:
-            self.Lambdas = Lambdas
+    # vectorized: if True, use the struct-of-arrays AfterImage backend (incStatDB_vec) which updates all the windows of a stream in one step
+    # RecordLimit: memory budget. No hash table will hold more than this many records: when full, the record with the lowest (projected) weight is evicted to make room
+    # cleanupInterval: every this many packets, the records whose weight has decayed below cutoffWeight are evicted (0: never)
+    # config: a netStatConfig selecting the stat groups to extract and their Lambdas (overrides Lambdas). None: all the original groups over Lambdas
+    def __init__(self, Lambdas = np.nan, HostLimit=255,HostSimplexLimit=1000, vectorized=False, RecordLimit=np.inf, cleanupInterval=0, cutoffWeight=1e-3, config=None):
+        #Lambdas and stat groups
+        if config is None:
+            if Lambdas is None or (np.isscalar(Lambdas) and np.isnan(Lambdas)):
+                Lambdas = None # default
+            config = netStatConfig(Lambdas)
+        self.config = config
+        self.Lambdas = config.Lambdas
+        self.groupLambdas = config.groupLambdas
+
+        #Layout of the stat vector: the enabled groups one after the other, each with groupSizes[group] features per Lambda
+        self.slices = dict()
+        offset = 0
+        for group in config.groups:
+            size = config.groupSizes[group]*len(self.groupLambdas[group])
+            self.slices[group] = slice(offset, offset+size)
+            offset += size
+        self.n_features = offset
 
         #HT Limits
         self.HostLimit = HostLimit
+        self.HostSimplexLimit = HostSimplexLimit
         self.SessionLimit = HostSimplexLimit*self.HostLimit*self.HostLimit #*2 since each dual creates 2 entries in memory
         self.MAC_HostLimit = self.HostLimit*10
 
-        #HTs
-        self.HT_jit = af.incStatDB(limit=self.HostLimit*self.HostLimit)#H-H Jitter Stats
-        self.HT_MI = af.incStatDB(limit=self.MAC_HostLimit)#MAC-IP relationships
-        self.HT_H = af.incStatDB(limit=self.HostLimit) #Source Host BW Stats
-        self.HT_Hp = af.incStatDB(limit=self.SessionLimit)#Source Host BW Stats
+        #Eviction
+        self.RecordLimit = RecordLimit
+        self.cleanupInterval = cleanupInterval
+        self.cutoffWeight = cutoffWeight
+        self.n_updates = 0
+
+        #Stream keys
+        self.streamKeys = streamKeys()
+
+        #HTs (None if the group is disabled)
+        self.vectorized = vectorized
+        self.HT_jit = self.__makeHT__('HH_jit', self.HostLimit*self.HostLimit)#H-H Jitter Stats
+        self.HT_MI = self.__makeHT__('MI', self.MAC_HostLimit)#MAC-IP relationships
+        self.HT_Hsrc = self.__makeHT__('H', self.HostLimit) #Source Host BW Stats (1D only)
+        self.HT_H = self.__makeHT__('HH', self.HostLimit) #Source Host BW Stats
+        self.HT_Hp = self.__makeHT__('HpHp', self.SessionLimit)#Source Host BW Stats
+
+    # creates the hash table of a stat group, or returns None if the group is disabled
+    def __makeHT__(self, group, limit):
+        Lambdas = self.groupLambdas[group]
+        if len(Lambdas) == 0:
+            return None
+        limit = min(limit, self.RecordLimit)
+        evict = self.RecordLimit < np.inf
+        if self.vectorized:
+            return af.incStatDB_vec(Lambdas, limit=limit, evict=evict, cutoffWeight=self.cutoffWeight)
+        return af.incStatDB(limit=limit, evict=evict, cutoffWeight=self.cutoffWeight)
+
+    def getHTs(self):
+        return [HT for HT in [self.HT_MI, self.HT_Hsrc, self.HT_H, self.HT_jit, self.HT_Hp] if HT is not None]
+
+    # evicts the records (in all hash tables) whose weight has decayed below cutoffWeight by curTime.
+    # returns the number of evicted records
+    def cleanOutOldRecords(self, curTime):
+        return sum([HT.cleanOutOldRecords(self.cutoffWeight, curTime) for HT in self.getHTs()])
+
+    # Writes the complete state (the configuration, the stream keys and every hash table) to w, a checkpoint.checkpointWriter.
+    # See load_netStat
+    def save_state(self, w):
+        w.write_object({'config': self.config, 'HostLimit': self.HostLimit, 'HostSimplexLimit': self.HostSimplexLimit,
+                        'vectorized': self.vectorized, 'RecordLimit': self.RecordLimit, 'cleanupInterval': self.cleanupInterval,
+                        'cutoffWeight': self.cutoffWeight, 'n_updates': self.n_updates})
+        self.streamKeys.save_state(w)
+        for HT in self.getHTs():
+            HT.save_state(w)
+
+    # the total number of records evicted so far, either by cleanOutOldRecords or to stay within the RecordLimit
+    def getNumEvicted(self):
+        return sum([HT.n_evicted for HT in self.getHTs()])
+
+    # the total number of records, and of cov links, created so far (records: streams for the vectorized backend, as getNumRecords)
+    def getNumCreated(self):
+        HTs = self.getHTs()
+        return sum([HT.n_created for HT in HTs]), sum([HT.n_covs_created for HT in HTs])
+
+    # the number of records currently held in all hash tables (streams for the vectorized backend, which holds all windows of a stream in one record)
+    def getNumRecords(self):
+        return sum([len(HT.HT) for HT in self.getHTs()])
 
 
     def findDirection(self,IPtype,srcIP,dstIP,eth_src,eth_dst): #cpp: this is all given to you in the direction string of the instance (NO NEED FOR THIS FUNCTION)
@@ -70,37 +210,115 @@ class netStat:
 
         return src_subnet, dst_subnet
 
-    def updateGetStats(self, IPtype, srcMAC,dstMAC, srcIP, srcProtocol, dstIP, dstProtocol, datagramSize, timestamp):
-        # Host BW: Stats on the srcIP's general Sender Statistics
-        # Hstat = np.zeros((3*len(self.Lambdas,)))
-        # for i in range(len(self.Lambdas)):
-        #     Hstat[(i*3):((i+1)*3)] = self.HT_H.update_get_1D_Stats(srcIP, timestamp, datagramSize, self.Lambdas[i])
+    # out: optional preallocated array of n_features (e.g. a row of a larger batch matrix) which the stats are written
+    # into directly, in place of allocating a new vector for every packet. The array written to is returned.
+    def updateGetStats(self, IPtype, srcMAC,dstMAC, srcIP, srcProtocol, dstIP, dstProtocol, datagramSize, timestamp, out=None):
+        if out is None:
+            out = np.empty(self.n_features)
+        elif out.shape != (self.n_features,) or not out.flags.c_contiguous:
+            raise ValueError("out must be a contiguous vector of "+str(self.n_features)+" features")
+
+        MI_ID, srcID, dstID, HH_ID, srcpID, dstpID = self.getStreamIDs(srcMAC, dstMAC, srcIP, srcProtocol, dstIP, dstProtocol)
+        return self.updateGetStats_IDs(MI_ID, srcID, dstID, HH_ID, srcpID, dstpID, datagramSize, timestamp, out)
+
+    # Same as updateGetStats over a packetTable (see packetTable.py), whose stream keys were already resolved and integer-coded.
+    # Each distinct key of the table is interned once, and the packets are then processed with no per-packet string handling.
+    # out: optional preallocated (len(table) x n_features) array to write the stats into. The array written to is returned.
+    def updateGetStats_table(self, table, out=None):
+        if out is None:
+            out = np.empty((len(table), self.n_features))
+        elif out.shape != (len(table), self.n_features) or not out.flags.c_contiguous:
+            raise ValueError("out must be a contiguous array of "+str(len(table))+" x "+str(self.n_features)+" features")
+
+        used = np.unique(table.codes)
+        remap = np.full(len(table.keys), -1, dtype=np.int64)
+        remap[used] = [self.streamKeys.intern(table.keys[k]) for k in used.tolist()]
+        IDs = remap[table.codes].tolist()
+        sizes = table.framelen.tolist()
+        timestamps = table.timestamp.tolist()
+        for i in range(len(table)):
+            MI_ID, srcID, dstID, HH_ID, srcpID, dstpID = IDs[i]
+            self.updateGetStats_IDs(MI_ID, srcID, dstID, HH_ID, srcpID, dstpID, sizes[i], timestamps[i], out[i])
+        return out
+
+    # Updates the stats of a packet given its (interned) stream IDs, and writes them into out
+    def updateGetStats_IDs(self, MI_ID, srcID, dstID, HH_ID, srcpID, dstpID, datagramSize, timestamp, out):
+        # periodic eviction of expired records
+        self.n_updates += 1
+        if self.cleanupInterval > 0 and self.n_updates % self.cleanupInterval == 0:
+            self.cleanOutOldRecords(timestamp)
+
+        if self.vectorized:
+            return self.updateGetStats_vec(MI_ID, srcID, dstID, HH_ID, srcpID, dstpID, datagramSize, timestamp, out)
 
         #MAC.IP: Stats on src MAC-IP relationships
-        MIstat =  np.zeros((3*len(self.Lambdas,)))
-        for i in range(len(self.Lambdas)):
-            MIstat[(i*3):((i+1)*3)] = self.HT_MI.update_get_1D_Stats(srcMAC+srcIP, timestamp, datagramSize, self.Lambdas[i])
+        if self.HT_MI is not None:
+            MIstat = out[self.slices['MI']]
+            for i, Lambda in enumerate(self.groupLambdas['MI']):
+                MIstat[(i*3):((i+1)*3)] = self.HT_MI.update_get_1D_Stats(MI_ID, timestamp, datagramSize, Lambda)
+
+        # Host BW: Stats on the srcIP's general Sender Statistics
+        if self.HT_Hsrc is not None:
+            Hstat = out[self.slices['H']]
+            for i, Lambda in enumerate(self.groupLambdas['H']):
+                Hstat[(i*3):((i+1)*3)] = self.HT_Hsrc.update_get_1D_Stats(srcID, timestamp, datagramSize, Lambda)
 
         # Host-Host BW: Stats on the dual traffic behavior between srcIP and dstIP
-        HHstat =  np.zeros((7*len(self.Lambdas,)))
-        for i in range(len(self.Lambdas)):
-            HHstat[(i*7):((i+1)*7)] = self.HT_H.update_get_1D2D_Stats(srcIP, dstIP,timestamp,datagramSize,self.Lambdas[i])
+        if self.HT_H is not None:
+            HHstat = out[self.slices['HH']]
+            for i, Lambda in enumerate(self.groupLambdas['HH']):
+                HHstat[(i*7):((i+1)*7)] = self.HT_H.update_get_1D2D_Stats(srcID, dstID,timestamp,datagramSize,Lambda)
 
         # Host-Host Jitter:
-        HHstat_jit =  np.zeros((3*len(self.Lambdas,)))
-        for i in range(len(self.Lambdas)):
-            HHstat_jit[(i*3):((i+1)*3)] = self.HT_jit.update_get_1D_Stats(srcIP+dstIP, timestamp, 0, self.Lambdas[i],isTypeDiff=True)
+        if self.HT_jit is not None:
+            HHstat_jit = out[self.slices['HH_jit']]
+            for i, Lambda in enumerate(self.groupLambdas['HH_jit']):
+                HHstat_jit[(i*3):((i+1)*3)] = self.HT_jit.update_get_1D_Stats(HH_ID, timestamp, 0, Lambda,isTypeDiff=True)
 
         # Host-Host BW: Stats on the dual traffic behavior between srcIP and dstIP
-        HpHpstat =  np.zeros((7*len(self.Lambdas,)))
+        if self.HT_Hp is not None:
+            HpHpstat = out[self.slices['HpHp']]
+            for i, Lambda in enumerate(self.groupLambdas['HpHp']):
+                HpHpstat[(i*7):((i+1)*7)] = self.HT_Hp.update_get_1D2D_Stats(srcpID, dstpID, timestamp, datagramSize, Lambda)
+
+        return out  # the stat groups were written into their slices of the one stat vector
+
+    # Returns the (interned) stream IDs of a packet:
+    # MAC-IP, src host, dst host, host-host, src host:port and dst host:port (src and dst MAC for ARP)
+    def getStreamIDs(self, srcMAC, dstMAC, srcIP, srcProtocol, dstIP, dstProtocol):
+        keys = self.streamKeys
         if srcProtocol == 'arp':
-            for i in range(len(self.Lambdas)):
-                HpHpstat[(i*7):((i+1)*7)] = self.HT_Hp.update_get_1D2D_Stats(srcMAC, dstMAC, timestamp, datagramSize, self.Lambdas[i])
+            srcpID = keys.intern(srcMAC)
+            dstpID = keys.intern(dstMAC)
         else:  # some other protocol (e.g. TCP/UDP)
-            for i in range(len(self.Lambdas)):
-                HpHpstat[(i*7):((i+1)*7)] = self.HT_Hp.update_get_1D2D_Stats(srcIP + srcProtocol, dstIP + dstProtocol, timestamp, datagramSize, self.Lambdas[i])
+            srcpID = keys.intern((srcIP, srcProtocol))
+            dstpID = keys.intern((dstIP, dstProtocol))
+        return keys.intern((srcMAC, srcIP)), keys.intern(srcIP), keys.intern(dstIP), keys.intern((srcIP, dstIP)), srcpID, dstpID
+
+    # same as updateGetStats, but each stat group is pulled for all Lambdas in one call to the incStatDB_vec backend,
+    # which writes it straight into its slice of out
+    def updateGetStats_vec(self, MI_ID, srcID, dstID, HH_ID, srcpID, dstpID, datagramSize, timestamp, out):
+        #MAC.IP: Stats on src MAC-IP relationships
+        if self.HT_MI is not None:
+            self.HT_MI.update_get_1D_Stats(MI_ID, timestamp, datagramSize, out=out[self.slices['MI']])
+
+        # Host BW: Stats on the srcIP's general Sender Statistics
+        if self.HT_Hsrc is not None:
+            self.HT_Hsrc.update_get_1D_Stats(srcID, timestamp, datagramSize, out=out[self.slices['H']])
 
-        return np.concatenate((MIstat, HHstat, HHstat_jit, HpHpstat))  # concatenation of stats into one stat vector
+        # Host-Host BW: Stats on the dual traffic behavior between srcIP and dstIP
+        if self.HT_H is not None:
+            self.HT_H.update_get_1D2D_Stats(srcID, dstID, timestamp, datagramSize, out=out[self.slices['HH']])
+
+        # Host-Host Jitter:
+        if self.HT_jit is not None:
+            self.HT_jit.update_get_1D_Stats(HH_ID, timestamp, 0, isTypeDiff=True, out=out[self.slices['HH_jit']])
+
+        # Host-Host BW: Stats on the dual traffic behavior between srcIP and dstIP
+        if self.HT_Hp is not None:
+            self.HT_Hp.update_get_1D2D_Stats(srcpID, dstpID, timestamp, datagramSize, out=out[self.slices['HpHp']])
+
+        return out
 
     def getNetStatHeaders(self):
         MIstat_headers = []
@@ -109,9 +327,27 @@ class netStat:
         HHjitstat_headers = []
         HpHpstat_headers = []
 
-        for i in range(len(self.Lambdas)):
-            MIstat_headers += ["MI_dir_"+h for h in self.HT_MI.getHeaders_1D(Lambda=self.Lambdas[i],ID=None)]
-            HHstat_headers += ["HH_"+h for h in self.HT_H.getHeaders_1D2D(Lambda=self.Lambdas[i],IDs=None,ver=2)]
-            HHjitstat_headers += ["HH_jit_"+h for h in self.HT_jit.getHeaders_1D(Lambda=self.Lambdas[i],ID=None)]
-            HpHpstat_headers += ["HpHp_" + h for h in self.HT_Hp.getHeaders_1D2D(Lambda=self.Lambdas[i], IDs=None, ver=2)]
+        for Lambda in self.groupLambdas['MI']:
+            MIstat_headers += ["MI_dir_"+h for h in self.HT_MI.getHeaders_1D(Lambda=Lambda,ID=None)]
+        for Lambda in self.groupLambdas['H']:
+            Hstat_headers += ["H_"+h for h in self.HT_Hsrc.getHeaders_1D(Lambda=Lambda,ID=None)]
+        for Lambda in self.groupLambdas['HH']:
+            HHstat_headers += ["HH_"+h for h in self.HT_H.getHeaders_1D2D(Lambda=Lambda,IDs=None,ver=2)]
+        for Lambda in self.groupLambdas['HH_jit']:
+            HHjitstat_headers += ["HH_jit_"+h for h in self.HT_jit.getHeaders_1D(Lambda=Lambda,ID=None)]
+        for Lambda in self.groupLambdas['HpHp']:
+            HpHpstat_headers += ["HpHp_" + h for h in self.HT_Hp.getHeaders_1D2D(Lambda=Lambda, IDs=None, ver=2)]
         return MIstat_headers + Hstat_headers + HHstat_headers + HHjitstat_headers + HpHpstat_headers
+
+
+# Creates a netStat from the state written by netStat.save_state to r (a checkpoint.checkpointReader).
+# The netStat continues from exactly where the saved one was: the same configuration, stream keys and hash tables
+def load_netStat(r):
+    params = r.read_object()
+    nstat = netStat(np.nan, params['HostLimit'], params['HostSimplexLimit'], params['vectorized'], params['RecordLimit'],
+                    params['cleanupInterval'], params['cutoffWeight'], params['config'])
+    nstat.n_updates = params['n_updates']
+    nstat.streamKeys.load_state(r)
+    for HT in nstat.getHTs():
+        HT.load_state(r)
+    return nstat
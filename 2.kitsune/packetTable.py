@@ -0,0 +1,115 @@
+import numpy as np
+import pandas as pd
+import pcapParser
+
+# Columnar (batch) loading of parsed packets, for feature extraction without per-packet string parsing.
+# The tshark TSV (or the rows of pcapParser) is read into columns, and the packet fields are resolved for all the
+# packets at once with vectorized masks (the same IPv4/IPv6/ARP/ICMP/L2 logic as FE.parse_tsv_row). The endpoints are
+# integer-coded, so netStat.updateGetStats_table can run AfterImage over the arrays directly.
+
+N_FIELDS = pcapParser.N_FIELDS  # the columns of the tshark TSV
+
+
+# A batch of packets:
+# timestamp: float64 array, framelen: int64 array, IPtype: float64 array (0: IPv4, 1: IPv6, nan: other)
+# codes: (n x 6) int64 array. The stream keys of each packet, as codes into keys:
+#        MAC-IP, src host, dst host, host-host, src host:port and dst host:port (the columns of netStat.getStreamIDs)
+# keys: list of the distinct stream keys, in the form netStat.streamKeys interns them (an IP/MAC string, or a tuple of two)
+class packetTable:
+    def __init__(self, timestamp, framelen, IPtype, codes, keys):
+        self.timestamp = timestamp
+        self.framelen = framelen
+        self.IPtype = IPtype
+        self.codes = codes
+        self.keys = keys
+
+    def __len__(self):
+        return len(self.timestamp)
+
+
+# Builds a packetTable from the 19 tshark TSV columns (a list of equally long object arrays of strings)
+def from_columns(cols):
+    n = len(cols[0])
+    empty = [c == '' for c in cols]
+
+    # network layer
+    ip4 = ~empty[4]
+    ip6 = ~ip4 & ~empty[17]
+    srcIP = np.where(ip4, cols[4], np.where(ip6, cols[17], ''))
+    dstIP = np.where(ip4, cols[5], np.where(ip6, cols[18], ''))
+    IPtype = np.where(ip4, 0., np.where(ip6, 1., np.nan))
+
+    # transport layer: the concatenation of the two port strings will results in an OR "[tcp|udp]"
+    srcproto = cols[6] + cols[8]
+    dstproto = cols[7] + cols[9]
+
+    # L2/L1 level protocols
+    l2 = srcproto == ''
+    arp = l2 & ~empty[12]
+    icmp = l2 & ~arp & ~empty[10]
+    other = l2 & ~arp & ~icmp & (srcIP + dstIP + dstproto == '')
+    srcproto = np.where(arp, 'arp', np.where(icmp, 'icmp', srcproto))
+    dstproto = np.where(arp, 'arp', np.where(icmp, 'icmp', dstproto))
+    srcIP = np.where(arp, cols[14], np.where(other, cols[2], srcIP))  # src IP (ARP), or src MAC
+    dstIP = np.where(arp, cols[16], np.where(other, cols[3], dstIP))  # dst IP (ARP), or dst MAC
+    IPtype[arp | icmp] = 0
+
+    # integer-code all the strings with one codebook
+    srcMAC, dstMAC = cols[2], cols[3]
+    strs, strkeys = pd.factorize(np.concatenate((srcMAC, dstMAC, srcIP, dstIP, srcproto, dstproto)))
+    srcMAC_c, dstMAC_c, srcIP_c, dstIP_c, srcproto_c, dstproto_c = strs.reshape(6, n)
+
+    # the stream keys: strings keep their codes, and the pairs (tuples) are coded after them
+    S = len(strkeys)
+    MI = srcMAC_c * S + srcIP_c
+    HH = srcIP_c * S + dstIP_c
+    srcp = np.where(arp, -1, srcIP_c * S + srcproto_c)
+    dstp = np.where(arp, -1, dstIP_c * S + dstproto_c)
+    pairs, pairkeys = pd.factorize(np.concatenate((MI, HH, srcp, dstp)))
+    MI_c, HH_c, srcp_c, dstp_c = (pairs + S).reshape(4, n)
+    srcp_c = np.where(arp, srcMAC_c, srcp_c)
+    dstp_c = np.where(arp, dstMAC_c, dstp_c)
+
+    keys = list(strkeys)
+    keys += [(keys[p // S], keys[p % S]) if p >= 0 else None for p in pairkeys.tolist()]
+    codes = np.stack((MI_c, srcIP_c, dstIP_c, HH_c, srcp_c, dstp_c), axis=1).astype(np.int64)
+
+    timestamp = np.asarray(cols[0]).astype(np.float64)
+    framelen = np.asarray(cols[1]).astype(np.int64)
+    return packetTable(timestamp, framelen, IPtype, codes, keys)
+
+
+# Builds a packetTable from a pandas DataFrame of the 19 TSV columns (as strings)
+def from_dataframe(df):
+    return from_columns([df.iloc[:, i].to_numpy(dtype=object) for i in range(N_FIELDS)])
+
+
+# Builds a packetTable from a list of rows of the 19 TSV fields (e.g., from pcapParser)
+def from_rows(rows):
+    if len(rows) == 0:
+        return from_columns([np.empty(0, dtype=object)] * N_FIELDS)
+    return from_columns(list(np.array(rows, dtype=object).T))
+
+
+# Yields the packets of a tshark TSV file as packetTables of (up to) chunksize packets
+# nrows: the maximum number of packets to read
+def read_tsv(path, chunksize=100000, nrows=None):
+    reader = pd.read_csv(path, sep='\t', header=0, dtype=object, na_filter=False, quoting=3,
+                         usecols=range(N_FIELDS), chunksize=chunksize, nrows=nrows)
+    for df in reader:
+        yield from_dataframe(df)
+
+
+# Yields the packets of a pcap/pcapng file (parsed with pcapParser) as packetTables of (up to) chunksize packets
+# nrows: the maximum number of packets to read
+def read_pcap(path, chunksize=100000, nrows=None):
+    rows = []
+    for i, row in enumerate(pcapParser.read_packets(path)):
+        if nrows is not None and i >= nrows:
+            break
+        rows.append(row)
+        if len(rows) == chunksize:
+            yield from_rows(rows)
+            rows = []
+    if len(rows) > 0:
+        yield from_rows(rows)
@@ -0,0 +1,289 @@
+import socket
+import struct
+
+# A streaming pcap/pcapng reader for the Kitsune feature extractor (no tshark or scapy required).
+# read_packets(path) walks the capture's record headers one packet at a time (constant memory), and decodes only
+# the Ethernet/IPv4/IPv6/TCP/UDP/ICMP/ARP fields which FE.get_next_vector needs. Each packet is yielded as
+# the same list of 19 strings that a row of the tshark TSV holds (see FE.pcap2tsv_with_tshark), i.e.:
+#  frame.time_epoch, frame.len, eth.src, eth.dst, ip.src, ip.dst, tcp.srcport, tcp.dstport, udp.srcport, udp.dstport,
+#  icmp.type, icmp.code, arp.opcode, arp.src.hw_mac, arp.src.proto_ipv4, arp.dst.hw_mac, arp.dst.proto_ipv4,
+#  ipv6.src, ipv6.dst
+# where fields missing from the packet are '' (like tshark's "-E occurrence=f", only the first occurrence of a field is given).
+# Supported link types: Ethernet (with 802.1Q/802.1ad VLAN tags), raw IPv4/IPv6 and Linux cooked capture (SLL).
+# Known difference from tshark: IP fragments are not reassembled (only a first fragment carries the transport ports).
+
+N_FIELDS = 19
+
+# link types
+LINKTYPE_ETHERNET = 1
+LINKTYPE_RAW = 101
+LINKTYPE_LINUX_SLL = 113
+LINKTYPE_IPV4 = 228
+LINKTYPE_IPV6 = 229
+
+# ether types
+ETH_IPV4 = 0x0800
+ETH_ARP = 0x0806
+ETH_IPV6 = 0x86DD
+ETH_VLAN = (0x8100, 0x88A8, 0x9100)
+
+# IPv6 extension headers: hop-by-hop, routing, destination options (fragment: 44)
+IPV6_EXT = (0, 43, 60)
+
+# ICMP error messages, which quote the IP header (and first 8 bytes) of the offending packet: tshark dissects it
+ICMP_ERRORS = (3, 4, 5, 11, 12)
+
+u16 = struct.Struct('!H')
+ports = struct.Struct('!HH')
+
+
+def format_mac(b):
+    return b.hex(':')
+
+
+# the time since the epoch, given as an integer count of 10^-digits seconds, in tshark's format (nanoseconds)
+def format_time(ticks, digits):
+    sec, frac = divmod(ticks, 10 ** digits)
+    if digits <= 9:
+        return "%d.%09d" % (sec, frac * 10 ** (9 - digits))
+    return "%d.%09d" % (sec, frac // 10 ** (digits - 9))
+
+
+# decodes the fields of a frame (of the given link type) into row
+def decode(row, linktype, data):
+    if linktype == LINKTYPE_ETHERNET:
+        if len(data) < 14:
+            return
+        row[3] = format_mac(data[0:6])
+        row[2] = format_mac(data[6:12])
+        etype = u16.unpack_from(data, 12)[0]
+        off = 14
+        while etype in ETH_VLAN and len(data) >= off + 4:
+            etype = u16.unpack_from(data, off + 2)[0]
+            off += 4
+    elif linktype == LINKTYPE_LINUX_SLL:
+        if len(data) < 16:
+            return
+        etype = u16.unpack_from(data, 14)[0]
+        off = 16
+    elif linktype == LINKTYPE_RAW:
+        if len(data) < 1:
+            return
+        etype = ETH_IPV4 if data[0] >> 4 == 4 else ETH_IPV6
+        off = 0
+    elif linktype == LINKTYPE_IPV4:
+        etype = ETH_IPV4
+        off = 0
+    elif linktype == LINKTYPE_IPV6:
+        etype = ETH_IPV6
+        off = 0
+    else:  # unsupported link layer: only the frame's time and length are known
+        return
+
+    if etype == ETH_IPV4:
+        decode_ipv4(row, data, off, False)
+    elif etype == ETH_IPV6:
+        decode_ipv6(row, data, off)
+    elif etype == ETH_ARP:
+        decode_arp(row, data, off)
+
+
+def decode_ipv4(row, data, off, quoted):
+    if len(data) < off + 20:
+        return
+    ihl = (data[off] & 0x0F) * 4
+    if not quoted:  # quoted headers (in ICMP errors) are the second occurrence of ip.src/ip.dst
+        row[4] = socket.inet_ntoa(data[off + 12:off + 16])
+        row[5] = socket.inet_ntoa(data[off + 16:off + 20])
+    if u16.unpack_from(data, off + 6)[0] & 0x1FFF:  # a non-first fragment: no transport header
+        return
+    decode_transport(row, data[off + 9], data, off + ihl, quoted)
+
+
+def decode_ipv6(row, data, off):
+    if len(data) < off + 40:
+        return
+    row[17] = socket.inet_ntop(socket.AF_INET6, data[off + 8:off + 24])
+    row[18] = socket.inet_ntop(socket.AF_INET6, data[off + 24:off + 40])
+    proto = data[off + 6]
+    off += 40
+    while True:
+        if proto in IPV6_EXT:
+            if len(data) < off + 2:
+                return
+            proto, off = data[off], off + (data[off + 1] + 1) * 8
+        elif proto == 44:  # fragment
+            if len(data) < off + 8:
+                return
+            if u16.unpack_from(data, off + 2)[0] & 0xFFF8:  # a non-first fragment
+                return
+            proto, off = data[off], off + 8
+        else:
+            break
+    decode_transport(row, proto, data, off, False)  # (ICMPv6 is protocol 58: it is not icmp)
+
+
+def decode_transport(row, proto, data, off, quoted):
+    if proto == 6 or proto == 17:  # TCP or UDP
+        if len(data) < off + 4:
+            return
+        sport, dport = ports.unpack_from(data, off)
+        i = 6 if proto == 6 else 8
+        if row[i] == '' and row[i + 1] == '':  # first occurrence
+            row[i] = str(sport)
+            row[i + 1] = str(dport)
+    elif proto == 1 and not quoted:  # ICMP
+        if len(data) < off + 2:
+            return
+        row[10] = str(data[off])
+        row[11] = str(data[off + 1])
+        if data[off] in ICMP_ERRORS and len(data) >= off + 8 + 20 and data[off + 8] >> 4 == 4:
+            decode_ipv4(row, data, off + 8, True)
+
+
+def decode_arp(row, data, off):
+    if len(data) < off + 8:
+        return
+    htype, ptype = ports.unpack_from(data, off)
+    hlen, plen = data[off + 4], data[off + 5]
+    row[12] = str(u16.unpack_from(data, off + 6)[0])
+    off += 8
+    if len(data) < off + 2 * (hlen + plen):
+        return
+    sha, spa = data[off:off + hlen], data[off + hlen:off + hlen + plen]
+    off += hlen + plen
+    tha, tpa = data[off:off + hlen], data[off + hlen:off + hlen + plen]
+    if htype == 1 and hlen == 6:
+        row[13] = format_mac(sha)
+        row[15] = format_mac(tha)
+    if ptype == ETH_IPV4 and plen == 4:
+        row[14] = socket.inet_ntoa(spa)
+        row[16] = socket.inet_ntoa(tpa)
+
+
+def new_row(timestamp, framelen):
+    row = [''] * N_FIELDS
+    row[0] = timestamp
+    row[1] = str(framelen)
+    return row
+
+
+# yields the packets of a pcap file (f is positioned after the magic number), from the record at offset (if given)
+def read_pcap(f, magic, offset=0):
+    endian = '<' if magic[0] in (0xD4, 0x4D) else '>'
+    digits = 9 if magic in (b'\x4d\x3c\xb2\xa1', b'\xa1\xb2\x3c\x4d') else 6  # nanosecond or microsecond resolution
+    hdr = f.read(20)
+    if len(hdr) < 20:
+        return
+    linktype = struct.unpack(endian + 'HHiIII', hdr)[5] & 0x0FFFFFFF  # (the upper bits hold the FCS length)
+    rec = struct.Struct(endian + 'IIII')
+    if offset > f.tell():
+        f.seek(offset)
+    while True:
+        rhdr = f.read(16)
+        if len(rhdr) < 16:
+            return
+        sec, frac, incl_len, orig_len = rec.unpack(rhdr)
+        data = f.read(incl_len)
+        if len(data) < incl_len:  # truncated capture
+            return
+        row = new_row(format_time(sec * 10 ** digits + frac, digits), orig_len)
+        decode(row, linktype, data)
+        yield row
+
+
+# returns the if_tsresol (as a power of 10 or 2) and if_tsoffset options of an interface description block
+def idb_options(body, endian):
+    digits, base2, ts_offset = 6, False, 0
+    off = 8
+    while off + 4 <= len(body):
+        code, length = struct.unpack_from(endian + 'HH', body, off)
+        off += 4
+        if code == 0:  # opt_endofopt
+            break
+        if code == 9 and length >= 1:  # if_tsresol
+            digits, base2 = body[off] & 0x7F, bool(body[off] & 0x80)
+        elif code == 14 and length >= 8:  # if_tsoffset
+            ts_offset = struct.unpack_from(endian + 'q', body, off)[0]
+        off += (length + 3) & ~3
+    return digits, base2, ts_offset
+
+
+# yields the packets of a pcapng file (f is positioned after the first block type), from the block at offset (if given).
+# The blocks before offset are still walked (for the interfaces they describe), but their packets are not decoded
+def read_pcapng(f, offset=0):
+    endian = '<'
+    interfaces = []  # (linktype, digits, base2, ts_offset)
+    btype = 0x0A0D0D0A
+    while True:
+        if btype == 0x0A0D0D0A:  # section header block: defines the byte order, and resets the interfaces
+            head = f.read(8)
+            if len(head) < 8:
+                return
+            endian = '<' if head[4:8] == b'\x4d\x3c\x2b\x1a' else '>'
+            blen = struct.unpack(endian + 'I', head[0:4])[0]
+            f.read(blen - 12)
+            interfaces = []
+        elif btype in (2, 3, 6) and f.tell() - 4 < offset:  # a packet before offset: skip it
+            head = f.read(4)
+            if len(head) < 4:
+                return
+            f.seek(struct.unpack(endian + 'I', head)[0] - 8, 1)
+        else:
+            head = f.read(4)
+            if len(head) < 4:
+                return
+            blen = struct.unpack(endian + 'I', head)[0]
+            body = f.read(blen - 12)
+            f.read(4)  # trailing block length
+            if len(body) < blen - 12:  # truncated capture
+                return
+            if btype == 1:  # interface description block
+                linktype = struct.unpack_from(endian + 'H', body, 0)[0]
+                interfaces.append((linktype,) + idb_options(body, endian))
+            elif btype == 6 or btype == 2:  # enhanced packet block (or the obsolete packet block)
+                if btype == 6:
+                    iface, ts_high, ts_low, cap_len, orig_len = struct.unpack_from(endian + 'IIIII', body, 0)
+                else:
+                    iface, _, ts_high, ts_low, cap_len, orig_len = struct.unpack_from(endian + 'HHIIII', body, 0)
+                if iface < len(interfaces):
+                    linktype, digits, base2, ts_offset = interfaces[iface]
+                    ts = (ts_high << 32) | ts_low
+                    if base2:
+                        timestamp = "%.9f" % (ts_offset + ts / float(2 ** digits))
+                    else:
+                        timestamp = format_time(ts_offset * 10 ** digits + ts, digits)
+                    row = new_row(timestamp, orig_len)
+                    decode(row, linktype, body[20:20 + cap_len])
+                    yield row
+            elif btype == 3:  # simple packet block: no timestamp, and belongs to the first interface
+                if len(interfaces) > 0:
+                    orig_len = struct.unpack_from(endian + 'I', body, 0)[0]
+                    row = new_row(format_time(0, 9), orig_len)
+                    decode(row, interfaces[0][0], body[4:4 + orig_len])
+                    yield row
+        btype_raw = f.read(4)
+        if len(btype_raw) < 4:
+            return
+        btype = struct.unpack(endian + 'I', btype_raw)[0]
+
+
+# Yields the packets of the pcap or pcapng file at path, one at a time, as rows of tshark TSV fields (see above)
+def read_packets(path):
+    with open(path, 'rb') as f:
+        for row in read_file(f, path):
+            yield row
+
+
+# Same as read_packets, over an open (binary) file f. The position of f is the number of bytes read so far.
+# Between two packets, it is the offset of the next packet's record: given as offset, the packets resume from there.
+def read_file(f, path='', offset=0):
+    magic = f.read(4)
+    if magic in (b'\xd4\xc3\xb2\xa1', b'\xa1\xb2\xc3\xd4', b'\x4d\x3c\xb2\xa1', b'\xa1\xb2\x3c\x4d'):
+        for row in read_pcap(f, magic, offset):
+            yield row
+    elif magic == b'\x0a\x0d\x0d\x0a':
+        for row in read_pcapng(f, offset):
+            yield row
+    else:
+        raise ValueError("File: " + path + " is not a pcap or pcapng file")
@@ -0,0 +1,158 @@
+import multiprocessing as mp
+import traceback
+from multiprocessing import shared_memory
+import numpy as np
+import netStat as ns
+from FeatureExtractor import FE
+from KitNET.KitNET import KitNET
+import KitNET.KitNET as KN
+
+# A pipelined Kitsune: the feature extraction (parsing and AfterImage) runs in a producer process, and KitNET in the
+# process that consumes the scores, so the two stages run on separate cores, and a packet's features are extracted
+# while the previous chunk is being scored.
+# The feature vectors are handed over through a ring buffer of n_slots chunks (of chunk_size vectors each) in shared
+# memory, so no vector is pickled or copied between the processes:
+#  - the producer waits for a free slot (the 'free' semaphore), writes the next chunk of vectors into it, and posts it ('full')
+#  - the consumer (proc_next_batch) waits for the next full slot, scores its vectors with KitNET, and frees it
+# The slots are filled and consumed in ring order, so the scores come out in packet order, and the producer blocks
+# (backpressure) when it is n_slots chunks ahead of KitNET.
+# The scores are exactly those of Kitsune.proc_next_batch(chunk_size).
+# Checkpointing is not supported (AfterImage's state lives in the producer process): use Kitsune for that.
+
+HEADER = 2  # the header of each slot: [number of vectors (0: no packets left, -1: error), progress of the input (FE.get_progress)]
+
+
+# The producer process: extracts the feature vectors of the input into the ring's slots, in order
+def produce(file_path, limit, fe_args, dtype, shape, feat_name, head_name, free, full, stop, errors):
+    feat_shm = shared_memory.SharedMemory(name=feat_name)
+    head_shm = shared_memory.SharedMemory(name=head_name)
+    slots = np.ndarray(shape, dtype=dtype, buffer=feat_shm.buf)
+    heads = np.ndarray((shape[0], HEADER), dtype=np.float64, buffer=head_shm.buf)
+    fe = None
+    slot = 0
+    try:
+        fe = FE(file_path, limit, dtype=dtype, **fe_args)
+        while True:
+            while not free.acquire(timeout=0.1):
+                if stop.is_set():
+                    return
+            X = fe.get_next_vectors(shape[1], slots[slot])
+            heads[slot] = len(X), fe.get_progress()
+            full.release()
+            if len(X) == 0:
+                return
+            slot = (slot + 1) % shape[0]
+    except Exception:
+        errors.put(traceback.format_exc())
+        heads[slot] = -1, 1.0
+        full.release()
+    finally:
+        if fe is not None:
+            fe.close()
+        del slots, heads
+        feat_shm.close()
+        head_shm.close()
+
+
+class KitsunePipeline:
+    # The parameters are those of Kitsune (checkpointing aside), plus:
+    # chunk_size: the number of packets per slot of the ring buffer (and per proc_next_batch)
+    # n_slots: the number of slots: how far (in chunks) feature extraction can run ahead of KitNET
+    # fe_args: more keyword arguments of FE (e.g. max_records, cleanup_interval, parser)
+    # The pipeline starts when it is created. close() it (or use it in a with statement) to stop the producer and free the ring
+    def __init__(self,file_path,limit,max_autoencoder_size=10,FM_grace_period=None,AD_grace_period=10000,learning_rate=0.1,hidden_ratio=0.75,stat_config=None,batch_size=1,model=None,
+                 dtype=np.float64,chunk_size=1000,n_slots=4,fe_args=None):
+        n = (stat_config if stat_config is not None else ns.netStatConfig()).num_features()
+
+        #init Kitnet (in this process)
+        if model is None:
+            self.AnomDetector = KitNET(n,max_autoencoder_size,FM_grace_period,AD_grace_period,learning_rate,hidden_ratio,batch_size=batch_size,dtype=dtype)
+        else:
+            self.AnomDetector = model if isinstance(model, KitNET) else KN.load(model)
+            if self.AnomDetector.n != n:
+                raise ValueError("The KitNET model takes " + str(self.AnomDetector.n) + " features, but the feature extractor gives "
+                                 + str(n) + " (a different stat_config?)")
+        self.dtype = self.AnomDetector.dtype
+
+        #the ring buffer
+        if chunk_size < 1 or n_slots < 1:
+            raise ValueError("chunk_size and n_slots must be at least 1")
+        shape = (n_slots, chunk_size, n)
+        self.feat_shm = shared_memory.SharedMemory(create=True, size=int(np.prod(shape)) * self.dtype.itemsize)
+        self.head_shm = shared_memory.SharedMemory(create=True, size=n_slots * HEADER * 8)
+        self.slots = np.ndarray(shape, dtype=self.dtype, buffer=self.feat_shm.buf)
+        self.heads = np.ndarray((n_slots, HEADER), dtype=np.float64, buffer=self.head_shm.buf)
+        self.slot = 0 # the next slot to consume
+        self.done = False
+        self.progress = 0.0
+        self.curPacketIndx = 0
+
+        #the feature extractor (producer) process
+        fe_args = dict(fe_args or {})
+        fe_args['stat_config'] = stat_config
+        self.free = mp.Semaphore(n_slots)
+        self.full = mp.Semaphore(0)
+        self.stop = mp.Event()
+        self.errors = mp.Queue()
+        self.producer = mp.Process(target=produce, daemon=True,
+                                   args=(file_path, limit, fe_args, self.dtype, shape, self.feat_shm.name, self.head_shm.name,
+                                         self.free, self.full, self.stop, self.errors))
+        self.producer.start()
+
+    # Processes the next chunk of (up to chunk_size) packets, and returns their RMSE scores as an array
+    # (an empty array when no packets are left)
+    def proc_next_batch(self):
+        if self.done:
+            return np.empty(0)
+        while not self.full.acquire(timeout=1.0):
+            if not self.producer.is_alive():
+                if self.full.acquire(timeout=0): # posted just before exiting
+                    break
+                self.close()
+                raise RuntimeError("The feature extraction process exited unexpectedly (exit code " + str(self.producer.exitcode) + ")")
+        count, self.progress = self.heads[self.slot]
+        if count < 0:
+            error = self.errors.get()
+            self.close()
+            raise RuntimeError("Feature extraction failed:\n" + error)
+        if count == 0:
+            self.done = True
+            self.close()
+            return np.empty(0)
+
+        # process KitNET (on the vectors in shared memory), then hand the slot back to the producer
+        rmses = self.AnomDetector.process_batch(self.slots[self.slot, :int(count)])
+        self.free.release()
+        self.slot = (self.slot + 1) % len(self.slots)
+        self.curPacketIndx += int(count)
+        return rmses
+
+    # the fraction of the input read by the producer so far (see FE.get_progress)
+    def get_progress(self):
+        return self.progress
+
+    # Stops the producer, and frees the ring buffer
+    def close(self):
+        if self.feat_shm is None:
+            return
+        self.stop.set()
+        self.producer.join(timeout=5)
+        if self.producer.is_alive():
+            self.producer.terminate()
+            self.producer.join()
+        del self.slots, self.heads
+        for shm in (self.feat_shm, self.head_shm):
+            shm.close()
+            shm.unlink()
+        self.feat_shm = self.head_shm = None
+        self.done = True
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __del__(self):
+        if getattr(self, 'feat_shm', None) is not None:
+            self.close()
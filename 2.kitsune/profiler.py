@@ -0,0 +1,79 @@
+# Per-stage timing counters for Kitsune (see Kitsune(..., profile=True)).
+# The instrumented code records the latency of each stage it runs (e.g. FE: parse and features, KitNET: FM update,
+# ensemble and output layer) with add(stage, ns). Each stage keeps its count, total and max latency, and a histogram of
+# the latencies in log-linear buckets: each power of two [2^b, 2^(b+1)) ns is split into 4 equal buckets, so the
+# percentiles estimated from it are within 25% of the true ones.
+# The hooks are only reached when a profiler is attached (the instrumented objects check `profiler is not None`), so a
+# run without one costs one attribute check per stage.
+
+SUB = 4 # buckets per power of two
+N_BUCKETS = 64 * SUB
+
+
+# the bucket of a latency of ns nanoseconds
+def bucket(ns):
+    b = ns.bit_length()
+    if b < 3:
+        return b * SUB
+    return min(b * SUB + ((ns >> (b - 3)) & 3), N_BUCKETS - 1)
+
+
+# the upper bound (exclusive) of the latencies in bucket i
+def upper(i):
+    b, sub = divmod(i, SUB)
+    if b < 3:
+        return 2 ** b
+    return (5 + sub) << (b - 3)
+
+
+class stageProfiler:
+    def __init__(self):
+        self.stages = dict() # stage -> [count, total ns, max ns, histogram]
+
+    # records that stage took ns nanoseconds, for n instances (a batch: the histogram gets n latencies of ns/n each)
+    def add(self, stage, ns, n=1):
+        s = self.stages.get(stage)
+        if s is None:
+            s = self.stages[stage] = [0, 0, 0, [0] * N_BUCKETS]
+        s[0] += n
+        s[1] += ns
+        per = ns // n if n > 1 else ns
+        if per > s[2]:
+            s[2] = per
+        s[3][bucket(per)] += n
+
+    def reset(self):
+        self.stages = dict()
+
+    # the latency below which a fraction q of the stage's instances fall (the upper bound of its bucket), in ns
+    @staticmethod
+    def percentile(hist, q):
+        count = sum(hist)
+        if count == 0:
+            return 0
+        target = q * count
+        seen = 0
+        for b, c in enumerate(hist):
+            seen += c
+            if seen >= target:
+                return upper(b)
+        return upper(N_BUCKETS - 1)
+
+    # the stats of every stage: {stage: {count, total_s, mean_us, p50_us, p90_us, p99_us, max_us, histogram}}
+    def stats(self):
+        out = dict()
+        for stage, (count, total, mx, hist) in self.stages.items():
+            out[stage] = {'count': count, 'total_s': total / 1e9, 'mean_us': total / count / 1e3 if count else 0.0,
+                          'p50_us': self.percentile(hist, 0.5) / 1e3, 'p90_us': self.percentile(hist, 0.9) / 1e3,
+                          'p99_us': self.percentile(hist, 0.99) / 1e3, 'max_us': mx / 1e3,
+                          'histogram': dict([(upper(b), c) for b, c in enumerate(hist) if c > 0])} # bucket upper bound (ns) -> count
+        return out
+
+    # a one line summary: the mean (and p99) latency and share of the time of each stage
+    def summary(self):
+        total = sum([s[1] for s in self.stages.values()])
+        parts = []
+        for stage, (count, t, mx, hist) in self.stages.items():
+            parts.append("%s %.1fus (p99 <%.0fus, %.0f%%)" % (stage, t / count / 1e3 if count else 0.0,
+                                                             self.percentile(hist, 0.99) / 1e3, 100.0 * t / total if total else 0.0))
+        return ", ".join(parts)
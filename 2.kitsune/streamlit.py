@@ -1,17 +1,18 @@
 import streamlit as st
-import pandas as pd
-from Kitsune import Kitsune  # Ensure this import is correct
-import matplotlib.pyplot as plt
+import jobs
+import uploads
 import time
-from scipy.stats import norm
-import numpy as np
-from io import BytesIO
 import warnings
-import os
-import tempfile
 
 warnings.filterwarnings("ignore", category=RuntimeWarning)
 
+
+# The job runner, shared by all the sessions (and reruns) of the page
+@st.cache_resource
+def get_runner():
+    return jobs.jobRunner()
+
+
 st.title("Kitsune autoencoder-based framework")
 
 # Info box with brief description
@@ -38,87 +39,65 @@ if uploaded_file:
     with col2:
         AD_grace = st.number_input("AD Grace", value=50000, step=5000, help='Detects anomalies based on more packets. Increases accuracy, but also processing time and potential false negatives.')
 
+    model_file = st.file_uploader("Pre-trained KitNET model (optional)", type=["kitnet", "npz"], help='A model downloaded from a previous analysis. Kitsune then scores every packet, with no FM/AD grace period.')
+
     # Add start button
     start_button = st.button("Start with Config")
 
+    # The analysis runs as a background job (see jobs.py): it goes on when the page is rerun, and its results are cached,
+    # so the same file analyzed with the same parameters again is shown at once
+    runner = get_runner()
+
     if start_button:
-        def main(packet_limit, FM_grace, AD_grace, uploaded_file):
-            try:
-                # Save the uploaded file to a temporary location with the original file name and extension
-                temp_dir = tempfile.mkdtemp()
-                file_path = os.path.join(temp_dir, uploaded_file.name)
-                with open(file_path, 'wb') as temp_file:
-                    temp_file.write(uploaded_file.getbuffer())
-
-                # Process the uploaded file with Kitsune
-                K = Kitsune(file_path, packet_limit)
-
-                RMSEs = []
-                timestamps = []
-                i = 0
-                start_time = time.time()
-
-                # Progress bar
-                total_packets = packet_limit if packet_limit < float('inf') else None
-                progress_bar = st.progress(0)
-
-                packets_processed_text = st.text("Packets processed: 0")
-
-                while i < packet_limit:
-                    rmse = K.proc_next_packet()
-                    if rmse == -1:
-                        break
-                    RMSEs.append(rmse)
-                    timestamps.append(time.time() - start_time)
-                    i += 1
-
-                    # Update packets processed display every 1000 packets
-                    if i % 1000 == 0:
-                        packets_processed_text.text(f"Packets processed: {i}")
-
-                    # Update progress bar
-                    if total_packets is not None:
-                        progress = min(round(i / total_packets, 2), 1.0)  # Ensure progress is within [0.0, 1.0] and round to 2 decimal places
-                        progress_bar.progress(progress)
-
-                # Close the progress bar
-                progress_bar.empty()
-
-                st.success("Kitsune execution completed.")
-
-                # Fit RMSE scores to a log-normal distribution
-                benignSample = np.log(RMSEs[FM_grace + AD_grace + 1:min(packet_limit, len(RMSEs))])
-                if np.std(benignSample) != 0:
-                    logProbs = norm.logsf(np.log(RMSEs), np.mean(benignSample), np.std(benignSample))
-                else:
-                    logProbs = np.zeros_like(RMSEs)  # or some other default value
-
-                # Plot the results
-                fig, ax = plt.subplots(figsize=(10, 6))
-                packet_numbers = range(FM_grace + AD_grace + 1, len(RMSEs))
-                scatter = ax.scatter(packet_numbers, RMSEs[FM_grace + AD_grace + 1:], s=2, c=logProbs[FM_grace + AD_grace + 1:], cmap='RdYlGn')
-                ax.set_yscale("log")
-                ax.set_title("Anomaly Scores from Kitsune's Execution Phase", fontsize=16)
-                ax.set_ylabel("RMSE (log scaled)", fontsize=14)
-                ax.set_xlabel("Packet Number", fontsize=14)
-                plt.colorbar(scatter, ax=ax, label='Log Probability', pad=0.15)
-                plt.tight_layout()
-
-                # Save the figure to a bytes object
-                img_bytes = BytesIO()
-                fig.savefig(img_bytes, format='png')
-                img_bytes.seek(0)
-
-                # Display the plot and add a download button
-                st.pyplot(fig)
-                st.download_button("Download Image", img_bytes, file_name="anomaly_scores.png", mime="image/png")
-
-                # Info box explaining the generated image
-                st.info("""
-                The generated plot visualizes the anomaly scores of network packets processed by the Kitsune algorithm. Each point represents the RMSE (Root Mean Squared Error) of a packet, plotted on a logarithmic scale. The color of the points indicates the log probability of the RMSE scores, with different colors representing varying levels of anomaly likelihood. A lower RMSE suggests normal behavior, while a higher RMSE indicates potential anomalies. Use this plot to identify suspicious patterns and assess network security.
-                """)
-
-            except Exception as e:
-                st.error(f"An error occurred: {e}")
-
-        main(packet_limit, FM_grace, AD_grace, uploaded_file)
+        try:
+            # Spool the uploaded files to disk (see uploads.py): their content hashes also key the job
+            file_path, file_hash = uploads.spool_upload(uploaded_file)
+            model_path, model_hash = uploads.spool_upload(model_file) if model_file is not None else (None, None)
+
+            st.session_state['kitsune_job'] = runner.submit(file_path, packet_limit, FM_grace, AD_grace, model_path,
+                                                            file_hash=file_hash, model_hash=model_hash)
+        except Exception as e:
+            st.error(f"An error occurred: {e}")
+
+    job = st.session_state.get('kitsune_job')
+    if job is not None:
+        # Poll the job: the packets processed out of the limit, or the bytes of the capture read, whichever is further along
+        progress_bar = st.progress(0)
+        packets_processed_text = st.text("Waiting for the job to start...")
+        status = runner.status(job)
+        while status is not None and status['state'] in ('queued', 'running'):
+            if status['state'] == 'running':
+                packets_processed_text.text(f"Packets processed: {status['packets']}, alerts: {status['alerts']}")
+                progress_bar.progress(min(round(status['progress'], 2), 1.0))
+            time.sleep(0.5)
+            status = runner.status(job)
+        progress_bar.empty()
+        packets_processed_text.empty()
+
+        if status is None:
+            del st.session_state['kitsune_job']
+        elif status['state'] == 'error':
+            st.error(f"An error occurred: {status['error']}")
+        else:
+            result = runner.result(job)
+            st.success(f"Kitsune execution completed: {result['packets']} packets processed, {result['alerts']} alerts.")
+
+            # Display the plot and add a download button
+            with open(result['plot'], 'rb') as f:
+                img_bytes = f.read()
+            st.image(img_bytes)
+            st.download_button("Download Image", img_bytes, file_name="anomaly_scores.png", mime="image/png")
+
+            # The plot shows the extremes of each pixel column and all the alerts; the scores of every packet are in a compact
+            # binary file: records of (rmse float32, logprob float32, alert bool), read with KitNET.calibrator.load_scores
+            with open(result['scores'], 'rb') as f:
+                st.download_button("Download Scores", f.read(), file_name="kitsune_scores.bin", mime="application/octet-stream")
+
+            # The trained model, to analyze other captures of the same network without a grace period
+            with open(result['model'], 'rb') as f:
+                st.download_button("Download Model", f.read(), file_name="kitsune_model.kitnet", mime="application/octet-stream")
+
+            # Info box explaining the generated image
+            st.info("""
+            The generated plot visualizes the anomaly scores of network packets processed by the Kitsune algorithm. Each point represents the RMSE (Root Mean Squared Error) of a packet, plotted on a logarithmic scale. The color of the points indicates the log probability of the RMSE scores, with different colors representing varying levels of anomaly likelihood. A lower RMSE suggests normal behavior, while a higher RMSE indicates potential anomalies. Use this plot to identify suspicious patterns and assess network security.
+            """)
@@ -3,6 +3,7 @@ import pandas as pd
 import subprocess
 import os
 import tempfile
+import uploads
 
 # Streamlit title
 st.title("Convert PCAP File with CICFlowMeter")
@@ -16,16 +17,11 @@ CICFlowMeter is a network traffic flow generator and analyzer that creates bidir
 uploaded_file = st.file_uploader("Upload a PCAP file", type=["pcap"])
 
 if uploaded_file is not None:
-    # Read the uploaded file
-    pcap_data = uploaded_file.read()
+    # Spool the uploaded file to disk (see uploads.py)
+    pcap_file_path, _ = uploads.spool_upload(uploaded_file)
     
     # Create a temporary directory to store the temporary files
     with tempfile.TemporaryDirectory() as tempdir:
-        # Write the uploaded file to a temporary file
-        pcap_file_path = os.path.join(tempdir, uploaded_file.name)
-        with open(pcap_file_path, "wb") as f:
-            f.write(pcap_data)
-        
         # Define the output CSV file path
         csv_file_name = os.path.splitext(uploaded_file.name)[0] + "_flows.csv"
         csv_file_path = os.path.join(tempdir, csv_file_name)
@@ -7,6 +7,7 @@ from io import BytesIO
 import folium
 from folium import Marker
 import streamlit.components.v1 as components
+import uploads
 
 # Set Streamlit to wide mode
 #st.set_page_config(layout="wide")
@@ -108,25 +109,27 @@ def retKML(dstip, srcip, external_ip):
 uploaded_file = st.file_uploader("Choose a PCAP file", type="pcap")
 if uploaded_file is not None:
     if st.button('Process PCAP'):
-        f = BytesIO(uploaded_file.getvalue())
-        pcap = dpkt.pcap.Reader(f)
-        external_ip = get_external_ip()
-        
-        # Get the geolocation of the external IP
-        center_lat, center_lon = get_geolocation(external_ip)
-        
-        # Initialize the map centered at the external IP location
-        mymap = folium.Map(location=[center_lat, center_lon], zoom_start=4)
-
-        kmlheader = '<?xml version="1.0" encoding="UTF-8"?>\n<kml xmlns="http://www.opengis.net/kml/2.2">\n<Document>\n' \
-                    '<Style id="transBluePoly">' \
-                    '<LineStyle>' \
-                    '<width>1.5</width>' \
-                    '<color>501400E6</color>' \
-                    '</LineStyle>' \
-                    '</Style>'
-        kmlfooter = '</Document>\n</kml>\n'
-        kmldoc = kmlheader + plotIPs(pcap, external_ip) + kmlfooter
+        # Spool the uploaded file to disk (see uploads.py), and read the packets from there
+        pcap_path, _ = uploads.spool_upload(uploaded_file)
+        with open(pcap_path, 'rb') as f:
+            pcap = dpkt.pcap.Reader(f)
+            external_ip = get_external_ip()
+
+            # Get the geolocation of the external IP
+            center_lat, center_lon = get_geolocation(external_ip)
+
+            # Initialize the map centered at the external IP location
+            mymap = folium.Map(location=[center_lat, center_lon], zoom_start=4)
+
+            kmlheader = '<?xml version="1.0" encoding="UTF-8"?>\n<kml xmlns="http://www.opengis.net/kml/2.2">\n<Document>\n' \
+                        '<Style id="transBluePoly">' \
+                        '<LineStyle>' \
+                        '<width>1.5</width>' \
+                        '<color>501400E6</color>' \
+                        '</LineStyle>' \
+                        '</Style>'
+            kmlfooter = '</Document>\n</kml>\n'
+            kmldoc = kmlheader + plotIPs(pcap, external_ip) + kmlfooter
 
         # Save to a buffer
         kml_buffer = BytesIO()
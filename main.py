@@ -18,8 +18,8 @@ folder_paths = {
     "Rep": os.path.join(script_dir, "6.files")
 }
 
-# Add the directories to the system path to ensure modules can be found
-for path in folder_paths.values():
+# Add the directories to the system path to ensure modules can be found (and the root, for the modules shared by the pages, e.g. uploads.py)
+for path in [script_dir] + list(folder_paths.values()):
     if path not in sys.path:
         sys.path.append(path)
 
@@ -0,0 +1,84 @@
+import hashlib
+import os
+import tempfile
+import threading
+import time
+
+# Upload ingestion shared by the pages: an uploaded file (Streamlit's UploadedFile, or any binary file object) is copied
+# to a spool directory on disk in fixed-size chunks, hashing it as it is copied, and the pages work on the spooled path
+# instead of copies of the upload in memory (read(), getvalue()).
+# The spool is content-addressed: a file is stored as <sha256><extension> (the extension of the uploaded name is kept,
+# as the parsers pick the format by it), so uploading the same capture again (from any session) reuses the spooled file.
+# Files not used for max_age seconds, and partial copies left behind, are removed by cleanup (run by spool_upload at most
+# once per CLEANUP_INTERVAL).
+
+SPOOL_DIR = os.environ.get('UPLOAD_SPOOL_DIR', os.path.join(tempfile.gettempdir(), 'upload-spool'))
+CHUNK = 1 << 20 # bytes copied at a time
+MAX_AGE = 24 * 3600 # seconds a spooled file is kept after its last use
+CLEANUP_INTERVAL = 3600
+
+_spooled = dict() # the uploads spooled by this process: file_id -> (path, digest)
+_last_cleanup = 0.0
+_lock = threading.Lock()
+
+
+# Copies an uploaded file to the spool (unless the same content is there already), and returns (path, digest): the
+# path of the spooled file, and the SHA-256 of its content
+def spool_upload(uploaded_file, spool_dir=None, chunk=CHUNK):
+    global _last_cleanup
+    spool_dir = spool_dir if spool_dir is not None else SPOOL_DIR
+    os.makedirs(spool_dir, exist_ok=True)
+    if time.time() - _last_cleanup > CLEANUP_INTERVAL:
+        _last_cleanup = time.time()
+        cleanup(spool_dir)
+
+    # the same upload (e.g. a rerun of the page) is not copied again
+    file_id = getattr(uploaded_file, 'file_id', None)
+    with _lock:
+        known = _spooled.get((spool_dir, file_id)) if file_id is not None else None
+    if known is not None and os.path.exists(known[0]):
+        os.utime(known[0])
+        return known
+
+    name = getattr(uploaded_file, 'name', None) or ''
+    extension = os.path.splitext(name)[1].lower()
+    fd, part = tempfile.mkstemp(dir=spool_dir, suffix='.part')
+    h = hashlib.sha256()
+    try:
+        uploaded_file.seek(0)
+        with os.fdopen(fd, 'wb') as f:
+            for block in iter(lambda: uploaded_file.read(chunk), b''):
+                h.update(block)
+                f.write(block)
+        digest = h.hexdigest()
+        path = os.path.join(spool_dir, digest + extension)
+        if os.path.exists(path):
+            os.remove(part) # a duplicate
+            os.utime(path)
+        else:
+            os.replace(part, path)
+    except BaseException:
+        if os.path.exists(part):
+            os.remove(part)
+        raise
+    finally:
+        uploaded_file.seek(0)
+    if file_id is not None:
+        with _lock:
+            _spooled[(spool_dir, file_id)] = (path, digest)
+    return path, digest
+
+
+# Removes the spooled files not used for max_age seconds (and the partial copies as old). Returns the number removed
+def cleanup(spool_dir=None, max_age=MAX_AGE):
+    spool_dir = spool_dir if spool_dir is not None else SPOOL_DIR
+    removed = 0
+    now = time.time()
+    for entry in os.scandir(spool_dir):
+        try:
+            if entry.is_file() and now - entry.stat().st_mtime > max_age:
+                os.remove(entry.path)
+                removed += 1
+        except OSError: # removed meanwhile (by another process)
+            pass
+    return removed